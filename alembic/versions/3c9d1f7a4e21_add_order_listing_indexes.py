@@ -0,0 +1,30 @@
+"""Add order listing indexes
+
+Revision ID: 3c9d1f7a4e21
+Revises: 57eb46a3b808
+Create Date: 2026-10-17 09:12:41.518203
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3c9d1f7a4e21'
+down_revision: Union[str, None] = '57eb46a3b808'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_index('ix_order_user_id_timestamp', 'order', ['user_id', 'timestamp', 'id'], unique=False)
+    op.create_index('ix_order_user_id_status_timestamp', 'order', ['user_id', 'status', 'timestamp', 'id'],
+                    unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_order_user_id_status_timestamp', table_name='order')
+    op.drop_index('ix_order_user_id_timestamp', table_name='order')
@@ -0,0 +1,29 @@
+"""Add transaction ticker timestamp index
+
+Revision ID: 8e4b2a6c0d13
+Revises: 3c9d1f7a4e21
+Create Date: 2026-10-17 10:03:18.274915
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '8e4b2a6c0d13'
+down_revision: Union[str, None] = '3c9d1f7a4e21'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_index('ix_transaction_ticker_timestamp', 'transaction',
+                    ['ticker', sa.text('timestamp DESC'), sa.text('id DESC')], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_transaction_ticker_timestamp', table_name='transaction')
@@ -0,0 +1,35 @@
+"""Keep trades of deleted orders
+
+Revision ID: d5a8c3e1f902
+Revises: b7d3e9f25a40
+Create Date: 2026-10-17 15:06:27.104385
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd5a8c3e1f902'
+down_revision: Union[str, None] = 'b7d3e9f25a40'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # сделка остается в истории тикера, когда заявку удаляют вместе с пользователем
+    op.alter_column('transaction', 'order_id', existing_type=sa.UUID(), nullable=True)
+    op.drop_constraint(op.f('transaction_order_id_fkey'), 'transaction', type_='foreignkey')
+    op.create_foreign_key(op.f('transaction_order_id_fkey'), 'transaction', 'order', ['order_id'], ['id'],
+                          ondelete='SET NULL')
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_constraint(op.f('transaction_order_id_fkey'), 'transaction', type_='foreignkey')
+    op.create_foreign_key(op.f('transaction_order_id_fkey'), 'transaction', 'order', ['order_id'], ['id'])
+    op.execute('DELETE FROM "transaction" WHERE order_id IS NULL')
+    op.alter_column('transaction', 'order_id', existing_type=sa.UUID(), nullable=False)
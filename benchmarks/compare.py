@@ -0,0 +1,66 @@
+"""Сравнение двух результатов бенчмарка.
+
+    python -m benchmarks.compare base.json new.json --threshold 0.1
+
+Печатает изменения пропускной способности и перцентилей по каждой операции
+и завершается с кодом 1, если новый прогон хуже базового больше чем на threshold.
+"""
+import argparse
+import json
+import sys
+
+METRICS = (("throughput", 1), ("p50_ms", -1), ("p95_ms", -1), ("p99_ms", -1))
+
+
+def load(path: str) -> dict:
+    with open(path) as file:
+        return json.load(file)
+
+
+def flatten(results: dict, prefix: str = "") -> dict:
+    """Строки с метриками из results, вложенные группы разворачиваются в имена через /"""
+    rows = {}
+    for name, value in results.items():
+        if isinstance(value, dict) and "count" in value:
+            rows[prefix + name] = value
+        elif isinstance(value, dict):
+            rows.update(flatten(value, f"{prefix}{name}/"))
+    return rows
+
+
+def compare(base: dict, new: dict, threshold: float):
+    """(строки отчета, список регрессий); метрика ухудшилась, если изменилась в плохую сторону больше threshold"""
+    lines, regressions = [], []
+    base_rows, new_rows = flatten(base["results"]), flatten(new["results"])
+    for name in base_rows.keys() & new_rows.keys():
+        cells = []
+        for metric, better in METRICS:
+            if metric not in base_rows[name] or metric not in new_rows[name]:
+                continue
+            old, current = base_rows[name][metric], new_rows[name][metric]
+            change = (current - old) / old if old else 0.0
+            cells.append(f"{metric} {old:g} -> {current:g} ({change:+.1%})")
+            if change * better < -threshold:
+                regressions.append(f"{name} {metric}")
+        lines.append(f"{name:<24}" + "  ".join(cells))
+    return sorted(lines), regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Сравнение двух результатов бенчмарка")
+    parser.add_argument("base")
+    parser.add_argument("new")
+    parser.add_argument("--threshold", type=float, default=0.1, help="допустимое ухудшение, доля")
+    args = parser.parse_args()
+    base, new = load(args.base), load(args.new)
+    if base["kind"] != new["kind"]:
+        sys.exit(f"different benchmarks: {base['kind']} and {new['kind']}")
+    lines, regressions = compare(base, new, args.threshold)
+    print("\n".join(lines))
+    if regressions:
+        print("regressions:", ", ".join(regressions))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+"""Бенчмарк конвейера групповой фиксации против commit на каждый запрос.
+
+Много одновременных отправителей пишут в Postgres из src/config/.env то же, что пишет
+выставление сведенной заявки: новую заявку, обновление встречной, сделку и баланс.
+
+    python -m benchmarks.group_commit --submitters 1000 --duration 10
+    python -m benchmarks.group_commit --mode group --window 0.005 --out group.json
+
+direct - каждый отправитель сам пишет свою пачку отдельной транзакцией (OrderORM.write_batch),
+group  - пачки идут через WritePipeline и ждут общей фиксации.
+"""
+import argparse
+import asyncio
+import datetime
+import time
+import uuid
+
+from sqlalchemy import delete, insert
+
+from src.backend.database.database import Instrument, User, engine_pg, session_var
+from src.backend.database.orm import OrderORM
+from src.backend.database.pipeline import Batch, WritePipeline
+from src.backend.server.models import Direction, OrderStatus
+from benchmarks.stats import print_table, save, summarize
+
+MODES = ("direct", "group")
+
+
+def order_row(user_id, ticker, direction, price):
+    return {"id": uuid.uuid4(), "status": OrderStatus.NEW, "direction": direction.value, "qty": 10, "filled": 0,
+            "price": price, "timestamp": datetime.datetime.now(datetime.timezone.utc), "user_id": user_id,
+            "ticker": ticker}
+
+
+class Submitter:
+    """Отправитель со своим пользователем: каждая пачка - заявка, сведенная с его предыдущей заявкой"""
+
+    def __init__(self, user_id, ticker):
+        self.user_id = user_id
+        self.ticker = ticker
+        self.maker = None
+        self.balance = 0
+
+    def batch(self) -> Batch:
+        taker = order_row(self.user_id, self.ticker, Direction.BUY, 100)
+        if self.maker is None:
+            self.maker = order_row(self.user_id, self.ticker, Direction.SELL, 100)
+            return Batch(orders=[self.maker])
+        maker, self.maker = self.maker, taker
+        taker["filled"], taker["status"] = 1, OrderStatus.PARTIALLY_EXECUTED
+        self.balance += 1
+        return Batch(orders=[taker],
+                     updates=[{"id": maker["id"], "filled": 1, "status": OrderStatus.PARTIALLY_EXECUTED}],
+                     trades=[{"id": uuid.uuid4(), "amount": 1, "price": 100, "timestamp": taker["timestamp"],
+                              "ticker": self.ticker, "order_id": taker["id"]}],
+                     balances=[{"user_id": self.user_id, "ticker": self.ticker, "amount": self.balance}])
+
+
+async def run_mode(mode: str, args, submitters) -> dict:
+    latencies, errors = [], [0]
+    pipeline = WritePipeline(args.window, args.max_batch)
+    if mode == "group":
+        pipeline.start(OrderORM.write_batch)
+
+    async def write(batch):
+        if mode == "group":
+            await pipeline.submit(batch)
+        else:
+            await OrderORM.write_batch(batch)
+
+    # первая пачка каждого отправителя ставит встречную заявку и в замер не входит
+    await asyncio.gather(*(write(submitter.batch()) for submitter in submitters))
+
+    async def worker(submitter, deadline):
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            try:
+                await write(submitter.batch())
+            except Exception:
+                errors[0] += 1
+                continue
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker(submitter, started + args.duration) for submitter in submitters))
+    elapsed = time.perf_counter() - started
+    if mode == "group":
+        await pipeline.stop()
+    result = summarize(latencies, elapsed, errors[0])
+    if mode == "group":
+        result["commits"] = pipeline.commits
+        result["batches_per_commit"] = round(pipeline.batches / pipeline.commits, 2) if pipeline.commits else 0.0
+    return result
+
+
+async def run(args) -> dict:
+    # построчный лог SQL исказил бы замеры
+    engine_pg.echo = False
+    ticker = f"GC{uuid.uuid4().hex[:6].upper()}"
+    users = [uuid.uuid4() for _ in range(args.submitters)]
+    async with session_var() as session, session.begin():
+        await session.execute(insert(Instrument).values(ticker=ticker, name=ticker))
+        await session.execute(insert(User), [{"id": user_id, "name": f"bench-gc-{user_id.hex[:8]}",
+                                              "password_hash": "", "api_key": f"bench-gc-{user_id.hex}"}
+                                             for user_id in users])
+    try:
+        results = {}
+        for mode in args.modes:
+            results[mode] = await run_mode(mode, args, [Submitter(user_id, ticker) for user_id in users])
+        return results
+    finally:
+        async with session_var() as session, session.begin():
+            await session.execute(delete(Instrument).where(Instrument.ticker == ticker))
+            await session.execute(delete(User).where(User.id.in_(users)))
+        await engine_pg.dispose()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Групповая фиксация против commit на каждый запрос")
+    parser.add_argument("--mode", choices=MODES + ("both",), default="both")
+    parser.add_argument("--submitters", type=int, default=1000, help="одновременных отправителей")
+    parser.add_argument("--duration", type=float, default=10, help="секунд замера на каждый режим")
+    parser.add_argument("--window", type=float, default=0.002, help="окно сбора пачек, секунд")
+    parser.add_argument("--max-batch", type=int, default=500, help="пачек в одной фиксации")
+    parser.add_argument("--out", default="", help="файл результатов JSON")
+    args = parser.parse_args()
+    args.modes = MODES if args.mode == "both" else (args.mode,)
+    results = asyncio.run(run(args))
+    print_table({mode: row for mode, row in results.items()})
+    for mode, row in results.items():
+        if "commits" in row:
+            print(f"{mode}: {row['commits']} commits, {row['batches_per_commit']} batches per commit")
+    config = {key: value for key, value in vars(args).items() if key not in ("out", "modes")}
+    print("saved", save(args.out, "group_commit", config, results))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,235 @@
+"""Нагрузочный бенчмарк REST API.
+
+Поднимает app в этом же процессе (или бьет по уже запущенному серверу через --url)
+поверх настроенного в src/config/.env Postgres, заводит свои инструменты и трейдеров
+и гоняет смесь запросов из --concurrency клиентов:
+
+    python -m benchmarks.http_load --duration 30 --concurrency 32
+    python -m benchmarks.http_load --mix limit=50,market=5,orderbook=45 --out base.json
+
+Масштабирование по ядрам - тот же прогон против кластера из N воркеров
+(тикеров должно быть заметно больше воркеров, чтобы разбиение было равномерным):
+
+    python -m src.backend.server.cluster --workers 4 --port 8000
+    python -m benchmarks.http_load --url http://127.0.0.1:8000 --tickers 32
+
+По каждой операции печатаются ops/s и p50/p95/p99, результаты сохраняются в JSON;
+два прогона сравнивает python -m benchmarks.compare base.json new.json.
+"""
+import argparse
+import asyncio
+import os
+import random
+import string
+import sys
+import time
+import uuid
+from contextlib import nullcontext
+
+import httpx
+from sqlalchemy import update
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# api.py импортирует models как модуль верхнего уровня, как при запуске python src/backend/server/api.py
+sys.path.insert(0, os.path.join(ROOT, "src", "backend", "server"))
+
+from src.backend.database.database import User, engine_pg, session_var  # noqa: E402
+from src.backend.server.api import app  # noqa: E402
+from src.backend.server.models import UserRole  # noqa: E402
+from benchmarks.stats import print_table, save, summarize  # noqa: E402
+
+MIX = {"register": 1, "deposit": 2, "limit": 40, "market": 8, "cancel": 15, "orderbook": 20, "transactions": 14}
+QUOTE_TICKER = "RUB"
+
+
+def parse_mix(text: str) -> dict:
+    mix = {}
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        if name not in MIX:
+            raise argparse.ArgumentTypeError(f"unknown operation {name!r}, expected one of {', '.join(MIX)}")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+class Trader:
+    __slots__ = ("user_id", "headers", "orders")
+
+    def __init__(self, user_id: str, api_key: str):
+        self.user_id = user_id
+        self.headers = {"Authorization": f"TOKEN {api_key}"}
+        self.orders = []
+
+
+class Load:
+    """Состояние прогона: клиент, созданные инструменты и трейдеры, замеры по операциям."""
+
+    def __init__(self, client: httpx.AsyncClient, args):
+        self.client = client
+        self.args = args
+        self.mix = args.mix
+        self.latencies = {name: [] for name in self.mix}
+        self.errors = {name: 0 for name in self.mix}
+        self.recording = False
+        self.suffix = uuid.uuid4().hex[:8]
+        self.tickers = []
+        self.traders = []
+        self.admin = None
+
+    async def call(self, name: str, method: str, url: str, **kwargs):
+        started = time.perf_counter()
+        try:
+            response = await self.client.request(method, url, **kwargs)
+        except httpx.HTTPError:
+            response = None
+        if self.recording and name in self.latencies:
+            self.latencies[name].append(time.perf_counter() - started)
+            if response is None or response.status_code >= 500:
+                self.errors[name] += 1
+        return response
+
+    async def new_trader(self, name: str) -> Trader:
+        response = await self.call("register", "POST", "/api/v1/public/register", json={"name": name})
+        response.raise_for_status()
+        user = response.json()
+        return Trader(user["id"], user["api_key"])
+
+    async def setup(self):
+        admin = await self.new_trader(f"bench-admin-{self.suffix}")
+        async with session_var() as session:
+            await session.execute(update(User).where(User.id == admin.user_id).values(role=UserRole.ADMIN))
+            await session.commit()
+        self.admin = admin
+        generator = random.Random(self.args.seed)
+        self.tickers = ["".join(generator.choices(string.ascii_uppercase, k=8)) for _ in range(self.args.tickers)]
+        instruments = [{"name": ticker, "ticker": ticker} for ticker in self.tickers]
+        instruments.append({"name": QUOTE_TICKER, "ticker": QUOTE_TICKER})
+        response = await self.client.post("/api/v1/admin/instrument", json=instruments, headers=admin.headers)
+        response.raise_for_status()
+        for number in range(self.args.traders):
+            trader = await self.new_trader(f"bench-{self.suffix}-{number}")
+            await self.fund(trader, QUOTE_TICKER, 10 ** 8)
+            for ticker in self.tickers:
+                await self.fund(trader, ticker, 10 ** 6)
+            self.traders.append(trader)
+
+    async def fund(self, trader: Trader, ticker: str, amount: int):
+        response = await self.call("deposit", "POST", "/api/v1/admin/balance/deposit",
+                                   json={"user_id": trader.user_id, "ticker": ticker, "amount": amount},
+                                   headers=self.admin.headers)
+        response.raise_for_status()
+
+    async def cleanup(self):
+        """Удаляет созданные инструменты (каскадом - заявки, сделки, балансы) и пользователей"""
+        for ticker in self.tickers:
+            await self.client.delete(f"/api/v1/admin/instrument/{ticker}", headers=self.admin.headers)
+        for trader in self.traders + [self.admin]:
+            await self.client.delete(f"/api/v1/admin/user/{trader.user_id}", headers=self.admin.headers)
+
+    async def register(self, generator: random.Random):
+        response = await self.call("register", "POST", "/api/v1/public/register",
+                                   json={"name": f"bench-{self.suffix}-{uuid.uuid4().hex}"})
+        if response is not None and response.status_code == 200:
+            self.traders.append(Trader(response.json()["id"], response.json()["api_key"]))
+
+    async def deposit(self, generator: random.Random):
+        trader = generator.choice(self.traders)
+        ticker = generator.choice(self.tickers + [QUOTE_TICKER])
+        await self.call("deposit", "POST", "/api/v1/admin/balance/deposit",
+                        json={"user_id": trader.user_id, "ticker": ticker, "amount": 1000},
+                        headers=self.admin.headers)
+
+    async def limit(self, generator: random.Random):
+        trader = generator.choice(self.traders)
+        body = {"direction": generator.choice(("BUY", "SELL")), "ticker": generator.choice(self.tickers),
+                "qty": generator.randint(1, 10),
+                "price": self.args.mid + generator.randint(-self.args.spread, self.args.spread)}
+        response = await self.call("limit", "POST", "/api/v1/order", json=body, headers=trader.headers)
+        if response is not None and response.status_code == 200:
+            trader.orders.append(response.json()["order_id"])
+
+    async def market(self, generator: random.Random):
+        trader = generator.choice(self.traders)
+        body = {"direction": generator.choice(("BUY", "SELL")), "ticker": generator.choice(self.tickers),
+                "qty": generator.randint(1, 5)}
+        await self.call("market", "POST", "/api/v1/order", json=body, headers=trader.headers)
+
+    async def cancel(self, generator: random.Random):
+        trader = generator.choice(self.traders)
+        if not trader.orders:
+            return await self.limit(generator)
+        order_id = trader.orders.pop(generator.randrange(len(trader.orders)))
+        await self.call("cancel", "DELETE", f"/api/v1/order/{order_id}", headers=trader.headers)
+
+    async def orderbook(self, generator: random.Random):
+        await self.call("orderbook", "GET", f"/api/v1/public/orderbook/{generator.choice(self.tickers)}")
+
+    async def transactions(self, generator: random.Random):
+        await self.call("transactions", "GET", f"/api/v1/public/transactions/{generator.choice(self.tickers)}",
+                        params={"limit": 50})
+
+    async def worker(self, number: int, deadline: float):
+        generator = random.Random(self.args.seed * 1000003 + number)
+        names, weights = list(self.mix), list(self.mix.values())
+        while time.perf_counter() < deadline:
+            await getattr(self, generator.choices(names, weights)[0])(generator)
+
+
+async def run(args) -> dict:
+    # построчный лог SQL исказил бы замеры
+    engine_pg.echo = False
+    if args.url:
+        client = httpx.AsyncClient(base_url=args.url, timeout=args.timeout)
+        lifespan = nullcontext()
+    else:
+        client = httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench",
+                                   timeout=args.timeout)
+        lifespan = app.router.lifespan_context(app)
+    async with lifespan, client:
+        load = Load(client, args)
+        await load.setup()
+        deadline = time.perf_counter() + args.warmup + args.duration
+
+        async def record():
+            await asyncio.sleep(args.warmup)
+            load.recording = True
+            return time.perf_counter()
+
+        workers = [load.worker(number, deadline) for number in range(args.concurrency)]
+        recorded, *_ = await asyncio.gather(record(), *workers)
+        elapsed = time.perf_counter() - recorded
+        load.recording = False
+        if not args.keep:
+            await load.cleanup()
+    results = {name: summarize(values, elapsed, load.errors[name])
+               for name, values in load.latencies.items() if values}
+    results["total"] = summarize([value for values in load.latencies.values() for value in values], elapsed,
+                                 sum(load.errors.values()))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочный бенчмарк REST API")
+    parser.add_argument("--url", help="адрес запущенного сервера; по умолчанию app поднимается в процессе")
+    parser.add_argument("--duration", type=float, default=30, help="секунд замера")
+    parser.add_argument("--warmup", type=float, default=3, help="секунд прогрева без замера")
+    parser.add_argument("--concurrency", type=int, default=32, help="одновременных клиентов")
+    parser.add_argument("--traders", type=int, default=50)
+    parser.add_argument("--tickers", type=int, default=4)
+    parser.add_argument("--mid", type=int, default=1000, help="центральная цена лимитных заявок")
+    parser.add_argument("--spread", type=int, default=20, help="разброс цен вокруг --mid")
+    parser.add_argument("--mix", type=parse_mix, default=MIX,
+                        help="веса операций, например limit=50,cancel=10,orderbook=40")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--timeout", type=float, default=30)
+    parser.add_argument("--keep", action="store_true", help="не удалять созданные инструменты и пользователей")
+    parser.add_argument("--out", default="", help="файл результатов JSON")
+    args = parser.parse_args()
+    results = asyncio.run(run(args))
+    print_table(results)
+    config = {key: value for key, value in vars(args).items() if key not in ("out",)}
+    print("saved", save(args.out, "http", config, results))
+
+
+if __name__ == "__main__":
+    main()
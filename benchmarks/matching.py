@@ -0,0 +1,186 @@
+"""Микробенчмарк движка сведения без веб-слоя.
+
+Генерирует синтетический поток заявок и отмен (или читает его из файла журнала)
+и прогоняет через MatchingEngine, измеряя задержку каждой операции:
+
+    python -m benchmarks.matching --orders 200000 --tickers 4 --cancel-ratio 0.3 --market-ratio 0.1
+    python -m benchmarks.matching --prices exponential --save flow.bin
+    python -m benchmarks.matching --load /var/lib/exchange/journal-00000003.bin --runs 3
+
+Поток хранится в формате журнала движка, поэтому можно повторить и настоящий сегмент журнала.
+Каждый прогон считает хэш сделок и итоговых книг: при --runs > 1 хэши должны совпасть,
+а --expect проверяет хэш против известного значения.
+"""
+import argparse
+import hashlib
+import random
+import sys
+import time
+import tracemalloc
+from typing import List, Tuple
+from uuid import UUID
+
+from src.backend.engine.journal import CANCEL, DROP, NEW, ORDER_ID, decode_order, encode, encode_order, \
+    read_records
+from src.backend.engine.matching import BookOrder, MatchingEngine
+from src.backend.server.models import Direction
+from benchmarks.stats import print_table, save, summarize
+
+PRICES = ("normal", "uniform", "exponential")
+
+
+def generate(args) -> List[Tuple]:
+    """Поток событий (NEW, тикер, заявка) и (CANCEL, тикер, id); отменяются недавние лимитные заявки"""
+    generator = random.Random(args.seed)
+    tickers = [f"T{number}" for number in range(args.tickers)]
+    users = [UUID(int=generator.getrandbits(128)) for _ in range(args.users)]
+    recent = {ticker: [] for ticker in tickers}
+    events = []
+    while len(events) < args.orders:
+        ticker = generator.choice(tickers)
+        if recent[ticker] and generator.random() < args.cancel_ratio:
+            order_id = recent[ticker].pop(generator.randrange(len(recent[ticker])))
+            events.append((CANCEL, ticker, order_id))
+            continue
+        is_bid = generator.random() < 0.5
+        direction = Direction.BUY if is_bid else Direction.SELL
+        order_id = UUID(int=generator.getrandbits(128))
+        qty = generator.randint(1, args.max_qty)
+        if generator.random() < args.market_ratio:
+            events.append((NEW, ticker, BookOrder(order_id, generator.choice(users), direction, qty)))
+            continue
+        if args.prices == "normal":
+            price = round(generator.gauss(args.mid, args.spread))
+        elif args.prices == "uniform":
+            price = args.mid + generator.randint(-args.spread, args.spread)
+        else:
+            # глубина книги убывает от середины: покупатели ставят ниже, продавцы выше
+            offset = round(generator.expovariate(1 / args.spread))
+            price = args.mid - offset if is_bid else args.mid + offset
+        events.append((NEW, ticker, BookOrder(order_id, generator.choice(users), direction, qty, max(1, price))))
+        recent[ticker].append(order_id)
+        if len(recent[ticker]) > args.cancel_window:
+            recent[ticker].pop(0)
+    return events
+
+
+def dump(events: List[Tuple], path: str):
+    with open(path, "wb") as file:
+        for kind, ticker, payload in events:
+            if kind == NEW:
+                file.write(encode_order(ticker, payload))
+            elif kind == CANCEL:
+                file.write(encode(CANCEL, ticker, ORDER_ID.pack(payload.bytes)))
+            else:
+                file.write(encode(DROP, ticker))
+
+
+def load(path: str) -> List[Tuple]:
+    with open(path, "rb") as file:
+        data = file.read()
+    events = []
+    for _, kind, ticker, payload in read_records(data):
+        if kind == NEW:
+            events.append((NEW, ticker, decode_order(payload)))
+        elif kind == CANCEL:
+            events.append((CANCEL, ticker, UUID(bytes=ORDER_ID.unpack(payload)[0])))
+        elif kind == DROP:
+            events.append((DROP, ticker, None))
+    return events
+
+
+def fresh(order: BookOrder) -> BookOrder:
+    return BookOrder(order.id, order.user_id, order.direction, order.qty, order.price, order.filled)
+
+
+def replay(events: List[Tuple], timed: bool = True):
+    """Один прогон на новом движке: (задержки по операциям, число сделок, хэш, секунды)"""
+    engine = MatchingEngine()
+    latencies = {"limit": [], "market": [], "cancel": []}
+    digest = hashlib.sha256()
+    fills = 0
+    clock = time.perf_counter
+    started = clock()
+    for kind, ticker, payload in events:
+        if kind == NEW:
+            order = fresh(payload)
+            begin = clock()
+            trades = engine.submit(ticker, order)
+            end = clock()
+            if timed:
+                latencies["limit" if order.price is not None else "market"].append(end - begin)
+            fills += len(trades)
+            for trade in trades:
+                digest.update(trade.taker.id.bytes + trade.maker.id.bytes
+                              + trade.price.to_bytes(8, "little", signed=True)
+                              + trade.amount.to_bytes(8, "little", signed=True))
+        elif kind == CANCEL:
+            begin = clock()
+            engine.cancel(ticker, payload)
+            end = clock()
+            if timed:
+                latencies["cancel"].append(end - begin)
+        else:
+            engine.drop(ticker)
+    elapsed = clock() - started
+    for ticker in sorted(engine.books):
+        for order in engine.books[ticker].orders.values():
+            digest.update(order.id.bytes + order.filled.to_bytes(8, "little", signed=True))
+    return latencies, fills, digest.hexdigest(), elapsed
+
+
+def peak_memory(events: List[Tuple]) -> int:
+    """Пиковая память прогона по tracemalloc; отдельный прогон, чтобы не искажать замеры времени"""
+    tracemalloc.start()
+    try:
+        replay(events, timed=False)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Микробенчмарк движка сведения")
+    parser.add_argument("--load", help="поток из файла в формате журнала вместо генерации")
+    parser.add_argument("--save", help="сохранить сгенерированный поток в файл")
+    parser.add_argument("--orders", type=int, default=100000, help="событий в потоке")
+    parser.add_argument("--tickers", type=int, default=4)
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--prices", choices=PRICES, default="normal", help="распределение цен лимитных заявок")
+    parser.add_argument("--mid", type=int, default=10000)
+    parser.add_argument("--spread", type=int, default=50, help="сигма, полуширина или средний отступ цены")
+    parser.add_argument("--max-qty", type=int, default=100)
+    parser.add_argument("--cancel-ratio", type=float, default=0.3, help="доля отмен среди событий")
+    parser.add_argument("--cancel-window", type=int, default=1000, help="из скольких последних заявок выбирать отмену")
+    parser.add_argument("--market-ratio", type=float, default=0.1, help="доля рыночных среди новых заявок")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--runs", type=int, default=1, help="прогонов; хэши сделок должны совпасть")
+    parser.add_argument("--expect", help="ожидаемый хэш сделок")
+    parser.add_argument("--out", default="", help="файл результатов JSON")
+    args = parser.parse_args()
+
+    events = load(args.load) if args.load else generate(args)
+    if args.save:
+        dump(events, args.save)
+    digests = []
+    for _ in range(args.runs):
+        latencies, fills, digest, elapsed = replay(events)
+        digests.append(digest)
+    orders = sum(1 for kind, _, _ in events if kind == NEW)
+    results = {name: summarize(values, elapsed) for name, values in latencies.items() if values}
+    results["total"] = summarize([value for values in latencies.values() for value in values], elapsed)
+    results["run"] = {"events": len(events), "orders": orders, "fills": fills, "seconds": round(elapsed, 4),
+                      "orders_per_sec": round(orders / elapsed, 1), "fills_per_sec": round(fills / elapsed, 1),
+                      "peak_memory_bytes": peak_memory(events), "digest": digest}
+    print_table({name: row for name, row in results.items() if name != "run"}, unit="us")
+    print(" ".join(f"{key}={value}" for key, value in results["run"].items()))
+    config = {key: value for key, value in vars(args).items() if key not in ("out", "save")}
+    print("saved", save(args.out, "matching", config, results))
+    if len(set(digests)) > 1:
+        sys.exit(f"fills differ between runs: {', '.join(digests)}")
+    if args.expect and args.expect != digest:
+        sys.exit(f"fills digest {digest} does not match expected {args.expect}")
+
+
+if __name__ == "__main__":
+    main()
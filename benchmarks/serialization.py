@@ -0,0 +1,182 @@
+"""Бенчмарк сериализации списка заявок: GET /order на 10k строк.
+
+Сравнивает два пути формирования ответа:
+  orm  - ORM-объекты Order -> модели LimitOrder/MarketOrder -> проверка по response_model
+         и JSONResponse, как FastAPI делает для возвращенных моделей;
+  fast - строки из select по колонкам -> dict -> orjson (FastJSONResponse в api.py).
+
+    python -m benchmarks.serialization --orders 10000 --runs 50
+    python -m benchmarks.serialization --db --orders 10000 --runs 20
+
+Без --db строки генерируются в памяти, с --db заводятся временные пользователь и инструмент,
+заявки пишутся в Postgres из src/config/.env и замер включает выборку из базы.
+Перед замером проверяется, что оба пути отдают одинаковый JSON.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+import uuid
+from collections import namedtuple
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import delete, insert, select
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# api.py импортирует models как модуль верхнего уровня, как при запуске python src/backend/server/api.py
+sys.path.insert(0, os.path.join(ROOT, "src", "backend", "server"))
+
+from fastapi.responses import JSONResponse  # noqa: E402
+from fastapi.routing import serialize_response  # noqa: E402
+
+from src.backend.database.database import Instrument, Order, User, engine_pg, session_var  # noqa: E402
+from src.backend.server.api import FastJSONResponse, app, order_json  # noqa: E402
+from src.backend.server.models import Direction, LimitOrder, LimitOrderBody, MarketOrder, MarketOrderBody, \
+    OrderStatus  # noqa: E402
+from benchmarks.stats import print_table, save, summarize  # noqa: E402
+
+COLUMNS = (Order.id, Order.status, Order.user_id, Order.timestamp, Order.direction, Order.ticker, Order.qty,
+           Order.price, Order.filled)
+# Row вне результата запроса не собрать; именованный кортеж дает тот же доступ по атрибутам
+OrderRow = namedtuple("OrderRow", [column.key for column in COLUMNS])
+
+
+def generate(args) -> list:
+    generator = random.Random(args.seed)
+    user_id = uuid.UUID(int=generator.getrandbits(128), version=4)
+    started = datetime(2026, 1, 1, tzinfo=timezone.utc)
+    orders = []
+    for number in range(args.orders):
+        market = generator.random() < args.market_ratio
+        orders.append({"id": uuid.UUID(int=generator.getrandbits(128), version=4),
+                       "status": generator.choice(list(OrderStatus)),
+                       "user_id": user_id,
+                       "timestamp": started + timedelta(milliseconds=number),
+                       "direction": generator.choice(list(Direction)),
+                       "ticker": args.ticker,
+                       "qty": generator.randint(1, 1000),
+                       "price": None if market else generator.randint(1, 100000),
+                       "filled": 0 if market else generator.randint(0, 10)})
+    return orders
+
+
+def response_field():
+    for route in app.routes:
+        if getattr(route, "path", None) == "/api/v1/order" and "GET" in route.methods:
+            return route.response_field
+    raise RuntimeError("GET /api/v1/order route not found")
+
+
+async def orm_body(orders, field) -> bytes:
+    """Прежний путь: модели Pydantic на каждую заявку, затем повторная проверка по response_model"""
+    result = []
+    for order in orders:
+        if order.price is not None:
+            body = LimitOrderBody(direction=order.direction, ticker=order.ticker, qty=order.qty, price=order.price)
+            result.append(LimitOrder(id=order.id, status=order.status, user_id=order.user_id,
+                                     timestamp=order.timestamp, body=body, filled=order.filled))
+        else:
+            body = MarketOrderBody(direction=order.direction, ticker=order.ticker, qty=order.qty)
+            result.append(MarketOrder(id=order.id, status=order.status, user_id=order.user_id,
+                                      timestamp=order.timestamp, body=body))
+    content = await serialize_response(field=field, response_content=result, is_coroutine=True)
+    return JSONResponse(content).body
+
+
+def fast_body(rows) -> bytes:
+    return FastJSONResponse([order_json(row) for row in rows]).body
+
+
+async def measure(args, fetch_orm, fetch_rows) -> dict:
+    field = response_field()
+    orm_orders, rows = await fetch_orm(), await fetch_rows()
+    if json.loads(await orm_body(orm_orders, field)) != json.loads(fast_body(rows)):
+        sys.exit("orm and fast paths produce different JSON")
+    latencies = {"orm": [], "fast": []}
+    sizes = {}
+    clock = time.perf_counter
+    started = clock()
+    for _ in range(args.runs):
+        begin = clock()
+        body = await orm_body(await fetch_orm(), field)
+        latencies["orm"].append(clock() - begin)
+        sizes["orm"] = len(body)
+        begin = clock()
+        body = fast_body(await fetch_rows())
+        latencies["fast"].append(clock() - begin)
+        sizes["fast"] = len(body)
+    elapsed = clock() - started
+    # оба пути шли поочередно, поэтому пропускная способность каждого - по его собственному времени
+    results = {name: summarize(values, sum(values)) for name, values in latencies.items()}
+    results["run"] = {"orders": args.orders, "seconds": round(elapsed, 4),
+                      "speedup_p50": round(results["orm"]["p50_ms"] / results["fast"]["p50_ms"], 2),
+                      "orm_bytes": sizes["orm"], "fast_bytes": sizes["fast"]}
+    return results
+
+
+async def in_memory(args) -> dict:
+    orders = generate(args)
+
+    async def fetch_orm():
+        # ORM-объекты без сессии: те же инструментированные атрибуты, что у session.scalars
+        return [Order(**order) for order in orders]
+
+    async def fetch_rows():
+        return [OrderRow(**order) for order in orders]
+
+    return await measure(args, fetch_orm, fetch_rows)
+
+
+async def in_database(args) -> dict:
+    # построчный лог SQL исказил бы замеры
+    engine_pg.echo = False
+    orders = generate(args)
+    user_id = orders[0]["user_id"]
+    async with session_var() as session, session.begin():
+        await session.execute(insert(User).values(id=user_id, name="bench-serialization", password_hash="",
+                                                  api_key=f"bench-{uuid.uuid4().hex}"))
+        await session.execute(insert(Instrument).values(ticker=args.ticker, name=args.ticker))
+        await session.execute(insert(Order), orders)
+    try:
+        async def fetch_orm():
+            async with session_var() as session:
+                query = await session.execute(select(Order).where(Order.user_id == user_id)
+                                              .order_by(Order.timestamp.desc(), Order.id.desc()))
+            return query.scalars().all()
+
+        async def fetch_rows():
+            async with session_var() as session:
+                query = await session.execute(select(*COLUMNS).where(Order.user_id == user_id)
+                                              .order_by(Order.timestamp.desc(), Order.id.desc()))
+            return query.all()
+
+        return await measure(args, fetch_orm, fetch_rows)
+    finally:
+        async with session_var() as session, session.begin():
+            await session.execute(delete(Instrument).where(Instrument.ticker == args.ticker))
+            await session.execute(delete(User).where(User.id == user_id))
+        await engine_pg.dispose()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк сериализации списка заявок")
+    parser.add_argument("--orders", type=int, default=10000, help="заявок в ответе")
+    parser.add_argument("--runs", type=int, default=30, help="повторов каждого пути")
+    parser.add_argument("--market-ratio", type=float, default=0.1, help="доля рыночных заявок")
+    parser.add_argument("--db", action="store_true", help="писать заявки в Postgres и мерить вместе с выборкой")
+    parser.add_argument("--ticker", default="BENCHSER")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--out", default="", help="файл результатов JSON")
+    args = parser.parse_args()
+    results = asyncio.run(in_database(args) if args.db else in_memory(args))
+    print_table({name: row for name, row in results.items() if name != "run"})
+    print(" ".join(f"{key}={value}" for key, value in results["run"].items()))
+    config = {key: value for key, value in vars(args).items() if key != "out"}
+    print("saved", save(args.out, "serialization", config, results))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,169 @@
+"""Бенчмарк подготовки SQL на стороне Python для горячих запросов ORM.
+
+Для каждого запроса сравниваются два способа получить готовый к отправке SQL:
+  old  - выражение select()/insert() собирается заново на каждый вызов, как раньше в orm.py,
+         и каждый раз вычисляется ключ кэша компиляции;
+  new  - выражения из orm.py, построенные один раз на уровне модуля, или lambda_stmt для запросов
+         с необязательными условиями.
+Оба пути идут через кэш скомпилированных выражений SQLAlchemy так же, как при session.execute,
+поэтому разница - это именно накладные расходы на построение запроса. Строка cold - полная
+компиляция без кэша, во что обходится промах кэша.
+
+    python -m benchmarks.statements --runs 20000
+    python -m benchmarks.statements --db --runs 2000
+
+С --db те же запросы выполняются в Postgres из src/config/.env на временных пользователе и заявках,
+а строка unprep - новые выражения с отключенным кэшем подготовленных выражений asyncpg
+(prepared_statement_cache_size=0), чтобы было видно, сколько стоит подготовка на сервере.
+"""
+import argparse
+import asyncio
+import datetime
+import os
+import sys
+import time
+import uuid
+
+from sqlalchemy import delete, desc, insert, lambda_stmt, select, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# orm.py через цепочку импортов доходит до api.py, который импортирует models как модуль верхнего уровня
+sys.path.insert(0, os.path.join(ROOT, "src", "backend", "server"))
+
+from src.backend.database.database import Instrument, Order, User, engine_pg, session_var, settings  # noqa: E402
+from src.backend.database.orm import get_order_stmt, identify_stmt, known_tickers_stmt  # noqa: E402
+from src.backend.server.models import Direction, OrderStatus  # noqa: E402
+from benchmarks.stats import print_table, save, summarize  # noqa: E402
+
+
+def orders_list_rebuilt(user_id, status, ticker, cursor, limit):
+    stmt = select(Order.id, Order.status, Order.user_id, Order.timestamp, Order.direction, Order.ticker,
+                  Order.qty, Order.price, Order.filled).where(Order.user_id == user_id)
+    if status is not None:
+        stmt = stmt.where(Order.status == status)
+    if ticker is not None:
+        stmt = stmt.where(Order.ticker == ticker)
+    if cursor is not None:
+        stmt = stmt.where(tuple_(Order.timestamp, Order.id) < tuple_(*cursor))
+    return stmt.order_by(desc(Order.timestamp), desc(Order.id)).limit(limit + 1)
+
+
+def orders_list_new(user_id, status, ticker, cursor, limit):
+    """То же, что OrderORM.orders_list"""
+    stmt = lambda_stmt(lambda: select(Order.id, Order.status, Order.user_id, Order.timestamp, Order.direction,
+                                      Order.ticker, Order.qty, Order.price, Order.filled).where(
+        Order.user_id == user_id))
+    if status is not None:
+        stmt += lambda s: s.where(Order.status == status)
+    if ticker is not None:
+        stmt += lambda s: s.where(Order.ticker == ticker)
+    if cursor is not None:
+        cursor_timestamp, cursor_id = cursor
+        stmt += lambda s: s.where(tuple_(Order.timestamp, Order.id) < tuple_(cursor_timestamp, cursor_id))
+    fetch = limit + 1
+    stmt += lambda s: s.order_by(desc(Order.timestamp), desc(Order.id)).limit(fetch)
+    return stmt
+
+
+def queries(user_id, order_id, ticker):
+    """Имя -> (старое построение, новое построение, параметры выполнения)"""
+    cursor = (datetime.datetime.now(datetime.timezone.utc), uuid.uuid4())
+    return {
+        "identify": (lambda: select(User.id, User.role).where(User.api_key == "bench-key"),
+                     lambda: identify_stmt, {"token": "bench-key"}),
+        "get_order": (lambda: select(Order).where(Order.id == order_id), lambda: get_order_stmt,
+                      {"order_id": order_id}),
+        "known": (lambda: select(Instrument.ticker).where(Instrument.ticker.in_({ticker})),
+                  lambda: known_tickers_stmt, {"tickers": [ticker]}),
+        "list": (lambda: orders_list_rebuilt(user_id, None, None, None, 100),
+                 lambda: orders_list_new(user_id, None, None, None, 100), {}),
+        "list_filt": (lambda: orders_list_rebuilt(user_id, OrderStatus.NEW, ticker, cursor, 100),
+                      lambda: orders_list_new(user_id, OrderStatus.NEW, ticker, cursor, 100), {}),
+    }
+
+
+def prepare(stmt, dialect, cache, parameters):
+    # то же, что делает Connection.execute перед отправкой запроса: ключ кэша и компиляция при промахе
+    return stmt._compile_w_cache(dialect=dialect, compiled_cache=cache, column_keys=sorted(parameters),
+                                 for_executemany=False, schema_translate_map=None)
+
+
+def in_memory(args) -> dict:
+    dialect = engine_pg.sync_engine.dialect
+    cache = {}
+    clock = time.perf_counter
+    results = {}
+    for name, (rebuilt, new, parameters) in queries(uuid.uuid4(), uuid.uuid4(), args.ticker).items():
+        for variant, build in (("old", rebuilt), ("new", new)):
+            prepare(build(), dialect, cache, parameters)
+            latencies = []
+            for _ in range(args.runs):
+                begin = clock()
+                prepare(build(), dialect, cache, parameters)
+                latencies.append(clock() - begin)
+            results[f"{name}:{variant}"] = summarize(latencies, sum(latencies))
+        latencies = []
+        for _ in range(max(1, args.runs // 10)):
+            begin = clock()
+            prepare(rebuilt(), dialect, None, parameters)
+            latencies.append(clock() - begin)
+        results[f"{name}:cold"] = summarize(latencies, sum(latencies))
+    return results
+
+
+async def in_database(args) -> dict:
+    # построчный лог SQL исказил бы замеры
+    engine_pg.echo = False
+    user_id, order_id = uuid.uuid4(), uuid.uuid4()
+    now = datetime.datetime.now(datetime.timezone.utc)
+    async with session_var() as session, session.begin():
+        await session.execute(insert(User).values(id=user_id, name="bench-statements", password_hash="",
+                                                  api_key="bench-key"))
+        await session.execute(insert(Instrument).values(ticker=args.ticker, name=args.ticker))
+        await session.execute(insert(Order), [
+            {"id": order_id if number == 0 else uuid.uuid4(), "status": OrderStatus.NEW, "user_id": user_id,
+             "timestamp": now - datetime.timedelta(milliseconds=number), "direction": Direction.BUY,
+             "ticker": args.ticker, "qty": 10, "price": 100, "filled": 0} for number in range(args.orders)])
+    unprepared = create_async_engine(settings.DATABASE_URL_psycopg, pool_size=1,
+                                     connect_args={"prepared_statement_cache_size": 0})
+    sessions = {"old": session_var, "new": session_var,
+                "unprep": async_sessionmaker(unprepared, class_=AsyncSession, expire_on_commit=False)}
+    clock = time.perf_counter
+    results = {}
+    try:
+        for name, (rebuilt, new, parameters) in queries(user_id, order_id, args.ticker).items():
+            for variant, build in (("old", rebuilt), ("new", new), ("unprep", new)):
+                latencies = []
+                async with sessions[variant]() as session:
+                    await session.execute(build(), parameters)
+                    for _ in range(args.runs):
+                        begin = clock()
+                        (await session.execute(build(), parameters)).all()
+                        latencies.append(clock() - begin)
+                results[f"{name}:{variant}"] = summarize(latencies, sum(latencies))
+    finally:
+        async with session_var() as session, session.begin():
+            await session.execute(delete(Instrument).where(Instrument.ticker == args.ticker))
+            await session.execute(delete(User).where(User.id == user_id))
+        await unprepared.dispose()
+        await engine_pg.dispose()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк подготовки SQL горячих запросов")
+    parser.add_argument("--runs", type=int, default=20000, help="вызовов каждого варианта")
+    parser.add_argument("--db", action="store_true", help="выполнять запросы в Postgres")
+    parser.add_argument("--orders", type=int, default=200, help="заявок пользователя для --db")
+    parser.add_argument("--ticker", default="BENCHSQL")
+    parser.add_argument("--out", default="", help="файл результатов JSON")
+    args = parser.parse_args()
+    results = asyncio.run(in_database(args)) if args.db else in_memory(args)
+    print_table(results, unit="us")
+    config = {key: value for key, value in vars(args).items() if key != "out"}
+    print("saved", save(args.out, "statements", config, results))
+
+
+if __name__ == "__main__":
+    main()
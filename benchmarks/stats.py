@@ -0,0 +1,62 @@
+"""Общие для бенчмарков подсчет перцентилей и сохранение результатов."""
+import json
+import os
+import platform
+import subprocess
+import time
+from typing import Dict, List
+
+
+def percentile(values: List[float], q: float) -> float:
+    """Перцентиль q (0..100) по ближайшему рангу; values должны быть отсортированы"""
+    if not values:
+        return 0.0
+    rank = max(0, min(len(values) - 1, round(q / 100 * len(values) + 0.5) - 1))
+    return values[rank]
+
+
+def summarize(latencies: List[float], elapsed: float, errors: int = 0) -> Dict[str, float]:
+    """Пропускная способность и перцентили задержек в миллисекундах"""
+    values = sorted(latencies)
+    return {"count": len(values),
+            "errors": errors,
+            "throughput": round(len(values) / elapsed, 2) if elapsed else 0.0,
+            "p50_ms": round(percentile(values, 50) * 1000, 4),
+            "p95_ms": round(percentile(values, 95) * 1000, 4),
+            "p99_ms": round(percentile(values, 99) * 1000, 4),
+            "max_ms": round(values[-1] * 1000, 4) if values else 0.0}
+
+
+def revision() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+
+def save(path: str, kind: str, config: dict, results: dict) -> str:
+    """Пишет результаты вместе с параметрами запуска; без path - в benchmarks/results"""
+    if not path:
+        directory = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f"{kind}-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    document = {"kind": kind,
+                "meta": {"revision": revision(), "python": platform.python_version(), "machine": platform.machine(),
+                         "started": time.strftime("%Y-%m-%dT%H:%M:%S%z")},
+                "config": config,
+                "results": results}
+    with open(path, "w") as file:
+        json.dump(document, file, indent=2)
+    return path
+
+
+def print_table(results: Dict[str, Dict[str, float]], unit: str = "ms"):
+    """Таблица результатов; unit="us" - задержки в микросекундах для микробенчмарков"""
+    scale = 1000 if unit == "us" else 1
+    print(f"{'operation':<16}{'count':>9}{'errors':>8}{'ops/s':>11}{'p50 ' + unit:>10}{'p95 ' + unit:>10}"
+          f"{'p99 ' + unit:>10}{'max ' + unit:>10}")
+    for name, row in results.items():
+        print(f"{name:<16}{row['count']:>9}{row['errors']:>8}{row['throughput']:>11.1f}"
+              f"{row['p50_ms'] * scale:>10.2f}{row['p95_ms'] * scale:>10.2f}{row['p99_ms'] * scale:>10.2f}"
+              f"{row['max_ms'] * scale:>10.2f}")
@@ -0,0 +1,52 @@
+import time
+from collections import OrderedDict
+from typing import NamedTuple, Optional, Set
+from uuid import UUID
+
+from src.backend.database.database import settings
+from src.backend.server.models import UserRole
+
+
+class Identity(NamedTuple):
+    user_id: UUID
+    role: UserRole
+
+
+class ApiKeyCache:
+    """LRU-кэш api_key -> (user_id, role) с ограниченным временем жизни записей"""
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict = OrderedDict()
+
+    def get(self, api_key: str) -> Optional[Identity]:
+        entry = self._entries.get(api_key)
+        if entry is None or entry[0] < time.monotonic():
+            if entry is not None:
+                del self._entries[api_key]
+            self.misses += 1
+            return None
+        self._entries.move_to_end(api_key)
+        self.hits += 1
+        return entry[1]
+
+    def put(self, api_key: str, identity: Identity) -> Identity:
+        self._entries[api_key] = (time.monotonic() + self.ttl, identity)
+        self._entries.move_to_end(api_key)
+        if len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+        return identity
+
+    def evict(self, api_key: str):
+        self._entries.pop(api_key, None)
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "size": len(self._entries)}
+
+
+api_key_cache = ApiKeyCache(settings.AUTH_CACHE_SIZE, settings.AUTH_CACHE_TTL)
+# тикеры инструментов, существование которых уже проверено в базе; удаление инструмента убирает тикер
+known_instruments: Set[str] = set()
@@ -1,14 +1,16 @@
 import os
+import time
 from uuid import UUID, uuid4
 from datetime import datetime, timezone
 from enum import Enum
-from typing import List, Optional
+from typing import Dict, List, Optional
 
 from sqlalchemy import (
     Column, String, Boolean, Integer, Float,
-    DateTime, ForeignKey, DECIMAL, Enum as SQLEnum, MetaData, TIMESTAMP, func
+    DateTime, ForeignKey, DECIMAL, Enum as SQLEnum, MetaData, TIMESTAMP, func, Index, BigInteger
 )
 from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 from sqlalchemy.orm import relationship, Mapped, mapped_column, DeclarativeBase
 from sqlalchemy.dialects.postgresql import UUID as PG_UUID
 from sqlalchemy.ext.declarative import declarative_base
@@ -25,27 +27,144 @@ class Settings(BaseSettings):
     POSTGRES_PORT: int = os.environ.get("POSTGRES_PORT")
     POSTGRES_HOST: str = os.environ.get("POSTGRES_HOST")
     POSTGRES_DB: str = os.environ.get("POSTGRES_DB")
+    # URL реплик только для чтения через запятую, в том же формате, что DATABASE_URL_psycopg
+    POSTGRES_REPLICA_URLS: str = os.environ.get("POSTGRES_REPLICA_URLS", "")
+    REPLICA_PIN_SECONDS: float = os.environ.get("REPLICA_PIN_SECONDS", 5)
+    ORDER_QUEUE_SIZE: int = os.environ.get("ORDER_QUEUE_SIZE", 1024)
+    ORDER_BATCH_SIZE: int = os.environ.get("ORDER_BATCH_SIZE", 1000)
+    WS_QUEUE_SIZE: int = os.environ.get("WS_QUEUE_SIZE", 256)
+    WS_SLOW_CONSUMER_POLICY: str = os.environ.get("WS_SLOW_CONSUMER_POLICY", "resnapshot")
+    TRADE_TAPE_SIZE: int = os.environ.get("TRADE_TAPE_SIZE", 1000)
+    AUTH_CACHE_SIZE: int = os.environ.get("AUTH_CACHE_SIZE", 100000)
+    AUTH_CACHE_TTL: float = os.environ.get("AUTH_CACHE_TTL", 300)
+    INSTRUMENT_COPY_THRESHOLD: int = os.environ.get("INSTRUMENT_COPY_THRESHOLD", 1000)
+    JOURNAL_DIR: str = os.environ.get("JOURNAL_DIR", "")
+    JOURNAL_FSYNC_INTERVAL: float = os.environ.get("JOURNAL_FSYNC_INTERVAL", 0.005)
+    JOURNAL_SNAPSHOT_INTERVAL: float = os.environ.get("JOURNAL_SNAPSHOT_INTERVAL", 60)
+    CANDLE_HISTORY: int = os.environ.get("CANDLE_HISTORY", 1000)
+    CANDLE_FLUSH_INTERVAL: float = os.environ.get("CANDLE_FLUSH_INTERVAL", 1)
+    BALANCE_FLUSH_INTERVAL: float = os.environ.get("BALANCE_FLUSH_INTERVAL", 0.2)
+    BALANCE_FLUSH_SIZE: int = os.environ.get("BALANCE_FLUSH_SIZE", 1000)
+    GROUP_COMMIT_WINDOW: float = os.environ.get("GROUP_COMMIT_WINDOW", 0.002)
+    GROUP_COMMIT_MAX_BATCH: int = os.environ.get("GROUP_COMMIT_MAX_BATCH", 500)
+    SETTLEMENT_WORKERS: int = os.environ.get("SETTLEMENT_WORKERS", 4)
+    SETTLEMENT_BATCH_SIZE: int = os.environ.get("SETTLEMENT_BATCH_SIZE", 500)
+    SETTLEMENT_MAX_BACKLOG: int = os.environ.get("SETTLEMENT_MAX_BACKLOG", 10000)
+    SETTLEMENT_RETRY_INTERVAL: float = os.environ.get("SETTLEMENT_RETRY_INTERVAL", 0.5)
+    SETTLEMENT_MAX_RETRIES: int = os.environ.get("SETTLEMENT_MAX_RETRIES", 120)
+    # куда пишутся решения, которые база отвергла; у каждого воркера кластера свой подкаталог
+    SETTLEMENT_DEAD_LETTER_DIR: str = os.environ.get("SETTLEMENT_DEAD_LETTER_DIR", "dead-letter")
+    WORKERS: int = os.environ.get("WORKERS", 1)
+    WORKER_ID: int = os.environ.get("WORKER_ID", 0)
+    CLUSTER_SOCKET_DIR: str = os.environ.get("CLUSTER_SOCKET_DIR", "/tmp/exchange-cluster")
+    CLUSTER_CONNECT_TIMEOUT: float = os.environ.get("CLUSTER_CONNECT_TIMEOUT", 30)
+    DEBUG: bool = os.environ.get("DEBUG", False)
+    DB_ECHO: bool = os.environ.get("DB_ECHO", False)
+    DB_POOL_SIZE: int = os.environ.get("DB_POOL_SIZE", 5)
+    DB_MAX_OVERFLOW: int = os.environ.get("DB_MAX_OVERFLOW", 15)
+    DB_POOL_TIMEOUT: float = os.environ.get("DB_POOL_TIMEOUT", 30)
+    # -1 - соединения не пересоздаются по возрасту
+    DB_POOL_RECYCLE: int = os.environ.get("DB_POOL_RECYCLE", -1)
+    DB_POOL_PRE_PING: bool = os.environ.get("DB_POOL_PRE_PING", False)
+    # подготовленных выражений на соединение в кэше asyncpg-диалекта; 0 - без подготовки
+    DB_STATEMENT_CACHE_SIZE: int = os.environ.get("DB_STATEMENT_CACHE_SIZE", 100)
+    SLOW_REQUEST_MS: float = os.environ.get("SLOW_REQUEST_MS", 500)
+    SQL_EXPLAIN_SAMPLE: float = os.environ.get("SQL_EXPLAIN_SAMPLE", 0)
 
     @property
     def DATABASE_URL_psycopg(self):
         return f"postgresql+asyncpg://{self.POSTGRES_USER}:{self.POSTGRES_PASSWORD}" + \
             f"@{self.POSTGRES_HOST}:{self.POSTGRES_PORT}/{self.POSTGRES_DB}"
 
+    @property
+    def DATABASE_REPLICA_URLS(self):
+        return [url.strip() for url in self.POSTGRES_REPLICA_URLS.split(",") if url.strip()]
+
     #model_config = SettingsConfigDict(env_file="src/config/.env", extra="ignore")
 
 
 settings = Settings()
 
-engine_pg = create_async_engine(
-    url=settings.DATABASE_URL_psycopg,
-    echo=True,
-    pool_size=5,
-    max_overflow=15
-)
+class TimedPool(AsyncAdaptedQueuePool):
+    """Пул, замеряющий ожидание соединения (вместе с открытием нового); замеры получают wait_listeners"""
+    wait_listeners = []
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            seconds = time.perf_counter() - started
+            for listener in self.wait_listeners:
+                listener(self.logging_name, seconds)
+
+
+def make_engine(url, name):
+    return create_async_engine(
+        url=url,
+        echo=settings.DB_ECHO,
+        poolclass=TimedPool,
+        pool_logging_name=name,
+        pool_size=settings.DB_POOL_SIZE,
+        max_overflow=settings.DB_MAX_OVERFLOW,
+        pool_timeout=settings.DB_POOL_TIMEOUT,
+        pool_recycle=settings.DB_POOL_RECYCLE,
+        pool_pre_ping=settings.DB_POOL_PRE_PING,
+        connect_args={"prepared_statement_cache_size": settings.DB_STATEMENT_CACHE_SIZE}
+    )
+
+
+engine_pg = make_engine(settings.DATABASE_URL_psycopg, "primary")
 
 session_var = async_sessionmaker(engine_pg, class_=AsyncSession,
                                  expire_on_commit=False)
 
+replica_engines = [make_engine(url, f"replica-{number}")
+                   for number, url in enumerate(settings.DATABASE_REPLICA_URLS)]
+
+
+class ReadRouter:
+    """Сессии для запросов только на чтение.
+
+    Чтения расходятся по репликам по кругу, а без реплик идут на primary.
+    Реплика отстает от primary, поэтому пользователь, который только что записал
+    заявки, pin_seconds после записи читает с primary и сразу видит свои изменения.
+    pin действует в своем процессе: в кластере его рассылает всем воркерам OrderORM.pin.
+    """
+
+    def __init__(self, primary, replicas, pin_seconds: float):
+        self.primary = primary
+        self.replicas = [async_sessionmaker(replica, class_=AsyncSession, expire_on_commit=False)
+                         for replica in replicas]
+        self.pin_seconds = pin_seconds
+        self.pins: Dict[UUID, float] = {}
+        self.routed = {"primary": 0, "pinned": 0, "replica": 0}
+        self._next = 0
+        self._prune_at = 1024
+
+    def pin(self, user_id: UUID):
+        if not self.replicas:
+            return
+        now = time.monotonic()
+        self.pins[user_id] = now + self.pin_seconds
+        if len(self.pins) >= self._prune_at:
+            self.pins = {user: until for user, until in self.pins.items() if until > now}
+            self._prune_at = max(1024, 2 * len(self.pins))
+
+    def __call__(self, user_id: Optional[UUID] = None) -> AsyncSession:
+        if not self.replicas:
+            self.routed["primary"] += 1
+            return self.primary()
+        if user_id is not None and self.pins.get(user_id, 0) > time.monotonic():
+            self.routed["pinned"] += 1
+            return self.primary()
+        self.routed["replica"] += 1
+        self._next = (self._next + 1) % len(self.replicas)
+        return self.replicas[self._next]()
+
+
+read_session_var = ReadRouter(session_var, replica_engines, float(settings.REPLICA_PIN_SECONDS))
+
 metadata = MetaData()
 
 
@@ -103,6 +222,10 @@ class Balance(Base):
 
 class Order(Base):
     __tablename__ = "order"
+    __table_args__ = (
+        Index("ix_order_user_id_timestamp", "user_id", "timestamp", "id"),
+        Index("ix_order_user_id_status_timestamp", "user_id", "status", "timestamp", "id"),
+    )
 
     id: Mapped[UUID] = mapped_column(PG_UUID(as_uuid=True), primary_key=True, default=uuid4)
     status: Mapped[OrderStatus] = mapped_column(SQLEnum(OrderStatus), default=OrderStatus.NEW)
@@ -131,12 +254,30 @@ class Transaction(Base):
     timestamp: Mapped[datetime] = mapped_column(DateTime(timezone=True), server_default=func.now())
 
     ticker: Mapped[str] = mapped_column(String(10), ForeignKey("instrument.ticker", ondelete="CASCADE"))
-    order_id: Mapped[UUID] = mapped_column(PG_UUID(as_uuid=True), ForeignKey("order.id"))
+    # без заявки сделка остается в истории тикера, если заявку удалили вместе с пользователем
+    order_id: Mapped[Optional[UUID]] = mapped_column(PG_UUID(as_uuid=True), ForeignKey("order.id", ondelete="SET NULL"),
+                                                     nullable=True)
 
     instrument: Mapped["Instrument"] = relationship("Instrument", back_populates="transactions")
     order: Mapped["Order"] = relationship("Order", back_populates="transactions")
 
 
+Index("ix_transaction_ticker_timestamp", Transaction.ticker, Transaction.timestamp.desc(), Transaction.id.desc())
+
+
+class Candle(Base):
+    __tablename__ = "candle"
+
+    ticker: Mapped[str] = mapped_column(String(10), ForeignKey("instrument.ticker", ondelete="CASCADE"), primary_key=True)
+    interval: Mapped[str] = mapped_column(String(3), primary_key=True)
+    timestamp: Mapped[datetime] = mapped_column(DateTime(timezone=True), primary_key=True)
+    open: Mapped[int] = mapped_column(Integer)
+    high: Mapped[int] = mapped_column(Integer)
+    low: Mapped[int] = mapped_column(Integer)
+    close: Mapped[int] = mapped_column(Integer)
+    volume: Mapped[int] = mapped_column(BigInteger)
+
+
 class OrderBookLevel(Base):
     __tablename__ = "order_book_level"
 
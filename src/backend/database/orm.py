@@ -1,4 +1,8 @@
+import asyncio
+import base64
+import binascii
 import datetime
+import functools
 import os
 import uuid
 
@@ -6,13 +10,66 @@ import jwt
 import sqlalchemy.exc
 from fastapi import HTTPException
 
-from src.backend.database.database import User, session_var, Instrument, Order, OrderBookLevel, Transaction, Balance, \
-    OrderStatus
-from sqlalchemy import select, bindparam, insert, String, Integer, UUID, and_, update, delete, DECIMAL, desc
+from src.backend.database.database import User, session_var, read_session_var, Instrument, Order, Transaction, Balance, \
+    OrderStatus, settings, Candle
+from sqlalchemy import select, bindparam, insert, String, Integer, UUID, and_, update, delete, DECIMAL, desc, func, \
+    text, table, column, tuple_, literal, lambda_stmt
+from sqlalchemy.dialects.postgresql import insert as pg_insert, aggregate_order_by, ARRAY
 import hashlib
-from src.backend.server.models import NewUser, UserRole, LimitOrderBody, Direction
+import logging
+from src.backend.database.cache import Identity, api_key_cache, known_instruments
+from src.backend.database.pipeline import Batch, writer
+from src.backend.database.settlement import settlement
+from src.backend.engine.actors import actors
+from src.backend.engine.journal import CANCEL, DROP, FORGET, NEW
+from src.backend.engine.ledger import ledger
+from src.backend.engine.matching import BookOrder, engine
+from src.backend.server.candles import INTERVALS
+from src.backend.server.cluster import cluster
+from src.backend.server.metrics import timed
+from src.backend.server.models import NewUser, UserRole, LimitOrderBody
 
+logger = logging.getLogger(__name__)
 
+QUOTE_TICKER = "RUB"
+# воркер-владелец quote резервирует покупки чужих тикеров только после сверки резервов при старте
+quote_reconciled = asyncio.Event()
+
+instrument_import = table("instrument_import", column("ticker"), column("name"))
+
+# Выражения горячих запросов строятся один раз: готовый объект помнит свой ключ кэша,
+# и SQLAlchemy сразу находит скомпилированный SQL, не собирая запрос заново на каждый вызов.
+# Запросы с необязательными условиями собираются через lambda_stmt, который кэширует и построение.
+identify_stmt = select(User.id, User.role).where(User.api_key == bindparam("token"))
+registration_stmt = insert(User).values(name=bindparam("name", type_=String(128)),
+                                        password_hash=bindparam("password_hash", type_=String(64)),
+                                        api_key=bindparam("api_key"), role=bindparam("role"), id=bindparam("id"))
+instruments_stmt = select(Instrument.name, Instrument.ticker)
+known_tickers_stmt = select(Instrument.ticker).where(Instrument.ticker.in_(bindparam("tickers", expanding=True)))
+select_orders_stmt = select(Order).where(Order.id.in_(bindparam("order_ids", expanding=True)))
+get_order_stmt = select(Order).where(Order.id == bindparam("order_id"))
+# проводка может повторить пачку после сбоя, поэтому уже записанные заявки и сделки пропускаются
+insert_orders_stmt = pg_insert(Order).on_conflict_do_nothing(index_elements=[Order.id])
+update_orders_stmt = update(Order)
+insert_trades_stmt = pg_insert(Transaction).on_conflict_do_nothing(index_elements=[Transaction.id])
+upsert_balances_stmt = pg_insert(Balance)
+upsert_balances_stmt = upsert_balances_stmt.on_conflict_do_update(
+    index_elements=[Balance.user_id, Balance.ticker], set_={"amount": upsert_balances_stmt.excluded.amount})
+
+
+def encode_cursor(timestamp, row_id):
+    return base64.urlsafe_b64encode(f"{timestamp.isoformat()}|{row_id}".encode()).decode()
+
+
+def decode_cursor(cursor):
+    try:
+        timestamp, row_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+        return datetime.datetime.fromisoformat(timestamp), uuid.UUID(row_id)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise HTTPException(status_code=422, detail="Invalid cursor")
+
+
+@timed
 class PublicORM:
 
     @classmethod
@@ -20,17 +77,13 @@ class PublicORM:
         token = jwt.encode({"username": user.name}, os.environ.get('SECRET_KEY'),
                            algorithm='HS256')
         uuid_id = uuid.uuid4()
-        stmt = insert(User).values(
-            [{"name": bindparam("name", type_=String(128)),
-              "password_hash": bindparam("password_hash", type_=String(64)),
-              "api_key": token,
-              "role": bindparam("role"),
-              "id": uuid_id}])
         try:
             async with session_var() as session:
-                await session.execute(stmt, {"name": user.name,
-                                             "password_hash": '1',
-                                             "role": UserRole.USER})
+                await session.execute(registration_stmt, {"name": user.name,
+                                                          "password_hash": '1',
+                                                          "api_key": token,
+                                                          "role": UserRole.USER,
+                                                          "id": uuid_id})
                 await session.commit()
             return user, token, uuid_id
         except sqlalchemy.exc.IntegrityError:
@@ -39,50 +92,96 @@ class PublicORM:
     @classmethod
     async def select_instruments(cls):
 
-        stmt = select(Instrument)
-        async with session_var() as session:
-            query = await session.execute(stmt)
-        return query.scalars()
-
-    @classmethod
-    async def select_orderbook(cls, ticker, limit):
-        stmt_bid = select(OrderBookLevel).where(and_(
-            OrderBookLevel.ticker == bindparam("ticker", type_=String()), OrderBookLevel.is_bid is True)).order_by(
-            OrderBookLevel.price).limit(
-            bindparam("limit", type_=Integer()))
-        stmt_ack = select(OrderBookLevel).where(and_(
-            OrderBookLevel.ticker == bindparam("ticker", type_=String()), OrderBookLevel.is_bid is False)).order_by(
-            desc(
-                OrderBookLevel.price)).limit(
-            bindparam("limit", type_=Integer()))
-        async with session_var() as session:
-            query1 = await session.execute(stmt_bid, {"limit": int(limit), "ticker": ticker})
-            query2 = await session.execute(stmt_ack, {"limit": int(limit), "ticker": ticker})
-        return query1.scalars(), query2.scalars()
+        async with read_session_var() as session:
+            query = await session.execute(instruments_stmt)
+        return query.all()
 
     @classmethod
-    async def transactions(cls, ticker, limit):
-        stmt = select(Transaction).where(Transaction.ticker == bindparam("ticker", type_=String())).limit(
-            bindparam("limit", type_=Integer()))
+    async def recent_transactions(cls, limit):
+        """Последние limit сделок по каждому тикеру, от старых к новым"""
+        ranked = select(Transaction.id, Transaction.ticker, Transaction.amount, Transaction.price, Transaction.timestamp,
+                        func.row_number().over(partition_by=Transaction.ticker,
+                                               order_by=(desc(Transaction.timestamp), desc(Transaction.id))
+                                               ).label("rank")).subquery()
+        stmt = select(ranked.c.id, ranked.c.ticker, ranked.c.amount, ranked.c.price, ranked.c.timestamp).where(
+            ranked.c.rank <= bindparam("limit", type_=Integer())).order_by(ranked.c.ticker, ranked.c.timestamp,
+                                                                          ranked.c.id)
         async with session_var() as session:
+            query = await session.execute(stmt, {"limit": int(limit)})
+        return query.mappings().all()
+
+    @classmethod
+    async def transactions(cls, ticker, limit, before=None, after=None, start=None, end=None):
+        """Сделки тикера от новых к старым; after выбирает ближайшие сделки новее курсора"""
+        stmt = lambda_stmt(lambda: select(Transaction.id, Transaction.ticker, Transaction.amount, Transaction.price,
+                                          Transaction.timestamp).where(
+            Transaction.ticker == bindparam("ticker", type_=String())))
+        if start is not None:
+            stmt += lambda s: s.where(Transaction.timestamp >= start)
+        if end is not None:
+            stmt += lambda s: s.where(Transaction.timestamp < end)
+        if before is not None:
+            before_timestamp, before_id = decode_cursor(before)
+            stmt += lambda s: s.where(tuple_(Transaction.timestamp, Transaction.id) < tuple_(before_timestamp,
+                                                                                             before_id))
+        if after is not None:
+            after_timestamp, after_id = decode_cursor(after)
+            stmt += lambda s: s.where(tuple_(Transaction.timestamp, Transaction.id) > tuple_(after_timestamp,
+                                                                                            after_id))
+            stmt += lambda s: s.order_by(Transaction.timestamp, Transaction.id)
+        else:
+            stmt += lambda s: s.order_by(desc(Transaction.timestamp), desc(Transaction.id))
+        stmt += lambda s: s.limit(bindparam("limit", type_=Integer()))
+        async with read_session_var() as session:
             query = await session.execute(stmt, {"limit": int(limit), "ticker": ticker})
-        return query.scalars()
+        rows = query.mappings().all()
+        if after is not None:
+            rows.reverse()
+        return rows
 
 
+@timed
 class BalanceORM:
 
     @classmethod
     async def get_balance(cls, token):
-        stmt = select(User.id).where(User.api_key == bindparam("api_key", type_=String()))
+        identity = await AuthORM.identify(token)
+        balances = {}
+        # счета разных тикеров ведут их воркеры-владельцы
+        for part in await cluster.gather("balances", identity.user_id):
+            balances.update(part)
+        return balances
+
+    @classmethod
+    async def transfer(cls, ticker, amounts):
+        """Проводит изменения счетов ticker, посчитанные воркером-владельцем другого тикера"""
+        ledger.transfer(ticker, amounts)
+        await cls.persist(ticker, amounts)
+
+    @classmethod
+    async def persist(cls, ticker, users):
+        """Делает только что внесенные изменения счетов долговечными: без журнала пишет их в balance
+        через очередь проводки, с журналом - ждет их записи в журнал"""
+        rows = ledger.pending()
+        if rows:
+            await OrderORM.durable(settlement.submit(ticker, Batch(balances=rows), users))
+        else:
+            await ledger.sync()
+
+    @classmethod
+    async def load_balances(cls):
+        stmt = select(Balance.user_id, Balance.ticker, Balance.amount)
         async with session_var() as session:
-            query = await session.execute(stmt, {"api_key": token})
-            user_id = query.scalars().first()
-            stmt = select(Balance).where(Balance.user_id == user_id)
             query = await session.execute(stmt)
-        print(query.scalars())
-        return query.scalars()
+        return query.all()
+
+    @classmethod
+    async def save_balances(cls, balances):
+        """Записывает доступные объемы счетов из ledger через общий конвейер записи"""
+        await writer.submit(Batch(balances=balances))
 
 
+@timed
 class AdminORM:
     @classmethod
     async def do_deposit(cls, user_id, ticker, amount):
@@ -101,172 +200,656 @@ class AdminORM:
                 raise HTTPException(status_code=404, detail="Instrument not found")
             if user is None:
                 raise HTTPException(status_code=404, detail="User not found")
-            stmt = select(Balance).where(
-                and_(Balance.user_id == user_id, Balance.ticker == bindparam("ticker")))
-            query = await session.execute(stmt, {"ticker": ticker})
-            user = query.scalars().first()
-            if user is None:
-                stmt = insert(Balance).values(
-                    [{"user_id": user_id, "ticker": bindparam("ticker"),
-                      "amount": bindparam("amount")}])
-                await session.execute(stmt, {"ticker": ticker, "amount": amount})
-            else:
-                stmt = update(Balance).where(
-                    and_(Balance.user_id == user.user_id, Balance.ticker == user.ticker)).values(
-                    amount=user.amount + amount)
-                await session.execute(stmt)
-            await session.commit()
+            # счет несуществующего инструмента ledger не смог бы сохранить в balance
+            if instrument is None:
+                raise HTTPException(status_code=404, detail="Instrument not found")
+        ledger.deposit(user_id, ticker, amount)
+        await BalanceORM.persist(ticker, {user_id})
+
+    @classmethod
+    async def deposit(cls, user_id, ticker, amount):
+        await actors.call(ticker, cls.do_deposit, user_id, ticker, amount)
+
+    @classmethod
+    async def withdraw(cls, user_id, ticker, amount):
+        await actors.call(ticker, cls.do_withdraw, user_id, ticker, amount)
 
     @classmethod
     async def do_withdraw(cls, user_id, ticker, amount):
-        async with session_var() as session:
-            stmt = select(Balance).where(and_(Balance.user_id == user_id,
-                                              Balance.ticker == bindparam("ticker", type_=String())))
-            query = await session.execute(stmt, {"ticker": ticker})
-            temp = query.scalars().first()
-            if temp and temp.amount - amount >= 0:
-                stmt = update(Balance).where(
-                    and_(Balance.user_id == temp.user_id, Balance.ticker == temp.ticker)).values(
-                    amount=temp.amount - amount)
-                await session.execute(stmt)
-                await session.commit()
-            else:
-                raise HTTPException(status_code=422)
+        if not ledger.withdraw(user_id, ticker, amount):
+            raise HTTPException(status_code=422)
+        await BalanceORM.persist(ticker, {user_id})
 
     @classmethod
-    async def add_instrument(cls, ticker, name):
-        stmt = insert(Instrument).values(
-            [{"ticker": bindparam("ticker", type_=String()), "name": bindparam("name", type_=String())}])
-        async with session_var() as session:
-            try:
-                await session.execute(stmt, {"name": name, "ticker": ticker})
-                await session.commit()
-            except sqlalchemy.exc.IntegrityError:
-                raise HTTPException(status_code=422)
+    async def add_instruments(cls, instruments):
+        """Добавляет инструменты одним запросом, возвращает тикеры, которых еще не было"""
+        rows = [{"ticker": instrument.ticker, "name": instrument.name} for instrument in instruments]
+        if not rows:
+            return set()
+        async with session_var() as session, session.begin():
+            if len(rows) < settings.INSTRUMENT_COPY_THRESHOLD:
+                stmt = pg_insert(Instrument).values(rows).on_conflict_do_nothing(
+                    index_elements=[Instrument.ticker]).returning(Instrument.ticker)
+                query = await session.execute(stmt)
+            else:
+                await session.execute(text("CREATE TEMP TABLE instrument_import "
+                                           "(ticker varchar(64), name varchar(64)) ON COMMIT DROP"))
+                connection = await (await session.connection()).get_raw_connection()
+                await connection.driver_connection.copy_records_to_table(
+                    "instrument_import", records=[(row["ticker"], row["name"]) for row in rows],
+                    columns=["ticker", "name"])
+                stmt = pg_insert(Instrument).from_select(
+                    ["ticker", "name"], select(instrument_import.c.ticker, instrument_import.c.name)).on_conflict_do_nothing(
+                    index_elements=[Instrument.ticker]).returning(Instrument.ticker)
+                query = await session.execute(stmt)
+            return set(query.scalars())
 
     @classmethod
     async def delete_instrument(cls, ticker):
+        await cluster.route(ticker, "drain")
         stmt = delete(Instrument).where(Instrument.ticker == bindparam("ticker", type_=String()))
         async with session_var() as session:
             await session.execute(stmt, {"ticker": ticker})
             await session.commit()
 
+    @classmethod
+    async def forget_instrument(cls, ticker):
+        """Убирает удаленный инструмент из памяти этого воркера; покупкам из его книги возвращается резерв"""
+        known_instruments.discard(ticker)
+        book = engine.books.get(ticker)
+        bids = [order for order in book.orders.values() if order.is_bid] if book is not None else []
+        engine.drop(ticker)
+        ledger.drop(ticker)
+        changes = OrderORM._release(ticker, bids)
+        if OrderORM._quote(changes):
+            await cluster.route(QUOTE_TICKER, "transfer", QUOTE_TICKER, changes)
+        elif changes:
+            await BalanceORM.persist(QUOTE_TICKER, changes)
+
     @classmethod
     async def delete_user(cls, user_id):
         stmt = select(User).where(User.id == user_id)
         async with session_var() as session:
             user = await session.execute(stmt)
-            if temp := user.scalars().one_or_none():
-                stmt = delete(User).where(User.id == user_id)
-                await session.execute(stmt)
-                await session.commit()
+            if (temp := user.scalars().one_or_none()) is None:
+                return None
+        # сначала заявки пользователя уходят из книг, чтобы с ними больше не было новых сделок,
+        # затем дожидаемся проводки уже принятых решений - иначе они придут в базу после удаления
+        await cluster.gather("forget_user", user_id, temp.api_key)
+        await OrderORM.settled(user_id)
+        stmt = delete(User).where(User.id == user_id)
+        async with session_var() as session:
+            await session.execute(stmt)
+            await session.commit()
+        # заявки, выставленные, пока шло удаление, не должны остаться в книгах
+        await cluster.gather("forget_user", user_id, temp.api_key)
         return temp
 
+    @classmethod
+    def forget_user(cls, user_id, api_key):
+        """Убирает удаленного пользователя из памяти этого воркера: ключ, заявки в книгах и счета"""
+        api_key_cache.evict(api_key)
+        engine.drop_user(user_id)
+        ledger.forget(user_id)
+
 
+@timed
 class OrderORM:
 
     @classmethod
     async def create_order(cls, api_key, order_model):
-        stmt = select(User.id).where(User.api_key == bindparam("token", type_=String()))
-        async with session_var() as session:
-            query = await session.execute(stmt, {"token": api_key})
-        user_id = query.scalars().first()
-        stmt = select(Balance.amount).where(and_(Balance.user_id == user_id, Balance.ticker == order_model.ticker))
-        async with session_var() as session:
-            query = await session.execute(stmt)
-        amount = query.scalars().one_or_none()
-        if amount is None and order_model.direction == Direction.BUY:
-            stmt = insert(Balance).values(user_id=user_id, ticker=order_model.ticker, amount=0)
-            async with session_var() as session:
-                await session.execute(stmt)
-        elif amount is None or (amount - order_model.qty < 0 and order_model.direction == Direction.SELL):
+        user_id = (await AuthORM.identify(api_key)).user_id
+        order = BookOrder(uuid.uuid4(), user_id, order_model.direction, order_model.qty,
+                          getattr(order_model, "price", None))
+        if not await cls.known_tickers({order_model.ticker}):
             raise HTTPException(status_code=422)
-        else:
-            stmt = update(Balance).where(and_(Balance.user_id == user_id, Balance.ticker == order_model.ticker)).values(
-                amount=amount - order_model.qty)
-            async with session_var() as session:
-                await session.execute(stmt)
-                await session.commit()
-        order_id = uuid.uuid4()
-        if "price" in order_model.model_fields:
-            stmt = insert(Order).values([{"id": order_id, "status": OrderStatus.NEW,
-                                          "direction": order_model.direction.value,
-                                          "qty": order_model.qty,
-                                          "price": order_model.price,
-                                          "user_id": user_id,
-                                          "ticker": order_model.ticker}])
-            async with session_var() as session:
-                await session.execute(stmt)
-                await session.commit()
-            async with session_var() as session:
-                await session.execute(stmt)
-                await session.commit()
-        else:
-            stmt = insert(Order).values([{"id": order_id, "status": OrderStatus.NEW,
-                                          "direction": order_model.direction.value,
-                                          "qty": order_model.qty,
-                                          "price": None,
-                                          "user_id": user_id,
-                                          "ticker": order_model.ticker}])
+        try:
+            if not await cluster.route(order_model.ticker, "place", order_model.ticker, [order]):
+                raise HTTPException(status_code=422)
+        finally:
+            await OrderORM.pin(user_id)
+        return order.id
+
+    @classmethod
+    async def place(cls, ticker, orders):
+        """Выставляет заявки на воркере-владельце тикера, возвращает id принятых.
+
+        Заявки и сделки проводит очередь settlement, а ответ ждет только durable.
+        """
+        await settlement.admit()
+        budgets = None
+        if not cluster.local(QUOTE_TICKER):
+            # покупки резервируют quote у его воркера-владельца до сведения
+            budgets = await cluster.route(QUOTE_TICKER, "reserve", orders[0].user_id, cls._bids(orders))
+            orders = [order for order in orders if not order.is_bid or order.id in budgets]
+        # резерв уже взят: отмена запроса не должна оборвать решение и расчеты по нему
+        return await asyncio.shield(cls._decide(ticker, orders, budgets))
+
+    @classmethod
+    async def _decide(cls, ticker, orders, budgets):
+        try:
+            accepted, settled, transfers = await actors.call(ticker, cls.place_orders, ticker, orders, budgets)
+        except Exception:
+            # актор не дошел до решения - резерв покупок у владельца quote возвращается целиком
+            if budgets:
+                await cluster.route(QUOTE_TICKER, "release", orders[0].user_id, QUOTE_TICKER, sum(budgets.values()))
+            raise
+        try:
+            if accepted:
+                await cls.durable(settled)
+        except HTTPException:
+            # база отвергла решение: принятые заявки снимаются с книги, а их резерв возвращается
+            _, _, released = await actors.call(ticker, cls.cancel_orders, ticker, list(accepted), False)
+            if released:
+                await cluster.route(QUOTE_TICKER, "transfer", QUOTE_TICKER, released)
+            raise
+        finally:
+            # книга уже изменилась, поэтому расчеты по счетам quote проводятся и при ошибке журнала
+            if transfers:
+                await cluster.route(QUOTE_TICKER, "transfer", QUOTE_TICKER, transfers)
+        return accepted
+
+    @classmethod
+    async def reserve_quote(cls, user_id, bids):
+        """Резервирует quote покупок для воркера-владельца их тикера"""
+        await quote_reconciled.wait()
+        return ledger.reserve_orders(user_id, QUOTE_TICKER, bids)
+
+    @classmethod
+    def resting_bids(cls):
+        """Сколько quote держат лежащие в своих книгах покупки, по пользователям"""
+        reserved = {}
+        for book in engine.books.values():
+            for order in book.orders.values():
+                if order.is_bid:
+                    reserved[order.user_id] = reserved.get(order.user_id, 0) + order.remaining * order.price
+        return reserved
+
+    @classmethod
+    async def reconcile_quote(cls):
+        """Сверяет резерв quote с покупками во всех книгах кластера.
+
+        Резерв берется у владельца quote до того, как заявка попадет в книгу другого воркера, и падение
+        между ними оставляет резерв без заявки. Поэтому при старте владелец quote возвращает такой резерв
+        в доступное и только потом начинает резервировать новые покупки.
+        """
+        expected = {}
+        for reserved in await cluster.gather("resting_bids"):
+            for user_id, amount in reserved.items():
+                expected[user_id] = expected.get(user_id, 0) + amount
+        fixed = ledger.reconcile(QUOTE_TICKER, expected)
+        if fixed:
+            logger.warning("reconciled %d %s reservations with resting bids", fixed, QUOTE_TICKER)
+            await ledger.sync()
+        quote_reconciled.set()
+
+    @classmethod
+    async def pin(cls, user_id):
+        """Пользователь только что записал заявки: пока действует pin, его читают с primary.
+
+        Следующий запрос может попасть на любой воркер кластера, поэтому pin ставится на всех
+        до ответа на запись.
+        """
+        if read_session_var.replicas:
+            await cluster.gather("pin", user_id)
+
+    @classmethod
+    async def durable(cls, settled):
+        """Ждет, пока решение актора переживет сбой: с журналом - его записей на диске,
+        без журнала - его проводки в базу, с которой после рестарта сойдутся и балансы.
+
+        Все, что база может отвергнуть, проверяется до сведения: пользователь - в identify, тикер -
+        в known_tickers, объем и цена - в моделях запроса. Если база все же отвергла решение
+        (например, пользователя удалили, пока шла заявка), это 422.
+        """
+        if engine.journal is not None:
+            await engine.sync()
+            return
+        try:
+            # проводка общая для всей пачки: отмена ожидающего запроса не должна ее отменять
+            await asyncio.shield(settled)
+        except (sqlalchemy.exc.IntegrityError, sqlalchemy.exc.DataError):
+            raise HTTPException(status_code=422)
+
+    @classmethod
+    def _bids(cls, orders):
+        """Объемы quote для резерва покупок; None - рыночная покупка"""
+        return [(order.id, None if order.price is None else order.qty * order.price)
+                for order in orders if order.is_bid]
+
+    @classmethod
+    async def settled(cls, user_id):
+        """Ждет, пока принятые изменения заявок пользователя окажутся в базе на всех воркерах"""
+        await cluster.gather("settled", user_id)
+
+    @classmethod
+    async def place_orders(cls, ticker, orders, budgets):
+        """Выставляет заявки одного пользователя по одному тикеру.
+
+        budgets - зарезервированный воркером-владельцем quote объем покупок по id заявок; если quote
+        свой (budgets=None), покупки резервируются здесь же, в одном решении с самими заявками.
+        Рыночная покупка исполняется не больше, чем позволяет ее резерв, неистраченный резерв возвращается.
+        Сведение и балансы решаются в памяти, а заявки и сделки уходят в очередь проводки settlement:
+        возвращаются id принятых заявок, future проводки и изменения счетов quote, если ими владеет
+        другой воркер кластера. Тикер должен быть заранее проверен через known_tickers.
+        """
+        now = datetime.datetime.now(datetime.timezone.utc)
+        if budgets is None:
+            budgets = ledger.reserve_orders(orders[0].user_id, QUOTE_TICKER, cls._bids(orders)) if orders else {}
+            orders = [order for order in orders if not order.is_bid or order.id in budgets]
+        accepted = cls._reserve(ticker, orders)
+        if not accepted:
+            return set(), None, {}
+        rows = [{"id": order.id, "status": OrderStatus.NEW, "direction": order.direction.value, "qty": order.qty,
+                 "filled": 0, "price": order.price, "timestamp": now, "user_id": order.user_id, "ticker": ticker}
+                for order in accepted]
+        fills = []
+        unspent = {}
+        for order in accepted:
+            if not order.is_bid or order.price is not None:
+                fills.extend(engine.submit(ticker, order))
+                continue
+            # в журнал и книгу рыночная покупка уходит с объемом, который она может оплатить,
+            # поэтому повтор журнала сводит ее так же
+            budget, qty = budgets[order.id], order.qty
+            order.qty = engine.book(ticker).buyable(qty, budget)
+            own = engine.submit(ticker, order) if order.qty else []
+            order.qty = qty
+            fills.extend(own)
+            spent = sum(fill.amount * fill.price for fill in own)
+            unspent[order.user_id] = unspent.get(order.user_id, 0) + budget - spent
+        market = [order for order in accepted if order.price is None]
+        updates, trades = cls._settle(ticker, fills, market, now)
+        changes = ledger.settle(ticker, fills)
+        for user_id, amount in unspent.items():
+            change = changes.setdefault(user_id, [0, 0])
+            change[0] += amount
+            change[1] -= amount
+        for order in market:
+            if not order.is_bid and order.remaining:
+                ledger.release(order.user_id, ticker, order.remaining)
+        transfers = cls._quote(changes)
+        users = {order.user_id for order in accepted}
+        users.update(fill.maker.user_id for fill in fills)
+        settled = settlement.submit(ticker, Batch(orders=rows, updates=updates, trades=trades,
+                                                  balances=ledger.pending()), users)
+        if trades:
+            settled.add_done_callback(functools.partial(cls._publish, ticker, trades))
+        return {order.id for order in accepted}, settled, transfers
+
+    @classmethod
+    def _publish(cls, ticker, trades, settled):
+        """Лента и свечи узнают о сделках только после их записи в базу"""
+        if not settled.cancelled() and settled.exception() is None:
+            engine.publish_trades(ticker, trades)
+
+    @classmethod
+    def _quote(cls, changes):
+        """Проводит изменения счетов quote здесь или возвращает их для воркера-владельца quote"""
+        if not changes or not cluster.local(QUOTE_TICKER):
+            return changes
+        ledger.transfer(QUOTE_TICKER, changes)
+        return {}
+
+    @classmethod
+    def _reserve(cls, ticker, orders):
+        """Резервирует объем заявок на продажу; заявки, на которые не хватило баланса, отбрасываются"""
+        sells = [order for order in orders if not order.is_bid]
+        if not sells:
+            return orders
+        user_id = sells[0].user_id
+        if ledger.reserve(user_id, ticker, sum(order.qty for order in sells)):
+            return orders
+        reserved = ledger.reserve_orders(user_id, ticker, [(order.id, order.qty) for order in sells])
+        return [order for order in orders if order.is_bid or order.id in reserved]
+
+    @classmethod
+    def _status(cls, order):
+        if order.filled == order.qty:
+            return OrderStatus.EXECUTED
+        if order.filled:
+            return OrderStatus.PARTIALLY_EXECUTED
+        if order.price is None:
+            return OrderStatus.CANCELLED
+        return OrderStatus.NEW
+
+    @classmethod
+    def _settle(cls, ticker, fills, market, timestamp):
+        """Обновления затронутых заявок и строки сделок; балансы проводит ledger"""
+        orders = {order.id: order for order in market}
+        for fill in fills:
+            orders[fill.taker.id] = fill.taker
+            orders[fill.maker.id] = fill.maker
+        updates = [{"id": order.id, "filled": order.filled, "status": cls._status(order)}
+                   for order in orders.values()]
+        if not fills:
+            return updates, []
+        # сделки одной пачки разводим по микросекундам, чтобы порядок (timestamp, id)
+        # в базе и курсорах совпадал с порядком исполнения в ленте
+        # id сделки выводится из пары заявок, чтобы повтор решения из журнала не задвоил ее
+        trades = [{"id": uuid.uuid5(fill.taker.id, fill.maker.id.hex),
+                   "amount": fill.amount,
+                   "price": fill.price,
+                   "timestamp": timestamp + datetime.timedelta(microseconds=number),
+                   "ticker": ticker,
+                   "order_id": fill.taker.id} for number, fill in enumerate(fills)]
+        return updates, trades
+
+    @classmethod
+    async def cancel_order(cls, order):
+        try:
+            if not await cluster.route(order.ticker, "cancel", order.ticker, [order.id]):
+                raise HTTPException(status_code=422, detail="Order is not active")
+        finally:
+            await cls.pin(order.user_id)
+
+    @classmethod
+    async def cancel(cls, ticker, order_ids):
+        """Снимает заявки на воркере-владельце тикера, возвращает id снятых; базы, как и place, не ждет"""
+        cancelled, settled, transfers = await actors.call(ticker, cls.cancel_orders, ticker, order_ids)
+        try:
+            if cancelled:
+                await cls.durable(settled)
+        finally:
+            if transfers:
+                await cluster.route(QUOTE_TICKER, "transfer", QUOTE_TICKER, transfers)
+        return cancelled
+
+    @classmethod
+    async def cancel_orders(cls, ticker, order_ids, recorded=True):
+        """Снимает активные заявки одного тикера, возвращает id снятых, future проводки
+        и возврат резерва покупок в quote, если им владеет другой воркер.
+
+        Отмена идет в базу через ту же очередь проводки, что и сделки тикера, поэтому
+        не может обогнать уже решенное исполнение этих заявок. recorded=False - заявок,
+        отвергнутых базой, в ней нет, и проводятся только балансы.
+        """
+        active = [book_order for book_order in (engine.cancel(ticker, order_id) for order_id in order_ids)
+                  if book_order is not None]
+        if not active:
+            return set(), None, {}
+        transfers = cls._quote(cls._release(ticker, active))
+        updates = [{"id": order.id, "status": OrderStatus.CANCELLED} for order in active] if recorded else []
+        settled = settlement.submit(ticker, Batch(updates=updates, balances=ledger.pending()),
+                                    {order.user_id for order in active})
+        return {order.id for order in active}, settled, transfers
+
+    @classmethod
+    def _release(cls, ticker, orders):
+        """Возвращает резерв снятых с книги заявок: продажи - здесь, покупки - изменениями счетов quote"""
+        changes = {}
+        for order in orders:
+            if not order.is_bid:
+                ledger.release(order.user_id, ticker, order.remaining)
+                continue
+            amount = order.remaining * order.price
+            change = changes.setdefault(order.user_id, [0, 0])
+            change[0] += amount
+            change[1] -= amount
+        return changes
+
+    @classmethod
+    async def write_batch(cls, batch):
+        """Пишет пачку конвейера записи одной транзакцией"""
+        async with session_var() as session, session.begin():
+            if batch.orders:
+                await session.execute(insert_orders_stmt, batch.orders)
+            # заявки, отличающиеся набором обновляемых колонок, обновляются отдельными executemany
+            groups = {}
+            for row in batch.updates:
+                groups.setdefault(tuple(sorted(row)), []).append(row)
+            for rows in groups.values():
+                await session.execute(update_orders_stmt, rows)
+            if batch.trades:
+                await session.execute(insert_trades_stmt, batch.trades)
+            if batch.balances:
+                await session.execute(upsert_balances_stmt, batch.balances)
+
+    @classmethod
+    async def known_tickers(cls, tickers):
+        """Тикеры из tickers, для которых есть инструмент; в базу идем только за еще не виденными"""
+        unknown = set(tickers) - known_instruments
+        if unknown:
             async with session_var() as session:
-                await session.execute(stmt)
-                await session.commit()
+                query = await session.execute(known_tickers_stmt, {"tickers": list(unknown)})
+            known_instruments.update(query.scalars())
+        return set(tickers) & known_instruments
 
-        return order_id
+    @classmethod
+    async def select_orders(cls, order_ids, user_id):
+        await cls.settled(user_id)
+        async with session_var() as session:
+            query = await session.execute(select_orders_stmt, {"order_ids": list(order_ids)})
+        return query.scalars().all()
 
     @classmethod
-    async def cancel_order(cls, order_id):
-        stmt = select(Order).where(Order.id == order_id)
+    async def active_orders(cls):
+        """Активные лимитные заявки всех тикеров в порядке поступления, как пары (тикер, заявка книги)"""
+        stmt = select(Order).where(and_(Order.status.in_([OrderStatus.NEW, OrderStatus.PARTIALLY_EXECUTED]),
+                                        Order.price.is_not(None))).order_by(Order.timestamp)
         async with session_var() as session:
             query = await session.execute(stmt)
+        return [(order.ticker, BookOrder(order.id, order.user_id, order.direction, order.qty, order.price,
+                                         order.filled)) for order in query.scalars()]
+
+    @classmethod
+    def load_books(cls, active):
+        """Восстанавливает книги заявок своих тикеров из активных лимитных заявок"""
+        for ticker, order in active:
+            if cluster.local(ticker):
+                engine.book(ticker).rest(order)
+
+    @classmethod
+    def recover(cls, tail):
+        """Заново ставит в очередь проводки решения из хвоста журнала, которые могли не дойти до базы.
+
+        Снимок журнала пишется только после проводки покрытых им решений, поэтому непроведенные
+        решения есть в хвосте, а уже проведенные повторяются без вреда: вставки пропускают записанные id,
+        а обновления пишут состояние заявок после всего хвоста. Время у восстановленных заявок
+        и сделок - время восстановления, а объем рыночной покупки - тот, что она могла оплатить.
+        """
+        now = datetime.datetime.now(datetime.timezone.utc)
+        decisions = {}
+        for kind, ticker, subject, fills in tail:
+            if kind == DROP:
+                decisions.pop(ticker, None)
+                continue
+            if kind == FORGET:
+                for orders, _, _, _ in decisions.values():
+                    for order_id in [order_id for order_id, order in orders.items() if order.user_id == subject]:
+                        del orders[order_id]
+                continue
+            if subject is None:
+                continue
+            orders, touched, cancelled, ticker_fills = decisions.setdefault(ticker, ({}, {}, set(), []))
+            if kind == NEW:
+                orders[subject.id] = subject
+                touched.update((fill.maker.id, fill.maker) for fill in fills)
+                if subject.price is not None:
+                    touched[subject.id] = subject
+                ticker_fills.extend(fills)
+            elif kind == CANCEL:
+                touched[subject.id] = subject
+                cancelled.add(subject.id)
+        for ticker, (orders, touched, cancelled, fills) in decisions.items():
+            # рыночная заявка решается целиком при поступлении, поэтому ее строка сразу итоговая
+            rows = [{"id": order.id, "status": OrderStatus.CANCELLED if order.id in cancelled else cls._status(order),
+                     "direction": order.direction.value, "qty": order.qty, "filled": order.filled,
+                     "price": order.price, "timestamp": now, "user_id": order.user_id, "ticker": ticker}
+                    for order in orders.values()]
+            updates = [{"id": order.id, "filled": order.filled,
+                        "status": OrderStatus.CANCELLED if order.id in cancelled else cls._status(order)}
+                       for order in touched.values()]
+            _, trades = cls._settle(ticker, [fill for fill in fills if fill.taker.id in orders], (), now)
+            users = {order.user_id for order in orders.values()}
+            users.update(order.user_id for order in touched.values())
+            settlement.submit(ticker, Batch(orders=rows, updates=updates, trades=trades), users)
+
+    @classmethod
+    async def orders_list(cls, user_id, status=None, ticker=None, cursor=None, limit=100):
+        """Страница заявок пользователя от новых к старым и курсор следующей страницы"""
+        stmt = lambda_stmt(lambda: select(Order.id, Order.status, Order.user_id, Order.timestamp, Order.direction,
+                                          Order.ticker, Order.qty, Order.price, Order.filled).where(
+            Order.user_id == user_id))
+        if status is not None:
+            stmt += lambda s: s.where(Order.status == status)
+        if ticker is not None:
+            stmt += lambda s: s.where(Order.ticker == ticker)
+        if cursor is not None:
+            cursor_timestamp, cursor_id = decode_cursor(cursor)
+            stmt += lambda s: s.where(tuple_(Order.timestamp, Order.id) < tuple_(cursor_timestamp, cursor_id))
+        fetch = limit + 1
+        stmt += lambda s: s.order_by(desc(Order.timestamp), desc(Order.id)).limit(fetch)
+        await cls.settled(user_id)
+        async with read_session_var(user_id) as session:
+            query = await session.execute(stmt)
+        orders = query.all()
+        if len(orders) <= limit:
+            return orders, None
+        orders = orders[:limit]
+        return orders, encode_cursor(orders[-1].timestamp, orders[-1].id)
+
+    @classmethod
+    async def get_order(cls, order_id, user_id=None, fresh=False):
+        """Заявка по id; fresh читает с primary - для отмены, которой нужна актуальная заявка.
+
+        Свежие заявки пользователя могут еще ждать проводки, поэтому сначала дожидаемся ее.
+        Чужая заявка для пользователя не существует: 404, как и для несуществующей.
+        """
+        if user_id is not None:
+            await cls.settled(user_id)
+        async with (session_var() if fresh else read_session_var(user_id)) as session:
+            query = await session.execute(get_order_stmt, {"order_id": order_id})
         order = query.scalars().one_or_none()
-        if order is None:
-            raise HTTPException(status_code=404)
+        if order is None or (user_id is not None and order.user_id != user_id):
+            raise HTTPException(status_code=404, detail="Order not found")
+        return order
+
+
+@timed
+class CandleORM:
 
-        stmt = delete(Order).where(Order.id == order_id)
+    @classmethod
+    async def backfill(cls, since=None):
+        """Пересчитывает свечи всех интервалов из сделок начиная с since одним GROUP BY на интервал"""
+        total = 0
+        async with session_var() as session, session.begin():
+            for interval, step in INTERVALS.items():
+                bucket = func.floor(func.extract("epoch", Transaction.timestamp) / step) * step
+                ordered = aggregate_order_by(Transaction.price, Transaction.timestamp, Transaction.id)
+                prices = func.array_agg(ordered, type_=ARRAY(Integer))
+                latest = aggregate_order_by(Transaction.price, desc(Transaction.timestamp), desc(Transaction.id))
+                stmt = select(Transaction.ticker, literal(interval), func.to_timestamp(bucket), prices[1],
+                              func.max(Transaction.price), func.min(Transaction.price),
+                              func.array_agg(latest, type_=ARRAY(Integer))[1],
+                              func.sum(Transaction.amount)).group_by(Transaction.ticker, bucket)
+                if since is not None:
+                    stmt = stmt.where(Transaction.timestamp >= since)
+                upsert = pg_insert(Candle).from_select(
+                    ["ticker", "interval", "timestamp", "open", "high", "low", "close", "volume"], stmt)
+                upsert = upsert.on_conflict_do_update(
+                    index_elements=[Candle.ticker, Candle.interval, Candle.timestamp],
+                    set_={name: upsert.excluded[name] for name in ("open", "high", "low", "close", "volume")})
+                total += (await session.execute(upsert)).rowcount
+        return total
+
+    @classmethod
+    async def backfill_start(cls):
+        """С какого момента пересчитывать свечи при старте, чтобы покрыть несохраненные бары; None - с начала"""
         async with session_var() as session:
-            await session.execute(stmt)
-            await session.commit()
-        if order.direction == Direction.SELL:
-            stmt = select(Balance.amount).where(and_(Balance.user_id == order.user_id, Balance.ticker == order.ticker))
-            async with session_var() as session:
-                query = await session.execute(stmt)
-            amount = query.scalars().first()
-            stmt = update(Balance).where(and_(Balance.user_id == order.user_id, Balance.ticker == order.ticker)).values(
-                amount=amount + order.qty)
-            async with session_var() as session:
-                await session.execute(stmt)
-                await session.commit()
+            last = (await session.execute(select(func.max(Candle.timestamp)))).scalar()
+        if last is None:
+            return None
+        day = INTERVALS["1d"]
+        return datetime.datetime.fromtimestamp((int(last.timestamp()) // day - 1) * day, datetime.timezone.utc)
 
     @classmethod
-    async def orders_list(cls):
-        stmt = select(Order)
+    async def recent_candles(cls, limit):
+        """Последние limit свечей каждого тикера и интервала, от старых к новым"""
+        ranked = select(Candle, func.row_number().over(partition_by=(Candle.ticker, Candle.interval),
+                                                       order_by=desc(Candle.timestamp)).label("rank")).subquery()
+        stmt = select(ranked.c.ticker, ranked.c.interval, ranked.c.timestamp, ranked.c.open, ranked.c.high,
+                      ranked.c.low, ranked.c.close, ranked.c.volume).where(
+            ranked.c.rank <= bindparam("limit", type_=Integer())).order_by(ranked.c.ticker, ranked.c.interval,
+                                                                          ranked.c.timestamp)
         async with session_var() as session:
+            query = await session.execute(stmt, {"limit": int(limit)})
+        return query.mappings().all()
+
+    @classmethod
+    async def select_candles(cls, ticker, interval, start=None, end=None, limit=500):
+        """Последние limit свечей в диапазоне [start, end), от старых к новым"""
+        stmt = lambda_stmt(lambda: select(Candle.timestamp, Candle.open, Candle.high, Candle.low, Candle.close,
+                                          Candle.volume).where(Candle.ticker == ticker, Candle.interval == interval))
+        if start is not None:
+            stmt += lambda s: s.where(Candle.timestamp >= start)
+        if end is not None:
+            stmt += lambda s: s.where(Candle.timestamp < end)
+        stmt += lambda s: s.order_by(desc(Candle.timestamp)).limit(limit)
+        async with read_session_var() as session:
             query = await session.execute(stmt)
-        return query.scalars()
+        rows = query.mappings().all()
+        rows.reverse()
+        return rows
 
     @classmethod
-    async def get_order(cls, order_id):
-        stmt = select(Order).where(Order.id == order_id)
+    async def minute_candles(cls, since):
+        """Минутные свечи всех тикеров начиная с since, от старых к новым"""
+        stmt = select(Candle.ticker, Candle.timestamp, Candle.open, Candle.high, Candle.low, Candle.close,
+                      Candle.volume).where(Candle.interval == "1m", Candle.timestamp >= since).order_by(
+            Candle.ticker, Candle.timestamp)
         async with session_var() as session:
             query = await session.execute(stmt)
-        order = query.scalars().one_or_none()
-        if order is None:
-            raise HTTPException(status_code=404, detail="Order not found")
-        return order
+        return query.mappings().all()
 
+    @classmethod
+    async def last_prices(cls):
+        """Цена закрытия последней дневной свечи каждого тикера"""
+        stmt = select(Candle.ticker, Candle.close).where(Candle.interval == "1d").distinct(Candle.ticker).order_by(
+            Candle.ticker, desc(Candle.timestamp))
+        async with session_var() as session:
+            query = await session.execute(stmt)
+        return dict(query.all())
 
+    @classmethod
+    async def save_candles(cls, candles):
+        stmt = pg_insert(Candle).values(candles)
+        stmt = stmt.on_conflict_do_update(index_elements=[Candle.ticker, Candle.interval, Candle.timestamp],
+                                          set_={name: stmt.excluded[name]
+                                                for name in ("open", "high", "low", "close", "volume")})
+        async with session_var() as session, session.begin():
+            await session.execute(stmt)
+
+
+@timed
 class AuthORM:
     @classmethod
-    async def verify_token_orm(cls, token):
-        stmt = select(User).where(User.api_key == bindparam("token"))
+    async def identify(cls, token):
+        """(user_id, role) владельца ключа; сначала смотрим в кэш, затем в базу"""
+        identity = api_key_cache.get(token)
+        if identity is not None:
+            return identity
         async with session_var() as session:
-            query = await session.execute(stmt, {"token": token})
-        return query.scalars().one_or_none()
+            query = await session.execute(identify_stmt, {"token": token})
+        row = query.one_or_none()
+        if row is None:
+            return None
+        return api_key_cache.put(token, Identity(row.id, row.role))
+
+    @classmethod
+    async def verify_token_orm(cls, token):
+        return await cls.identify(token)
 
     @classmethod
     async def verify_admin_token_orm(cls, token):
-        stmt = select(User).where(and_(User.api_key == bindparam("api_key"), User.role == UserRole.ADMIN))
-        async with session_var() as session:
-            query = await session.execute(stmt, {"api_key": token})
-        return query.scalars().one_or_none()
+        identity = await cls.identify(token)
+        if identity is not None and identity.role == UserRole.ADMIN:
+            return identity
+        return None
+
+
+cluster.register(place=OrderORM.place, cancel=OrderORM.cancel, deposit=AdminORM.deposit,
+                 withdraw=AdminORM.withdraw, transfer=BalanceORM.transfer, reserve=OrderORM.reserve_quote,
+                 balances=ledger.balances, forget_user=AdminORM.forget_user, settled=settlement.settled,
+                 drain=settlement.drain, pin=read_session_var.pin, release=ledger.release,
+                 resting_bids=OrderORM.resting_bids)
@@ -0,0 +1,134 @@
+import asyncio
+from typing import Dict, List, Tuple
+
+from src.backend.database.database import settings
+
+
+class Batch:
+    """Изменения одного запроса, которые должны попасть в базу вместе.
+
+    orders - новые заявки (строки для insert), updates - новые filled/status по id заявки,
+    trades - сделки, balances - доступные объемы счетов (строки для upsert).
+    """
+    __slots__ = ("orders", "updates", "trades", "balances")
+
+    def __init__(self, orders=(), updates=(), trades=(), balances=()):
+        self.orders = list(orders)
+        self.updates = list(updates)
+        self.trades = list(trades)
+        self.balances = list(balances)
+
+    @classmethod
+    def merge(cls, batches: List["Batch"]) -> "Batch":
+        """Одна пачка из нескольких в порядке поступления.
+
+        Обновления заявки, вставленной в этой же пачке, сразу попадают в ее строку,
+        а из нескольких обновлений одной заявки или одного счета остается последнее.
+        """
+        orders: Dict = {}
+        updates: Dict = {}
+        balances: Dict[Tuple, dict] = {}
+        trades = []
+        for batch in batches:
+            for row in batch.orders:
+                orders[row["id"]] = dict(row)
+            for row in batch.updates:
+                target = orders.get(row["id"])
+                if target is None:
+                    target = updates.setdefault(row["id"], {})
+                target.update(row)
+            trades.extend(batch.trades)
+            for row in batch.balances:
+                balances[row["user_id"], row["ticker"]] = row
+        return cls(orders.values(), updates.values(), trades, balances.values())
+
+
+class WritePipeline:
+    """Групповая фиксация записей в базу.
+
+    Обработчики запросов отдают свои изменения в submit и, если нужно, ждут возвращенный future.
+    Фоновая задача собирает все, что пришло за window секунд (но не больше max_batch пачек),
+    и пишет одной транзакцией, так что десятки запросов платят за один commit.
+    Если общая транзакция не прошла, пачки пишутся по одной, чтобы ошибка одной
+    не досталась остальным.
+    """
+
+    def __init__(self, window: float, max_batch: int):
+        self.window = window
+        self.max_batch = max_batch
+        self.pending: List[Tuple[Batch, asyncio.Future]] = []
+        self.commits = 0
+        self.batches = 0
+        self._save = None
+        self._task = None
+        self._wakeup = None
+        self._full = None
+        self._stopping = False
+
+    def submit(self, batch: Batch) -> asyncio.Future:
+        future = asyncio.get_running_loop().create_future()
+        self.pending.append((batch, future))
+        self._wakeup.set()
+        if len(self.pending) >= self.max_batch:
+            self._full.set()
+        return future
+
+    async def commit(self):
+        """Пишет накопленные пачки, не больше max_batch за раз; остаток уходит в следующую фиксацию"""
+        pending, self.pending = self.pending[:self.max_batch], self.pending[self.max_batch:]
+        if self.pending:
+            self._wakeup.set()
+        if len(self.pending) < self.max_batch:
+            self._full.clear()
+        if not pending:
+            return
+        try:
+            await self._save(Batch.merge([batch for batch, _ in pending]))
+        except Exception:
+            for batch, future in pending:
+                try:
+                    await self._save(batch)
+                except Exception as exc:
+                    if not future.done():
+                        future.set_exception(exc)
+                else:
+                    if not future.done():
+                        future.set_result(None)
+                self.commits += 1
+        else:
+            self.commits += 1
+            for _, future in pending:
+                if not future.done():
+                    future.set_result(None)
+        self.batches += len(pending)
+
+    def start(self, save):
+        self._save = save
+        self._stopping = False
+        self._wakeup = asyncio.Event()
+        self._full = asyncio.Event()
+        self._task = asyncio.create_task(self._writer())
+
+    async def stop(self):
+        """Дописывает все принятые пачки и останавливает запись; отменять задачу посреди commit нельзя"""
+        self._stopping = True
+        self._wakeup.set()
+        await self._task
+
+    async def _writer(self):
+        while True:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            if self._stopping and not self.pending:
+                return
+            if self.window and not self._stopping and len(self.pending) < self.max_batch:
+                try:
+                    await asyncio.wait_for(self._full.wait(), self.window)
+                except asyncio.TimeoutError:
+                    pass
+            await self.commit()
+            if self._stopping:
+                self._wakeup.set()
+
+
+writer = WritePipeline(settings.GROUP_COMMIT_WINDOW, settings.GROUP_COMMIT_MAX_BATCH)
@@ -0,0 +1,243 @@
+import asyncio
+import datetime
+import json
+import logging
+import os
+import time
+from collections import deque
+from typing import Deque, Dict, Iterable, List, Optional
+from uuid import UUID
+
+import sqlalchemy.exc
+
+from src.backend.database.database import settings
+from src.backend.database.pipeline import Batch
+
+logger = logging.getLogger(__name__)
+
+
+class Settlement:
+    """Исполнение одного решения актора тикера: новые заявки, их filled/status и сделки"""
+    __slots__ = ("batch", "users", "future", "created")
+
+    def __init__(self, batch: Batch, users: Iterable[UUID]):
+        self.batch = batch
+        self.users = set(users)
+        self.future = asyncio.get_running_loop().create_future()
+        self.created = time.monotonic()
+
+
+class SettlementQueue:
+    """Очередь проводки сделок в базу, отвязанная от сведения.
+
+    Актор тикера решает сведение в памяти и кладет результат в очередь, а заявка подтверждается,
+    не дожидаясь базы. Тикеры поделены между workers обработчиками: у каждого своя очередь,
+    и изменения одного тикера проводятся строго в порядке решений, пачками до batch_size через
+    конвейер групповой фиксации. Проводка идемпотентна - filled/status и балансы пишутся новыми значениями,
+    а вставки заявок и сделок пропускают уже записанные id, - поэтому пачку после обрыва соединения
+    с базой можно просто повторить, но не больше max_retries раз. Пачка с любой другой ошибкой
+    проводится по одной, а отвергнутое базой решение (как и то, что не удалось записать за все попытки)
+    дописывается строкой JSON в файл dead_letter, чтобы не останавливать очередь и не потерять его.
+
+    Если в очередях больше max_backlog решений, новые заявки ждут в admit, пока очереди
+    не разберутся до половины.
+
+    Без журнала решения несут и новые балансы счетов, а их нельзя записать не в том порядке,
+    поэтому очередь тогда одна на все тикеры (start с workers=1).
+    """
+
+    def __init__(self, workers: int, batch_size: int, max_backlog: int, retry_interval: float, max_retries: int):
+        self.workers = self.default_workers = workers
+        self.batch_size = batch_size
+        self.max_backlog = max_backlog
+        self.retry_interval = retry_interval
+        self.max_retries = max_retries
+        self.queues: List[Deque[Settlement]] = [deque() for _ in range(workers)]
+        self.backlog = 0
+        self.users: Dict[UUID, int] = {}
+        self.applied = 0
+        self.failed = 0
+        self.retries = 0
+        self.throttled = 0
+        self._save = None
+        self.dead_letter = None
+        self._tasks = []
+        self._wakeups: List[asyncio.Event] = []
+        self._idle: List[asyncio.Event] = []
+        self._drained = None
+        self._user_waiters: Dict[UUID, List[asyncio.Future]] = {}
+        self._stopping = False
+
+    def partition(self, ticker: str) -> int:
+        return hash(ticker) % self.workers
+
+    def submit(self, ticker: str, batch: Batch, users: Iterable[UUID]) -> asyncio.Future:
+        """Ставит изменения тикера в очередь; future завершится, когда они окажутся в базе"""
+        settlement = Settlement(batch, users)
+        partition = self.partition(ticker)
+        self.queues[partition].append(settlement)
+        self.backlog += 1
+        for user_id in settlement.users:
+            self.users[user_id] = self.users.get(user_id, 0) + 1
+        if self.backlog >= self.max_backlog:
+            self._drained.clear()
+        self._idle[partition].clear()
+        self._wakeups[partition].set()
+        return settlement.future
+
+    async def admit(self):
+        """Задерживает новые заявки, пока очередь перегружена"""
+        if self.backlog >= self.max_backlog:
+            self.throttled += 1
+            await self._drained.wait()
+
+    async def settled(self, user_id: UUID):
+        """Ждет, пока в базе окажутся все уже принятые изменения заявок пользователя"""
+        if not self.users.get(user_id):
+            return
+        future = asyncio.get_running_loop().create_future()
+        self._user_waiters.setdefault(user_id, []).append(future)
+        await future
+
+    async def barrier(self):
+        """Ждет, пока будут проведены или отвергнуты все уже поставленные решения"""
+        # очереди проводятся по порядку, поэтому достаточно дождаться последнего решения каждой
+        futures = [queue[-1].future for queue in self.queues if queue]
+        if futures:
+            await asyncio.wait(futures)
+
+    async def drain(self):
+        """Ждет, пока очереди опустеют"""
+        await asyncio.gather(*(idle.wait() for idle in self._idle))
+
+    def lag(self) -> float:
+        """Сколько секунд ждет самое старое непроведенное решение"""
+        oldest = min((queue[0].created for queue in self.queues if queue), default=None)
+        return 0.0 if oldest is None else time.monotonic() - oldest
+
+    def _done(self, settlements: List[Settlement]):
+        self.backlog -= len(settlements)
+        for settlement in settlements:
+            for user_id in settlement.users:
+                left = self.users[user_id] - 1
+                if left:
+                    self.users[user_id] = left
+                    continue
+                del self.users[user_id]
+                for future in self._user_waiters.pop(user_id, ()):
+                    if not future.done():
+                        future.set_result(None)
+        if self.backlog <= self.max_backlog // 2:
+            self._drained.set()
+
+    @staticmethod
+    def transient(exc: Exception) -> bool:
+        """Ошибка соединения с базой, после которой ту же пачку можно повторить"""
+        if isinstance(exc, sqlalchemy.exc.DBAPIError) and exc.connection_invalidated:
+            return True
+        return isinstance(exc, (sqlalchemy.exc.OperationalError, sqlalchemy.exc.InterfaceError,
+                                sqlalchemy.exc.TimeoutError, OSError))
+
+    async def _commit(self, batch: Batch):
+        """Пишет пачку, пока соединение с базой рвется - повторяет, остальные ошибки отдает вызывающему"""
+        for attempt in range(self.max_retries + 1):
+            try:
+                await self._save(batch)
+                return
+            except Exception as exc:
+                if not self.transient(exc) or attempt == self.max_retries:
+                    raise
+                self.retries += 1
+                logger.warning("settlement commit failed, retrying in %.2fs", self.retry_interval, exc_info=True)
+                await asyncio.sleep(self.retry_interval)
+
+    def _append(self, line: str):
+        with open(self.dead_letter, "a") as file:
+            file.write(line)
+            file.flush()
+            os.fsync(file.fileno())
+
+    async def _reject(self, settlement: Settlement, exc: Exception):
+        """Сохраняет решение, которое база не приняла, для разбора вручную"""
+        record = {"rejected": datetime.datetime.now(datetime.timezone.utc), "error": str(exc),
+                  "users": sorted(settlement.users, key=str), "orders": settlement.batch.orders,
+                  "updates": settlement.batch.updates, "trades": settlement.batch.trades,
+                  "balances": settlement.batch.balances}
+        try:
+            await asyncio.to_thread(self._append, json.dumps(record, default=str) + "\n")
+        except OSError:
+            logger.exception("settlement dead letter write failed: %s", record)
+
+    async def _fail(self, settlement: Settlement, exc: Exception):
+        self.failed += 1
+        logger.error("settlement rejected, saved to %s: %s", self.dead_letter, exc)
+        await self._reject(settlement, exc)
+        if not settlement.future.done():
+            settlement.future.set_exception(exc)
+
+    async def _apply(self, settlements: List[Settlement]):
+        try:
+            await self._commit(Batch.merge([settlement.batch for settlement in settlements]))
+        except Exception as exc:
+            if self.transient(exc):
+                # база так и не ответила за все попытки - писать решения по одной незачем
+                for settlement in settlements:
+                    await self._fail(settlement, exc)
+            else:
+                for settlement in settlements:
+                    try:
+                        await self._commit(settlement.batch)
+                    except Exception as error:
+                        await self._fail(settlement, error)
+                    else:
+                        self.applied += 1
+                        if not settlement.future.done():
+                            settlement.future.set_result(None)
+        else:
+            self.applied += len(settlements)
+            for settlement in settlements:
+                if not settlement.future.done():
+                    settlement.future.set_result(None)
+        self._done(settlements)
+
+    async def _worker(self, partition: int):
+        queue, wakeup, idle = self.queues[partition], self._wakeups[partition], self._idle[partition]
+        while True:
+            if not queue:
+                idle.set()
+                if self._stopping:
+                    return
+                wakeup.clear()
+                await wakeup.wait()
+                continue
+            # решения остаются в очереди до записи, чтобы lag видел и те, что пишутся сейчас
+            settlements = [queue[number] for number in range(min(self.batch_size, len(queue)))]
+            await self._apply(settlements)
+            for _ in settlements:
+                queue.popleft()
+
+    def start(self, save, dead_letter: str, workers: Optional[int] = None):
+        self._save = save
+        self.dead_letter = dead_letter
+        os.makedirs(os.path.dirname(dead_letter) or ".", exist_ok=True)
+        self._stopping = False
+        self.workers = self.default_workers if workers is None else workers
+        self.queues = [deque() for _ in range(self.workers)]
+        self._drained = asyncio.Event()
+        self._drained.set()
+        self._wakeups = [asyncio.Event() for _ in range(self.workers)]
+        self._idle = [asyncio.Event() for _ in range(self.workers)]
+        self._tasks = [asyncio.create_task(self._worker(partition), name=f"settlement-{partition}")
+                       for partition in range(self.workers)]
+
+    async def stop(self):
+        """Проводит все принятые решения и останавливает обработчиков"""
+        self._stopping = True
+        for wakeup in self._wakeups:
+            wakeup.set()
+        await asyncio.gather(*self._tasks)
+
+
+settlement = SettlementQueue(int(settings.SETTLEMENT_WORKERS), int(settings.SETTLEMENT_BATCH_SIZE),
+                             int(settings.SETTLEMENT_MAX_BACKLOG), float(settings.SETTLEMENT_RETRY_INTERVAL),
+                             int(settings.SETTLEMENT_MAX_RETRIES))
@@ -0,0 +1,66 @@
+import asyncio
+import contextvars
+from typing import Dict
+
+from src.backend.database.database import settings
+
+
+class TickerActor:
+    """Единственный исполнитель команд одного тикера.
+
+    Команды выполняются строго по очереди, поэтому книга заявок и балансы
+    этого тикера никогда не меняются конкурентно.
+    """
+
+    def __init__(self, ticker: str, maxsize: int):
+        self.ticker = ticker
+        self.queue = asyncio.Queue(maxsize)
+        self.task = asyncio.create_task(self._run(), name=f"ticker-actor-{ticker}")
+
+    async def _run(self):
+        while True:
+            func, args, context, future = await self.queue.get()
+            if future.cancelled():
+                continue
+            try:
+                # команда выполняется в контексте вызвавшего запроса, чтобы до нее доходили его contextvars
+                result = await context.run(asyncio.ensure_future, func(*args))
+            except Exception as exc:
+                if not future.done():
+                    future.set_exception(exc)
+            else:
+                if not future.done():
+                    future.set_result(result)
+
+    async def call(self, func, *args):
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((func, args, contextvars.copy_context(), future))
+        return await future
+
+
+class TickerActors:
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self.actors: Dict[str, TickerActor] = {}
+
+    def actor(self, ticker: str) -> TickerActor:
+        actor = self.actors.get(ticker)
+        if actor is None:
+            actor = self.actors[ticker] = TickerActor(ticker, self.maxsize)
+        return actor
+
+    async def call(self, ticker: str, func, *args):
+        return await self.actor(ticker).call(func, *args)
+
+    def depths(self) -> Dict[str, int]:
+        return {ticker: actor.queue.qsize() for ticker, actor in self.actors.items()}
+
+    async def stop(self):
+        actors, self.actors = self.actors, {}
+        for actor in actors.values():
+            actor.task.cancel()
+        await asyncio.gather(*(actor.task for actor in actors.values()), return_exceptions=True)
+
+
+actors = TickerActors(settings.ORDER_QUEUE_SIZE)
@@ -0,0 +1,356 @@
+import asyncio
+import logging
+import os
+import re
+import struct
+import sys
+import time
+import zlib
+from typing import Iterator, List, Optional, Tuple
+from uuid import UUID
+
+from src.backend.engine.ledger import BalanceLedger
+from src.backend.engine.matching import BookOrder, MatchingEngine
+from src.backend.server.models import Direction
+
+logger = logging.getLogger(__name__)
+
+NEW = 1
+CANCEL = 2
+DROP = 3
+SEQ = 4
+BALANCE = 5
+FORGET = 6
+LEDGER = 7
+
+FRAME = struct.Struct("<II")
+HEAD = struct.Struct("<BB")
+ORDER = struct.Struct("<16s16s?qqq")
+ORDER_ID = struct.Struct("<16s")
+NUMBER = struct.Struct("<q")
+SNAPSHOT = struct.Struct("<Q")
+ACCOUNT = struct.Struct("<16sqq")
+SEGMENT = "journal-{:08d}.bin"
+SEGMENT_NAME = re.compile(r"journal-(\d{8})\.bin")
+
+
+def encode(kind: int, ticker: str, payload: bytes = b"") -> bytes:
+    ticker = ticker.encode()
+    body = HEAD.pack(kind, len(ticker)) + ticker + payload
+    return FRAME.pack(len(body), zlib.crc32(body)) + body
+
+
+def encode_order(ticker: str, order: BookOrder) -> bytes:
+    price = -1 if order.price is None else order.price
+    return encode(NEW, ticker, ORDER.pack(order.id.bytes, order.user_id.bytes, order.is_bid,
+                                          order.qty, price, order.filled))
+
+
+def decode_order(payload: bytes) -> BookOrder:
+    order_id, user_id, is_bid, qty, price, filled = ORDER.unpack(payload)
+    return BookOrder(UUID(bytes=order_id), UUID(bytes=user_id), Direction.BUY if is_bid else Direction.SELL,
+                     qty, None if price < 0 else price, filled)
+
+
+def read_records(data: bytes, offset: int = 0) -> Iterator[Tuple[int, int, str, bytes]]:
+    """(конец записи, тип, тикер, данные) для целых записей начиная с offset; на оборванной записи останавливается"""
+    while offset + FRAME.size <= len(data):
+        length, crc = FRAME.unpack_from(data, offset)
+        body = data[offset + FRAME.size:offset + FRAME.size + length]
+        if len(body) < length or zlib.crc32(body) != crc:
+            return
+        kind, ticker_length = HEAD.unpack_from(body)
+        ticker = body[HEAD.size:HEAD.size + ticker_length].decode()
+        offset += FRAME.size + length
+        yield offset, kind, ticker, body[HEAD.size + ticker_length:]
+
+
+def apply(engine: MatchingEngine, kind: int, ticker: str, payload: bytes, ledger: Optional[BalanceLedger] = None):
+    """Повторяет событие журнала напрямую на книгах и балансах, не записывая его заново"""
+    if kind == NEW:
+        return engine.book(ticker).submit(decode_order(payload))
+    if kind == CANCEL:
+        engine.book(ticker).cancel(UUID(bytes=ORDER_ID.unpack(payload)[0]))
+    elif kind == DROP:
+        engine.drop(ticker)
+        if ledger is not None:
+            ledger.drop(ticker)
+    elif ledger is not None and kind == BALANCE:
+        user_id, available, reserved = ACCOUNT.unpack(payload)
+        ledger.restore(UUID(bytes=user_id), ticker, available, reserved)
+    elif ledger is not None and kind == FORGET:
+        ledger.forget(UUID(bytes=ORDER_ID.unpack(payload)[0]))
+    return []
+
+
+class Journal:
+    """Журнал заявок, отмен и состояний счетов только на дозапись плюс периодические снимки книг и балансов.
+
+    Записи копятся в буфере и сбрасываются на диск пачками с одним fsync;
+    sync() ждет, пока все уже добавленные записи окажутся на диске.
+    Журнал поделен на сегменты: каждый снимок начинает новый сегмент, а после записи снимка
+    сегменты, которые он покрывает, удаляются. При старте загружается последний снимок
+    и повторяются только сегменты после него. Снимок записывается только после settled() -
+    когда проведены в базу все решения из покрытых им сегментов, поэтому непроведенные
+    решения всегда остаются в хвосте журнала.
+    Если запись на диск не удалась, журнал считается сломанным: ждущие и все следующие sync
+    получают ошибку, пока процесс не перезапустят.
+    """
+
+    def __init__(self, directory: str, fsync_interval: float, snapshot_interval: float):
+        self.directory = directory
+        self.snapshot_path = os.path.join(directory, "snapshot.bin")
+        self.fsync_interval = fsync_interval
+        self.snapshot_interval = snapshot_interval
+        self.segment = 0
+        self.offset = 0
+        self.error: Optional[OSError] = None
+        self._synced = 0
+        self._buffer = bytearray()
+        self._waiters = []
+        self._wakeup = None
+        self._lock = None
+        self._settled = None
+        self._file = None
+        self._tasks = []
+        os.makedirs(directory, exist_ok=True)
+
+    def segment_path(self, segment: int) -> str:
+        return os.path.join(self.directory, SEGMENT.format(segment))
+
+    def segments(self) -> List[int]:
+        """Номера сегментов на диске по возрастанию"""
+        return sorted(int(match.group(1)) for match in map(SEGMENT_NAME.fullmatch, os.listdir(self.directory))
+                      if match)
+
+    def load(self, engine: MatchingEngine, ledger: Optional[BalanceLedger] = None,
+             tail: Optional[list] = None) -> bool:
+        """Восстанавливает книги и балансы из снимка и хвоста журнала; False, если восстанавливать не из чего.
+
+        Балансы считаются восстановленными (ledger.restored), только если снимок записан вместе с ними.
+        В tail складываются события хвоста как (тип, тикер, предмет, сделки): для NEW - заявка и ее сделки,
+        для CANCEL - снятая заявка, для FORGET - id пользователя, для DROP - None.
+        """
+        if not os.path.exists(self.snapshot_path):
+            return False
+        with open(self.snapshot_path, "rb") as file:
+            snapshot = file.read()
+        # снимок покрывает все сегменты до first
+        first, = SNAPSHOT.unpack_from(snapshot)
+        seqs = {}
+        for _, kind, ticker, payload in read_records(snapshot, SNAPSHOT.size):
+            if kind == NEW:
+                engine.book(ticker).rest(decode_order(payload))
+            elif kind == SEQ:
+                seqs[ticker] = NUMBER.unpack(payload)[0]
+            elif ledger is not None and kind == BALANCE:
+                user_id, available, reserved = ACCOUNT.unpack(payload)
+                ledger.restore(UUID(bytes=user_id), ticker, available, reserved)
+            elif ledger is not None and kind == LEDGER:
+                ledger.restored = True
+        for ticker, seq in seqs.items():
+            engine.book(ticker).seq = seq
+        for segment in self.segments():
+            if segment < first:
+                continue
+            path = self.segment_path(segment)
+            with open(path, "rb") as file:
+                data = file.read()
+            end = 0
+            for end, kind, ticker, payload in read_records(data):
+                if tail is None or kind not in (NEW, CANCEL, DROP, FORGET):
+                    apply(engine, kind, ticker, payload, ledger)
+                elif kind == NEW:
+                    order = decode_order(payload)
+                    tail.append((kind, ticker, order, engine.book(ticker).submit(order)))
+                else:
+                    subject = UUID(bytes=ORDER_ID.unpack(payload)[0]) if payload else None
+                    if kind == CANCEL:
+                        subject = engine.book(ticker).orders.get(subject)
+                    apply(engine, kind, ticker, payload, ledger)
+                    tail.append((kind, ticker, subject, []))
+            if end < len(data):
+                # оборваться может только последний сегмент: предыдущий закрывается с fsync до начала записи в новый
+                with open(path, "r+b") as file:
+                    file.truncate(end)
+        return True
+
+    def start(self, engine: MatchingEngine, ledger: Optional[BalanceLedger] = None, settled=None):
+        """settled - корутина, которая ждет проводки в базу всех уже принятых решений"""
+        self._settled = settled
+        self.segment = max(self.segments(), default=0)
+        self._file = open(self.segment_path(self.segment), "ab")
+        self.offset = self._synced = 0
+        self.error = None
+        self._wakeup = asyncio.Event()
+        self._lock = asyncio.Lock()
+        self._tasks = [asyncio.create_task(self._flusher()),
+                       asyncio.create_task(self._snapshotter(engine, ledger))]
+        engine.journal = self
+        if ledger is not None:
+            ledger.journal = self
+
+    async def stop(self, engine: MatchingEngine, ledger: Optional[BalanceLedger] = None):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        await self.flush()
+        await self.write_snapshot(engine, ledger)
+        engine.journal = None
+        if ledger is not None:
+            ledger.journal = None
+        self._file.close()
+
+    def append(self, record: bytes):
+        if self.error is not None:
+            return
+        self._buffer += record
+        self.offset += len(record)
+
+    def append_order(self, ticker: str, order: BookOrder):
+        self.append(encode_order(ticker, order))
+
+    def append_cancel(self, ticker: str, order_id: UUID):
+        self.append(encode(CANCEL, ticker, ORDER_ID.pack(order_id.bytes)))
+
+    def append_drop(self, ticker: str):
+        self.append(encode(DROP, ticker))
+
+    def append_balance(self, ticker: str, user_id: UUID, available: int, reserved: int):
+        self.append(encode(BALANCE, ticker, ACCOUNT.pack(user_id.bytes, available, reserved)))
+
+    def append_forget(self, user_id: UUID):
+        self.append(encode(FORGET, "", ORDER_ID.pack(user_id.bytes)))
+
+    async def sync(self):
+        if self.error is not None:
+            raise self.error
+        if self._synced >= self.offset:
+            return
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.append((self.offset, future))
+        self._wakeup.set()
+        await future
+
+    @staticmethod
+    def _write(file, data: bytes):
+        file.write(data)
+        file.flush()
+        os.fsync(file.fileno())
+
+    def _seal(self, file, data: bytes):
+        """Дописывает в закрываемый сегмент его последние записи"""
+        try:
+            self._write(file, data)
+        finally:
+            file.close()
+
+    def _fail(self, exc: OSError):
+        # после неудачного fsync неизвестно, что из записанного дошло до диска
+        self.error = exc
+        self._buffer.clear()
+        waiters, self._waiters = self._waiters, []
+        for _, future in waiters:
+            if not future.done():
+                future.set_exception(exc)
+
+    async def flush(self):
+        async with self._lock:
+            if self._buffer:
+                data, target = bytes(self._buffer), self.offset
+                self._buffer.clear()
+                try:
+                    await asyncio.to_thread(self._write, self._file, data)
+                except OSError as exc:
+                    self._fail(exc)
+                    raise
+                self._synced = target
+            self._resolve()
+
+    def _resolve(self):
+        waiters, self._waiters = self._waiters, []
+        for target, future in waiters:
+            if target <= self._synced:
+                if not future.done():
+                    future.set_result(None)
+            else:
+                self._waiters.append((target, future))
+
+    async def _flusher(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.fsync_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except OSError:
+                logger.error("journal write failed, syncs fail until restart", exc_info=True)
+                return
+
+    def snapshot(self, engine: MatchingEngine, ledger: Optional[BalanceLedger] = None) -> bytes:
+        parts = [SNAPSHOT.pack(self.segment)]
+        for ticker, book in engine.books.items():
+            parts.append(encode(SEQ, ticker, NUMBER.pack(book.seq)))
+            parts.extend(encode_order(ticker, order) for order in book.orders.values())
+        if ledger is not None:
+            parts.append(encode(LEDGER, ""))
+            parts.extend(encode(BALANCE, ticker, ACCOUNT.pack(user_id.bytes, available, reserved))
+                         for user_id, ticker, available, reserved in ledger.snapshot())
+        return b"".join(parts)
+
+    def _replace(self, data: bytes, first: int):
+        temp = self.snapshot_path + ".tmp"
+        with open(temp, "wb") as file:
+            file.write(data)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temp, self.snapshot_path)
+        for segment in self.segments():
+            if segment < first:
+                os.remove(self.segment_path(segment))
+
+    async def write_snapshot(self, engine: MatchingEngine, ledger: Optional[BalanceLedger] = None):
+        """Начинает новый сегмент и пишет снимок состояния на его начало, затем удаляет покрытые сегменты"""
+        async with self._lock:
+            # снимок и переключение сегмента - без await между ними, чтобы записи не разошлись со снимком
+            self.segment += 1
+            data = self.snapshot(engine, ledger)
+            file, self._file = self._file, open(self.segment_path(self.segment), "ab")
+            rest, target = bytes(self._buffer), self.offset
+            self._buffer.clear()
+            try:
+                await asyncio.to_thread(self._seal, file, rest)
+            except OSError as exc:
+                self._fail(exc)
+                raise
+            self._synced = target
+            self._resolve()
+        first = self.segment
+        if self._settled is not None:
+            await self._settled()
+        await asyncio.to_thread(self._replace, data, first)
+
+    async def _snapshotter(self, engine: MatchingEngine, ledger: Optional[BalanceLedger]):
+        while True:
+            await asyncio.sleep(self.snapshot_interval)
+            try:
+                await self.write_snapshot(engine, ledger)
+            except OSError:
+                logger.error("journal snapshot failed", exc_info=True)
+
+
+if __name__ == "__main__":
+    # сегменты журнала по порядку: python -m src.backend.engine.journal dir/journal-*.bin
+    replay_engine = MatchingEngine()
+    records = fills = 0
+    started = time.perf_counter()
+    for segment_path in sys.argv[1:]:
+        with open(segment_path, "rb") as journal_file:
+            journal_data = journal_file.read()
+        for _, record_kind, record_ticker, record_payload in read_records(journal_data):
+            records += 1
+            fills += len(apply(replay_engine, record_kind, record_ticker, record_payload))
+    elapsed = time.perf_counter() - started
+    print(f"{records} records, {fills} fills, {len(replay_engine.books)} books in {elapsed:.3f}s")
@@ -0,0 +1,254 @@
+import asyncio
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+from uuid import UUID
+
+from src.backend.database.database import settings
+
+
+class Account:
+    __slots__ = ("available", "reserved")
+
+    def __init__(self, available: int = 0, reserved: int = 0):
+        self.available = available
+        self.reserved = reserved
+
+
+class BalanceLedger:
+    """Балансы пользователей в памяти: доступный и зарезервированный объем по каждому тикеру.
+
+    Источник истины для балансов - ledger. С подключенным журналом таблица balance (amount = доступный
+    объем) догоняет его: каждое изменение пишется в журнал новым состоянием счета и помечает счет грязным,
+    а грязные счета раз в flush_interval секунд или по накоплении flush_size сохраняются одним upsert.
+    После сбоя ledger восстанавливается из снимка и хвоста журнала, а не из отставшей таблицы.
+
+    Без журнала отставать таблице нельзя: после рестарта резерв считается по активным заявкам в базе,
+    и он должен сойтись с доступным объемом из balance. Поэтому изменения счетов забирает pending
+    и пишет той же транзакцией, что и заявки, которые их вызвали.
+    """
+
+    def __init__(self, flush_interval: float, flush_size: int):
+        self.flush_interval = flush_interval
+        self.flush_size = flush_size
+        self.accounts: Dict[UUID, Dict[str, Account]] = {}
+        self.dirty: Set[Tuple[UUID, str]] = set()
+        self.journal = None
+        self.restored = False
+        self._save = None
+        self._task = None
+        self._wakeup = None
+
+    def account(self, user_id: UUID, ticker: str) -> Account:
+        accounts = self.accounts.get(user_id)
+        if accounts is None:
+            accounts = self.accounts[user_id] = {}
+        account = accounts.get(ticker)
+        if account is None:
+            account = accounts[ticker] = Account()
+        return account
+
+    def _changed(self, user_id: UUID, ticker: str, account: Account):
+        self.dirty.add((user_id, ticker))
+        if self.journal is not None:
+            self.journal.append_balance(ticker, user_id, account.available, account.reserved)
+        if len(self.dirty) >= self.flush_size and self._wakeup is not None:
+            self._wakeup.set()
+
+    def balances(self, user_id: UUID) -> Dict[str, int]:
+        return {ticker: account.available for ticker, account in self.accounts.get(user_id, {}).items()}
+
+    def available(self, user_id: UUID, ticker: str) -> int:
+        account = self.accounts.get(user_id, {}).get(ticker)
+        return account.available if account is not None else 0
+
+    def deposit(self, user_id: UUID, ticker: str, amount: int):
+        account = self.account(user_id, ticker)
+        account.available += amount
+        self._changed(user_id, ticker, account)
+
+    def withdraw(self, user_id: UUID, ticker: str, amount: int) -> bool:
+        account = self.accounts.get(user_id, {}).get(ticker)
+        if account is None or account.available < amount:
+            return False
+        account.available -= amount
+        self._changed(user_id, ticker, account)
+        return True
+
+    def reserve(self, user_id: UUID, ticker: str, amount: int) -> bool:
+        """Переводит amount из доступного в резерв; False, если доступного не хватает"""
+        account = self.accounts.get(user_id, {}).get(ticker)
+        if account is None or account.available < amount:
+            return False
+        account.available -= amount
+        account.reserved += amount
+        self._changed(user_id, ticker, account)
+        return True
+
+    def reserve_orders(self, user_id: UUID, ticker: str, amounts: List[Tuple[UUID, Optional[int]]]) -> Dict[UUID, int]:
+        """Резервирует объемы заявок по очереди, пока хватает доступного; заявки, на которые не хватило, пропускаются.
+
+        Объем None - рыночная покупка: ей достается весь оставшийся доступный объем, а неистраченное
+        вызывающий вернет через release. Возвращает зарезервированное по id заявок.
+        """
+        account = self.accounts.get(user_id, {}).get(ticker)
+        available = account.available if account is not None else 0
+        reserved = {}
+        for order_id, amount in amounts:
+            if amount is None:
+                amount = available
+            if 0 < amount <= available:
+                reserved[order_id] = amount
+                available -= amount
+        if reserved:
+            self.reserve(user_id, ticker, sum(reserved.values()))
+        return reserved
+
+    def release(self, user_id: UUID, ticker: str, amount: int):
+        """Возвращает неисполненный остаток из резерва в доступное"""
+        account = self.account(user_id, ticker)
+        account.reserved -= amount
+        account.available += amount
+        self._changed(user_id, ticker, account)
+
+    def settle(self, ticker: str, fills) -> Dict[UUID, List[int]]:
+        """Проводит сделки по счетам ticker: продавец отдает объем из резерва, покупатель получает в доступное.
+
+        Изменения счетов quote возвращаются как [изменение доступного, изменение резерва] по пользователям:
+        покупатель платит из резерва, а если купил дешевле своей лимитной цены, разница возвращается
+        из резерва в доступное; продавец получает оплату в доступное. Проводит их transfer - здесь
+        или на воркере-владельце quote.
+        """
+        changes: Dict[UUID, List[int]] = {}
+        for fill in fills:
+            buyer, seller = fill.buyer, fill.seller
+            account = self.account(buyer.user_id, ticker)
+            account.available += fill.amount
+            self._changed(buyer.user_id, ticker, account)
+            account = self.account(seller.user_id, ticker)
+            account.reserved -= fill.amount
+            self._changed(seller.user_id, ticker, account)
+            cost = fill.amount * fill.price
+            change = changes.setdefault(buyer.user_id, [0, 0])
+            change[1] -= cost
+            if buyer.price is not None and buyer.price > fill.price:
+                refund = fill.amount * (buyer.price - fill.price)
+                change[0] += refund
+                change[1] -= refund
+            changes.setdefault(seller.user_id, [0, 0])[0] += cost
+        return changes
+
+    def reconcile(self, ticker: str, reserved: Dict[UUID, int]) -> int:
+        """Приводит резерв счетов ticker к ожидаемому, разница уходит в доступное; возвращает число исправленных"""
+        fixed = 0
+        users = set(reserved)
+        users.update(user_id for user_id, accounts in self.accounts.items() if ticker in accounts)
+        for user_id in users:
+            expected = reserved.get(user_id, 0)
+            account = self.account(user_id, ticker)
+            if account.reserved != expected:
+                account.available += account.reserved - expected
+                account.reserved = expected
+                self._changed(user_id, ticker, account)
+                fixed += 1
+        return fixed
+
+    def transfer(self, ticker: str, changes: Dict[UUID, List[int]]):
+        """Проводит изменения [доступного, резерва] счетов ticker, посчитанные settle"""
+        for user_id, (available, reserved) in changes.items():
+            if available or reserved:
+                account = self.account(user_id, ticker)
+                account.available += available
+                account.reserved += reserved
+                self._changed(user_id, ticker, account)
+
+    def restore(self, user_id: UUID, ticker: str, available: int, reserved: int):
+        """Состояние счета из журнала"""
+        account = self.account(user_id, ticker)
+        account.available, account.reserved = available, reserved
+        self.dirty.add((user_id, ticker))
+
+    def forget(self, user_id: UUID):
+        """Удаленный пользователь: его счета больше не нужны ни в памяти, ни в очереди на запись"""
+        self.accounts.pop(user_id, None)
+        self.dirty = {key for key in self.dirty if key[0] != user_id}
+        if self.journal is not None:
+            self.journal.append_forget(user_id)
+
+    def drop(self, ticker: str):
+        for accounts in self.accounts.values():
+            accounts.pop(ticker, None)
+        self.dirty = {key for key in self.dirty if key[1] != ticker}
+
+    def load(self, rows: Iterable, resting: Iterable[Tuple[str, object]], quote: str):
+        """Загружает доступные объемы из таблицы balance, резерв считается по лежащим в книгах заявкам:
+        продажа держит остаток объема тикера, покупка - остаток по своей цене в quote"""
+        for row in rows:
+            self.account(row.user_id, row.ticker).available = row.amount
+        for ticker, order in resting:
+            if order.is_bid:
+                self.account(order.user_id, quote).reserved += order.remaining * order.price
+            else:
+                self.account(order.user_id, ticker).reserved += order.remaining
+
+    def snapshot(self) -> List[Tuple[UUID, str, int, int]]:
+        return [(user_id, ticker, account.available, account.reserved)
+                for user_id, accounts in self.accounts.items() for ticker, account in accounts.items()]
+
+    async def sync(self):
+        """Ждет, пока изменения балансов окажутся в журнале на диске"""
+        if self.journal is not None:
+            await self.journal.sync()
+
+    def _rows(self, dirty: Set[Tuple[UUID, str]]) -> List[dict]:
+        rows = []
+        for user_id, ticker in dirty:
+            account = self.accounts.get(user_id, {}).get(ticker)
+            if account is not None:
+                rows.append({"user_id": user_id, "ticker": ticker, "amount": account.available})
+        return rows
+
+    def pending(self) -> List[dict]:
+        """Без журнала - строки balance для счетов, измененных с прошлого вызова, чтобы записать их
+        вместе с вызвавшими изменения заявками; с журналом - пусто, счета догонит фоновый сброс"""
+        if self.journal is not None or not self.dirty:
+            return []
+        dirty, self.dirty = self.dirty, set()
+        return self._rows(dirty)
+
+    async def flush(self):
+        if not self.dirty:
+            return
+        dirty, self.dirty = self.dirty, set()
+        rows = self._rows(dirty)
+        if not rows:
+            return
+        try:
+            await self._save(rows)
+        except Exception:
+            self.dirty |= dirty
+            raise
+
+    def start(self, save):
+        self._save = save
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._flusher())
+
+    async def stop(self):
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        await self.flush()
+
+    async def _flusher(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except Exception:
+                # счета вернулись в dirty, попробуем на следующем шаге
+                pass
+
+
+ledger = BalanceLedger(settings.BALANCE_FLUSH_INTERVAL, settings.BALANCE_FLUSH_SIZE)
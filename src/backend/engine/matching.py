@@ -0,0 +1,302 @@
+import heapq
+from bisect import bisect_left, insort
+from collections import deque
+from typing import Dict, List, NamedTuple, Optional
+from uuid import UUID
+
+from src.backend.server.models import Direction
+
+
+class BookOrder:
+    __slots__ = ("id", "user_id", "is_bid", "qty", "price", "filled")
+
+    def __init__(self, order_id: UUID, user_id: UUID, direction: Direction, qty: int,
+                 price: Optional[int] = None, filled: int = 0):
+        self.id = order_id
+        self.user_id = user_id
+        self.is_bid = direction == Direction.BUY
+        self.qty = qty
+        self.price = price
+        self.filled = filled
+
+    @property
+    def direction(self):
+        return Direction.BUY if self.is_bid else Direction.SELL
+
+    @property
+    def remaining(self):
+        return self.qty - self.filled
+
+
+class Fill(NamedTuple):
+    price: int
+    amount: int
+    taker: BookOrder
+    maker: BookOrder
+
+    @property
+    def buyer(self):
+        return self.taker if self.taker.is_bid else self.maker
+
+    @property
+    def seller(self):
+        return self.maker if self.taker.is_bid else self.taker
+
+
+class OrderBook:
+    """Книга заявок одного тикера с приоритетом цена-время.
+
+    Уровни хранятся в словаре цена -> очередь заявок, а отсортированные ключи
+    уровней держим так, чтобы лучшая цена всегда была в конце списка:
+    для бидов ключ - цена, для асков - цена со знаком минус.
+    Суммарный объем каждого уровня (L2) обновляется вместе с очередями.
+    Каждая операция, изменившая уровни, увеличивает seq и передает слушателям
+    новые объемы затронутых уровней (0 - уровень исчез).
+    """
+
+    def __init__(self, ticker: str, listeners=()):
+        self.ticker = ticker
+        self.seq = 0
+        self.listeners = listeners
+        self.orders: Dict[UUID, BookOrder] = {}
+        self._bids: Dict[int, deque] = {}
+        self._asks: Dict[int, deque] = {}
+        self._bid_keys: List[int] = []
+        self._ask_keys: List[int] = []
+        self._bid_qty: Dict[int, int] = {}
+        self._ask_qty: Dict[int, int] = {}
+
+    def _side(self, is_bid: bool):
+        if is_bid:
+            return self._bids, self._bid_keys, 1, self._bid_qty
+        return self._asks, self._ask_keys, -1, self._ask_qty
+
+    def best_bid(self) -> Optional[int]:
+        return self._bid_keys[-1] if self._bid_keys else None
+
+    def best_ask(self) -> Optional[int]:
+        return -self._ask_keys[-1] if self._ask_keys else None
+
+    def levels(self):
+        """Число ценовых уровней на стороне бидов и асков."""
+        return len(self._bid_keys), len(self._ask_keys)
+
+    def depth(self, limit: int):
+        """Лучшие limit уровней каждой стороны в виде пар (цена, объем)."""
+        if limit <= 0:
+            return [], []
+        bids = [(price, self._bid_qty[price]) for price in reversed(self._bid_keys[-limit:])]
+        asks = [(-key, self._ask_qty[-key]) for key in reversed(self._ask_keys[-limit:])]
+        return bids, asks
+
+    def buyable(self, qty: int, budget: int) -> int:
+        """Сколько из qty рыночная покупка исполнит сейчас, не потратив больше budget."""
+        total = 0
+        for key in reversed(self._ask_keys):
+            price = -key
+            amount = min(qty - total, self._ask_qty[price], budget // price)
+            total += amount
+            budget -= amount * price
+            if total == qty or amount < self._ask_qty[price]:
+                break
+        return total
+
+    def _changed(self, bid_prices, ask_prices):
+        self.seq += 1
+        if self.listeners:
+            bids = [(price, self._bid_qty.get(price, 0)) for price in bid_prices]
+            asks = [(price, self._ask_qty.get(price, 0)) for price in ask_prices]
+            for listener in self.listeners:
+                listener(self, bids, asks)
+
+    def submit(self, order: BookOrder) -> List[Fill]:
+        """Сводит входящую заявку с книгой; остаток лимитной заявки встает в книгу.
+
+        Остаток рыночной заявки не сохраняется - вызывающий код решает, что с ним делать.
+        """
+        if order.qty <= 0 or (order.price is not None and order.price <= 0):
+            raise ValueError("qty and price must be positive")
+        fills = []
+        levels, keys, sign, depth = self._side(not order.is_bid)
+        while order.remaining and keys:
+            price = keys[-1] * sign
+            if order.price is not None and (price > order.price if order.is_bid else price < order.price):
+                break
+            queue = levels[price]
+            while order.remaining and queue:
+                maker = queue[0]
+                amount = min(order.remaining, maker.remaining)
+                order.filled += amount
+                maker.filled += amount
+                depth[price] -= amount
+                fills.append(Fill(price, amount, order, maker))
+                if not maker.remaining:
+                    queue.popleft()
+                    del self.orders[maker.id]
+            if not queue:
+                del levels[price]
+                del depth[price]
+                keys.pop()
+        rested = order.remaining and order.price is not None
+        if rested:
+            self._rest(order)
+        if fills or rested:
+            touched = list(dict.fromkeys(fill.price for fill in fills))
+            own = [order.price] if rested else []
+            if order.is_bid:
+                self._changed(own, touched)
+            else:
+                self._changed(touched, own)
+        return fills
+
+    def rest(self, order: BookOrder):
+        """Ставит лимитную заявку в конец очереди своего уровня без сведения."""
+        self._rest(order)
+        if order.is_bid:
+            self._changed([order.price], [])
+        else:
+            self._changed([], [order.price])
+
+    def _rest(self, order: BookOrder):
+        levels, keys, sign, depth = self._side(order.is_bid)
+        queue = levels.get(order.price)
+        if queue is None:
+            queue = levels[order.price] = deque()
+            depth[order.price] = 0
+            insort(keys, order.price * sign)
+        queue.append(order)
+        depth[order.price] += order.remaining
+        self.orders[order.id] = order
+
+    def cancel(self, order_id: UUID) -> Optional[BookOrder]:
+        order = self.orders.pop(order_id, None)
+        if order is None:
+            return None
+        levels, keys, sign, depth = self._side(order.is_bid)
+        queue = levels[order.price]
+        queue.remove(order)
+        depth[order.price] -= order.remaining
+        if not queue:
+            del levels[order.price]
+            del depth[order.price]
+            del keys[bisect_left(keys, order.price * sign)]
+        if order.is_bid:
+            self._changed([order.price], [])
+        else:
+            self._changed([], [order.price])
+        return order
+
+
+class MirrorBook:
+    """L2 уровни книги, которую ведет другой воркер кластера.
+
+    Сводить здесь нечего: владелец присылает снимок уровней и затем дельты с тем же seq,
+    что у его книги, а зеркало раздает их своим слушателям, как это делает OrderBook.
+    """
+
+    def __init__(self, ticker: str, listeners=()):
+        self.ticker = ticker
+        self.seq = 0
+        self.listeners = listeners
+        self._bid_qty: Dict[int, int] = {}
+        self._ask_qty: Dict[int, int] = {}
+
+    def best_bid(self) -> Optional[int]:
+        return max(self._bid_qty) if self._bid_qty else None
+
+    def best_ask(self) -> Optional[int]:
+        return min(self._ask_qty) if self._ask_qty else None
+
+    def levels(self):
+        return len(self._bid_qty), len(self._ask_qty)
+
+    def depth(self, limit: int):
+        if limit <= 0:
+            return [], []
+        return heapq.nlargest(limit, self._bid_qty.items()), heapq.nsmallest(limit, self._ask_qty.items())
+
+    def load(self, seq: int, bids, asks):
+        self.seq = seq
+        self._bid_qty = dict(bids)
+        self._ask_qty = dict(asks)
+
+    def apply(self, seq: int, bids, asks):
+        """Дельта владельца: новые объемы уровней, 0 - уровень исчез"""
+        for levels, qty in ((bids, self._bid_qty), (asks, self._ask_qty)):
+            for price, amount in levels:
+                if amount:
+                    qty[price] = amount
+                else:
+                    qty.pop(price, None)
+        self.seq = seq
+        for listener in self.listeners:
+            listener(self, bids, asks)
+
+
+class MatchingEngine:
+
+    def __init__(self):
+        self.books: Dict[str, OrderBook] = {}
+        # книги тикеров, которыми владеют другие воркеры кластера
+        self.mirrors: Dict[str, MirrorBook] = {}
+        self.listeners = []
+        self.trade_listeners = []
+        self.journal = None
+
+    def book(self, ticker: str) -> OrderBook:
+        book = self.books.get(ticker)
+        if book is None:
+            book = self.books[ticker] = OrderBook(ticker, self.listeners)
+        return book
+
+    def submit(self, ticker: str, order: BookOrder) -> List[Fill]:
+        if self.journal is not None:
+            self.journal.append_order(ticker, order)
+        return self.book(ticker).submit(order)
+
+    def cancel(self, ticker: str, order_id: UUID) -> Optional[BookOrder]:
+        book = self.books.get(ticker)
+        order = book.cancel(order_id) if book is not None else None
+        if order is not None and self.journal is not None:
+            self.journal.append_cancel(ticker, order_id)
+        return order
+
+    async def sync(self):
+        """Ждет, пока события книг окажутся в журнале на диске."""
+        if self.journal is not None:
+            await self.journal.sync()
+
+    def view(self, ticker: str):
+        """Книга для чтения: своя или зеркало книги другого воркера"""
+        book = self.books.get(ticker)
+        return book if book is not None else self.mirrors.get(ticker)
+
+    def mirror(self, ticker: str) -> MirrorBook:
+        book = self.mirrors.get(ticker)
+        if book is None:
+            book = self.mirrors[ticker] = MirrorBook(ticker, self.listeners)
+        return book
+
+    def depth(self, ticker: str, limit: int):
+        book = self.view(ticker)
+        if book is None:
+            return [], []
+        return book.depth(limit)
+
+    def publish_trades(self, ticker: str, trades: List[dict]):
+        """Сообщает слушателям о сделках, уже записанных в базу."""
+        for listener in self.trade_listeners:
+            listener(ticker, trades)
+
+    def drop(self, ticker: str):
+        self.mirrors.pop(ticker, None)
+        if self.books.pop(ticker, None) is not None and self.journal is not None:
+            self.journal.append_drop(ticker)
+
+    def drop_user(self, user_id: UUID):
+        for ticker, book in self.books.items():
+            for order in [order for order in book.orders.values() if order.user_id == user_id]:
+                self.cancel(ticker, order.id)
+
+
+engine = MatchingEngine()
@@ -1,15 +1,88 @@
 import asyncio
+import os
+import time
+import uuid
+from contextlib import asynccontextmanager
+from datetime import datetime, timezone
 from typing import List, Dict
-from fastapi import FastAPI, APIRouter, Header, HTTPException, Depends, Request
+from fastapi import FastAPI, APIRouter, Header, HTTPException, Depends, Request, WebSocket, WebSocketDisconnect, Body, \
+    Query
+from fastapi.responses import StreamingResponse, PlainTextResponse, ORJSONResponse
+import orjson
 from fastapi_restful.cbv import cbv
 from pydantic import UUID4
-from sqlalchemy import inspect
 
 from models import Transaction, L2OrderBook, Level, Instrument, UserRole, User, NewUser, \
     CreateOrderResponse, LimitOrderBody, MarketOrder, LimitOrder, MarketOrderBody, Ok, Direction, Deposit, Withdraw, \
-    OrderStatus
+    OrderStatus, BatchItemResult, InstrumentResult, InstrumentsAdded, Candle, CandleInterval, TickerSummary
 import uvicorn
-from src.backend.database.orm import PublicORM, AuthORM, BalanceORM, AdminORM, OrderORM
+from src.backend.database.database import settings
+from src.backend.database.pipeline import writer
+from src.backend.database.settlement import settlement
+from src.backend.database.orm import PublicORM, AuthORM, BalanceORM, AdminORM, OrderORM, CandleORM, encode_cursor, \
+    QUOTE_TICKER
+from src.backend.engine.journal import Journal
+from src.backend.engine.matching import BookOrder, engine
+from src.backend.engine.actors import actors
+from src.backend.server.cluster import cluster
+from src.backend.engine.ledger import ledger
+from src.backend.server.marketdata import orderbook_feed, trade_tape, DISCONNECT
+from src.backend.server.candles import candles, epoch
+from src.backend.server.summary import market_summary, WINDOW
+from src.backend.server.metrics import MetricsMiddleware, registry
+from src.backend.server.profiling import QueryProfilingMiddleware
+
+
+class FastJSONResponse(ORJSONResponse):
+    """Готовые dict/list сразу в JSON через orjson, без повторной проверки по response_model.
+
+    Время с часовым поясом UTC пишется с суффиксом Z, как это делает Pydantic.
+    """
+
+    @staticmethod
+    def default(value):
+        # asyncpg отдает свой подкласс UUID, а orjson сам сериализует только uuid.UUID
+        if isinstance(value, uuid.UUID):
+            return str(value)
+        raise TypeError
+
+    def render(self, content) -> bytes:
+        return orjson.dumps(content, default=self.default, option=orjson.OPT_UTC_Z)
+
+
+def order_json(order) -> dict:
+    """Строка заявки в виде LimitOrder или MarketOrder"""
+    body = {"direction": order.direction, "ticker": order.ticker, "qty": order.qty}
+    if order.price is None:
+        return {"id": order.id, "status": order.status, "user_id": order.user_id, "timestamp": order.timestamp,
+                "body": body}
+    body["price"] = order.price
+    return {"id": order.id, "status": order.status, "user_id": order.user_id, "timestamp": order.timestamp,
+            "body": body, "filled": order.filled}
+
+
+def done_ids(results) -> set:
+    """id из результатов команд place/cancel по тикерам, которые дошли до базы"""
+    done = set()
+    for result in results:
+        if not isinstance(result, BaseException):
+            done |= result
+    return done
+
+
+async def forget_instrument(ticker):
+    """Убирает удаленный инструмент из памяти этого воркера"""
+    await AdminORM.forget_instrument(ticker)
+    market_summary.drop(ticker)
+    candles.drop(ticker)
+
+
+def add_tickers(tickers):
+    for ticker in tickers:
+        market_summary.add(ticker)
+
+
+cluster.register(forget_instrument=forget_instrument, add_tickers=add_tickers)
 
 
 async def verify_user_token(authorization: str = Header(...)):
@@ -28,7 +101,62 @@ async def verify_admin_token(authorization: str = Header(...)):
     raise HTTPException(status_code=401)
 
 
-app = FastAPI(debug=False)
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    journal = None
+    if cluster.workers > 1 and not settings.JOURNAL_DIR:
+        # без журнала балансы пишутся вместе с заявками, а резерв quote у другого воркера - отдельно от них
+        raise RuntimeError("cluster workers need JOURNAL_DIR")
+    if settings.JOURNAL_DIR:
+        journal = Journal(cluster.journal_dir(settings.JOURNAL_DIR), settings.JOURNAL_FSYNC_INTERVAL,
+                          settings.JOURNAL_SNAPSHOT_INTERVAL)
+    active = None
+    tail = []
+    if journal is None or not journal.load(engine, ledger, tail):
+        active = await OrderORM.active_orders()
+        OrderORM.load_books(active)
+    if not ledger.restored:
+        # резерв покупок ведет владелец quote, а их книги могут быть у других воркеров, поэтому берем из базы
+        if active is None:
+            active = await OrderORM.active_orders()
+        ledger.load((row for row in await BalanceORM.load_balances() if cluster.local(row.ticker)),
+                    ((ticker, order) for ticker, order in active
+                     if cluster.local(QUOTE_TICKER if order.is_bid else ticker)), QUOTE_TICKER)
+    writer.start(OrderORM.write_batch)
+    settlement.start(writer.submit, os.path.join(cluster.journal_dir(settings.SETTLEMENT_DEAD_LETTER_DIR),
+                                                 "settlement.jsonl"), None if journal is not None else 1)
+    if journal is not None:
+        # решения хвоста могли не дойти до базы до сбоя; первый снимок дождется их проводки
+        OrderORM.recover(tail)
+        journal.start(engine, ledger, settlement.barrier)
+        await journal.write_snapshot(engine, ledger)
+    ledger.start(BalanceORM.save_balances)
+    trade_tape.load(await PublicORM.recent_transactions(trade_tape.size))
+    # пересчет свечей общий для всех тикеров, его достаточно сделать одному воркеру
+    if cluster.worker_id == 0:
+        await CandleORM.backfill(await CandleORM.backfill_start())
+    candles.load(await CandleORM.recent_candles(candles.size))
+    candles.start(CandleORM.save_candles, cluster.local)
+    since = datetime.fromtimestamp(time.time() - WINDOW, timezone.utc)
+    market_summary.load([instrument.ticker for instrument in await PublicORM.select_instruments()],
+                        await CandleORM.minute_candles(since), await CandleORM.last_prices())
+    await cluster.start()
+    if cluster.workers > 1 and cluster.local(QUOTE_TICKER):
+        await OrderORM.reconcile_quote()
+    yield
+    await cluster.stop()
+    await actors.stop()
+    await settlement.stop()
+    await ledger.stop()
+    await candles.stop()
+    await writer.stop()
+    if journal is not None:
+        await journal.stop(engine, ledger)
+
+
+app = FastAPI(debug=settings.DEBUG, lifespan=lifespan)
+app.add_middleware(MetricsMiddleware)
+app.add_middleware(QueryProfilingMiddleware)
 public_router = APIRouter(prefix='/api/v1')
 balance_router = APIRouter(prefix='/api/v1', dependencies=[Depends(verify_user_token)])
 order_router = APIRouter(prefix='/api/v1', dependencies=[Depends(verify_user_token)])
@@ -53,30 +181,78 @@ class PublicCBV:
 
     @public_router.get("/public/instrument", response_model=List[Instrument], tags=["public"])
     async def list_instruments(self):
-        response = []
-        for i in await PublicORM.select_instruments():
-            response.append(Instrument(name=i.name, ticker=i.ticker))
-        return response
+        return FastJSONResponse([{"name": i.name, "ticker": i.ticker} for i in await PublicORM.select_instruments()])
 
     @public_router.get("/public/orderbook/{ticker}", response_model=L2OrderBook, tags=["public"])
-    async def get_orderbook(self, ticker: str, limit=10):
-        query = await PublicORM.select_orderbook(ticker, limit)
-        bid_levels = [Level(price=i.cost, qty=i.qty) for i in query[0]]
-        ask_levels = [Level(price=i.cost, qty=i.qty) for i in query[1]]
+    async def get_orderbook(self, ticker: str, limit: int = 10):
+        bids, asks = engine.depth(ticker, limit)
+        bid_levels = [Level(price=price, qty=qty) for price, qty in bids]
+        ask_levels = [Level(price=price, qty=qty) for price, qty in asks]
         return L2OrderBook(
             bid_levels=bid_levels,
             ask_levels=ask_levels
         )
 
+    @public_router.get("/public/ticker", response_model=List[TickerSummary], tags=["public"])
+    async def list_tickers(self):
+        """Сводка по всем инструментам за последние сутки"""
+        return [TickerSummary(**summary) for summary in market_summary.summaries()]
+
+    @public_router.get("/public/ticker/{ticker}", response_model=TickerSummary, tags=["public"])
+    async def get_ticker(self, ticker: str):
+        summary = market_summary.summary(ticker)
+        if summary is None:
+            raise HTTPException(status_code=404, detail="Instrument not found")
+        return TickerSummary(**summary)
+
     @public_router.get("/public/transactions/{ticker}", response_model=List[Transaction], tags=["public"])
-    async def get_transaction_history(self, ticker: str, limit=10):
-        """История сделок"""
-        return [Transaction(
-            ticker=i.ticker,
-            amount=i.amount,
-            price=i.price,
-            timestamp=i.timestamp
-        ) for i in await PublicORM.transactions(ticker, limit)]
+    async def get_transaction_history(self, ticker: str,
+                                      limit: int = Query(10, ge=1, le=1000),
+                                      before: str | None = None, after: str | None = None,
+                                      start: datetime | None = Query(None, alias="from"),
+                                      end: datetime | None = Query(None, alias="to")):
+        """История сделок от новых к старым; курсоры страниц - в заголовках X-Before-Cursor и X-After-Cursor"""
+        if before is None and after is None and start is None and end is None and limit <= trade_tape.size:
+            trades = trade_tape.recent(ticker, limit)
+        else:
+            trades = await PublicORM.transactions(ticker, limit, before, after, start, end)
+        headers = {}
+        if trades:
+            headers["X-Before-Cursor"] = encode_cursor(trades[-1]["timestamp"], trades[-1]["id"])
+            headers["X-After-Cursor"] = encode_cursor(trades[0]["timestamp"], trades[0]["id"])
+        return FastJSONResponse([{"ticker": trade["ticker"], "amount": trade["amount"], "price": trade["price"],
+                                  "timestamp": trade["timestamp"]} for trade in trades], headers=headers)
+
+    @public_router.get("/public/candles/{ticker}", response_model=List[Candle], tags=["public"])
+    async def get_candles(self, ticker: str, interval: CandleInterval = CandleInterval.M1,
+                          limit: int = Query(500, ge=1, le=1000),
+                          start: datetime | None = Query(None, alias="from"),
+                          end: datetime | None = Query(None, alias="to")):
+        """Свечи OHLCV от старых к новым: последние limit в диапазоне [from, to)"""
+        bars = candles.select(ticker, interval.value, start, end, limit)
+        oldest = candles.oldest(ticker, interval.value)
+        if len(bars) < limit and (oldest is None or start is None or epoch(start) < epoch(oldest)):
+            if oldest is not None and (end is None or epoch(oldest) < epoch(end)):
+                end = oldest
+            bars = await CandleORM.select_candles(ticker, interval.value, start, end, limit - len(bars)) + bars
+        return FastJSONResponse([dict(bar) for bar in bars])
+
+    @public_router.get("/public/transactions/{ticker}/stream", tags=["public"])
+    async def stream_transactions(self, ticker: str, last: int = 0):
+        """Лента сделок (Server-Sent Events)"""
+
+        async def events():
+            subscriber = trade_tape.subscribe(ticker)
+            try:
+                for message in trade_tape.history(ticker, last):
+                    yield f"data: {message}\n\n"
+                while (message := await subscriber.queue.get()) is not None:
+                    yield f"data: {message}\n\n"
+            finally:
+                trade_tape.unsubscribe(ticker, subscriber)
+
+        return StreamingResponse(events(), media_type="text/event-stream",
+                                 headers={"Cache-Control": "no-cache"})
 
 
 @cbv(balance_router)
@@ -86,8 +262,7 @@ class BalanceCBV:
     @balance_router.get("/balance", tags=["balance"])
     async def get_balances(self, request: Request) -> Dict[str, int]:
         """Получить балансы"""
-        balance = await BalanceORM.get_balance(request.headers["Authorization"][6:])
-        return {i.ticker: i.amount for i in balance}
+        return await BalanceORM.get_balance(request.headers["Authorization"][6:])
 
 
 @cbv(order_router)
@@ -102,31 +277,78 @@ class OrderCBV:
         query = await OrderORM.create_order(request.headers["Authorization"][6:], order)
         return CreateOrderResponse(order_id=query)
 
-    @order_router.get("/order", response_model=List[LimitOrder | MarketOrder], tags=["order"])
-    async def list_orders(self):
-        query = await OrderORM.orders_list()
-        response = []
-        for order in query:
-            if getattr(order, "price") and order.price is not None:
-                attrs = {c.key: getattr(order, c.key) for c in inspect(order).mapper.column_attrs}
-                body = LimitOrderBody(**attrs)
-                attrs["body"] = body
-                entry = LimitOrder(**attrs)
-                response.append(entry)
+    @order_router.post("/order/batch", response_model=List[BatchItemResult], tags=["order"])
+    async def create_orders(self, request: Request,
+                            orders: List[LimitOrderBody | MarketOrderBody]):
+        """Пакетное выставление заявок"""
+        if len(orders) > settings.ORDER_BATCH_SIZE:
+            raise HTTPException(status_code=422, detail="Batch is too large")
+        identity = await AuthORM.identify(request.headers["Authorization"][6:])
+        for order in orders:
+            if order.ticker is None:
+                order.ticker = "RUB"
+        tickers = await OrderORM.known_tickers({order.ticker for order in orders})
+        results = [BatchItemResult() for _ in orders]
+        groups = {}
+        for result, order in zip(results, orders):
+            price = getattr(order, "price", None)
+            if order.ticker not in tickers:
+                result.success, result.detail = False, "Instrument not found"
             else:
-                attrs = {c.key: getattr(order, c.key) for c in inspect(order).mapper.column_attrs}
-                body = MarketOrderBody(**attrs)
-                attrs["body"] = body
-                entry = MarketOrder(**attrs)
-                response.append(entry)
-        return response
+                book_order = BookOrder(uuid.uuid4(), identity.user_id, order.direction, order.qty, price)
+                result.order_id = book_order.id
+                groups.setdefault(order.ticker, []).append(book_order)
+        accepted = done_ids(await asyncio.gather(
+            *(cluster.route(ticker, "place", ticker, group) for ticker, group in groups.items()),
+            return_exceptions=True))
+        await OrderORM.pin(identity.user_id)
+        for result in results:
+            if result.success and result.order_id not in accepted:
+                result.success, result.order_id, result.detail = False, None, "Order rejected"
+        return results
+
+    @order_router.delete("/order/batch", response_model=List[BatchItemResult], tags=["order"])
+    async def cancel_orders(self, request: Request, order_ids: List[UUID4] = Body(...)):
+        """Пакетная отмена заявок"""
+        if len(order_ids) > settings.ORDER_BATCH_SIZE:
+            raise HTTPException(status_code=422, detail="Batch is too large")
+        identity = await AuthORM.identify(request.headers["Authorization"][6:])
+        orders = {order.id: order for order in await OrderORM.select_orders(order_ids, identity.user_id)
+                  if order.user_id == identity.user_id}
+        groups = {}
+        for order in orders.values():
+            groups.setdefault(order.ticker, []).append(order.id)
+        done = done_ids(await asyncio.gather(
+            *(cluster.route(ticker, "cancel", ticker, group) for ticker, group in groups.items()),
+            return_exceptions=True))
+        await OrderORM.pin(identity.user_id)
+        results = []
+        for order_id in order_ids:
+            if order_id in done:
+                results.append(BatchItemResult(order_id=order_id))
+            elif order_id in orders:
+                results.append(BatchItemResult(success=False, order_id=order_id, detail="Order is not active"))
+            else:
+                results.append(BatchItemResult(success=False, order_id=order_id, detail="Order not found"))
+        return results
+
+    @order_router.get("/order", response_model=List[LimitOrder | MarketOrder], tags=["order"])
+    async def list_orders(self, request: Request, status: OrderStatus | None = None,
+                          ticker: str | None = None, cursor: str | None = None,
+                          limit: int = Query(100, ge=1, le=1000)):
+        """Заявки пользователя; следующая страница - по курсору из заголовка X-Next-Cursor"""
+        identity = await AuthORM.identify(request.headers["Authorization"][6:])
+        orders, next_cursor = await OrderORM.orders_list(identity.user_id, status, ticker, cursor, limit)
+        headers = {"X-Next-Cursor": next_cursor} if next_cursor is not None else {}
+        return FastJSONResponse([order_json(order) for order in orders], headers=headers)
 
     @order_router.get("/order/{order_id}", response_model=LimitOrder | MarketOrder, tags=["order"])
-    async def get_order(self, order_id: UUID4):
-        order = await OrderORM.get_order(order_id)
+    async def get_order(self, request: Request, order_id: UUID4):
+        identity = await AuthORM.identify(request.headers["Authorization"][6:])
+        order = await OrderORM.get_order(order_id, identity.user_id)
         base_attrs = {
             "id": order.id,
-            "status": OrderStatus,
+            "status": order.status,
             "user_id": order.user_id,
             "timestamp": order.timestamp,
             "filled": order.filled
@@ -152,8 +374,10 @@ class OrderCBV:
             )
 
     @order_router.delete("/order/{order_id}", response_model=Ok, tags=["order"])
-    async def cancel_order(self, order_id: UUID4):
-        await OrderORM.cancel_order(order_id)
+    async def cancel_order(self, request: Request, order_id: UUID4):
+        identity = await AuthORM.identify(request.headers["Authorization"][6:])
+        order = await OrderORM.get_order(order_id, identity.user_id, fresh=True)
+        await OrderORM.cancel_order(order)
         return Ok()
 
 
@@ -172,38 +396,92 @@ class AdminCBV:
             api_key=user.api_key
         )
 
-    @admin_router.post("/admin/instrument", response_model=Ok, tags=["admin"])
+    @admin_router.post("/admin/instrument", response_model=InstrumentsAdded | Ok, tags=["admin"])
     async def add_instrument(self,
                              instrument: List[Instrument] | Instrument):
         if isinstance(instrument, list):
+            created = await AdminORM.add_instruments(instrument)
+            await cluster.gather("add_tickers", created)
+            results = []
             for instr in instrument:
-                await AdminORM.add_instrument(instr.ticker, instr.name)
-        else:
-            await AdminORM.add_instrument(instrument.ticker, instrument.name)
+                results.append(InstrumentResult(ticker=instr.ticker, created=instr.ticker in created))
+                created.discard(instr.ticker)
+            return InstrumentsAdded(results=results)
+        if not await AdminORM.add_instruments([instrument]):
+            raise HTTPException(status_code=422)
+        await cluster.gather("add_tickers", [instrument.ticker])
         return Ok()
 
     @admin_router.delete("/admin/instrument/{ticker}", response_model=Ok, tags=["admin"])
     async def delete_instrument(self, ticker: str):
         await AdminORM.delete_instrument(ticker)
+        await cluster.gather("forget_instrument", ticker)
         return Ok()
 
     @admin_router.post("/admin/balance/deposit", response_model=Ok, tags=["admin", "balance"])
     async def deposit(self, deposit: Deposit):
-        await AdminORM.do_deposit(deposit.user_id, deposit.ticker, deposit.amount)
+        await cluster.route(deposit.ticker, "deposit", deposit.user_id, deposit.ticker, deposit.amount)
 
         return Ok()
 
     @admin_router.post("/admin/balance/withdraw", response_model=Ok, tags=["admin", "balance"])
     async def withdraw(self, withdraw: Withdraw):
         """Вывод средств"""
-        await AdminORM.do_withdraw(withdraw.user_id, withdraw.ticker, withdraw.amount)
+        await cluster.route(withdraw.ticker, "withdraw", withdraw.user_id, withdraw.ticker, withdraw.amount)
         return Ok()
 
 
+@app.websocket("/ws/orderbook/{ticker}")
+async def orderbook_stream(websocket: WebSocket, ticker: str):
+    """Снимок L2 стакана, затем дельты уровней с возрастающим seq"""
+    await websocket.accept()
+    subscriber = orderbook_feed.subscribe(ticker)
+    try:
+        await websocket.send_text(orderbook_feed.snapshot(ticker))
+        while True:
+            message = await subscriber.queue.get()
+            if message is None:
+                if orderbook_feed.policy == DISCONNECT:
+                    await websocket.close(code=1013)
+                    break
+                while not subscriber.queue.empty():
+                    subscriber.queue.get_nowait()
+                message = orderbook_feed.snapshot(ticker)
+            await websocket.send_text(message)
+    except WebSocketDisconnect:
+        pass
+    finally:
+        orderbook_feed.unsubscribe(ticker, subscriber)
+
+
+@app.websocket("/ws/trades/{ticker}")
+async def trades_stream(websocket: WebSocket, ticker: str, last: int = 0):
+    """Последние last сделок из буфера, затем новые сделки по мере появления"""
+    await websocket.accept()
+    subscriber = trade_tape.subscribe(ticker)
+    try:
+        for message in trade_tape.history(ticker, last):
+            await websocket.send_text(message)
+        while (message := await subscriber.queue.get()) is not None:
+            await websocket.send_text(message)
+        await websocket.close(code=1013)
+    except WebSocketDisconnect:
+        pass
+    finally:
+        trade_tape.unsubscribe(ticker, subscriber)
+
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    """Метрики в текстовом формате Prometheus"""
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
+
+
 app.include_router(public_router)
 app.include_router(admin_router)
 app.include_router(balance_router)
 app.include_router(order_router)
 
 if __name__ == "__main__":
-    uvicorn.run("src.backend.server.api:app", host='0.0.0.0', port=80, reload=True)
+    # один процесс; несколько воркеров с разбиением тикеров - python -m src.backend.server.cluster
+    uvicorn.run("src.backend.server.api:app", host='0.0.0.0', port=80)
@@ -0,0 +1,178 @@
+import asyncio
+import sys
+import time
+from collections import deque
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
+
+from src.backend.database.database import settings
+from src.backend.engine.matching import engine
+
+INTERVALS = {"1s": 1, "1m": 60, "5m": 300, "1h": 3600, "1d": 86400}
+
+
+def epoch(timestamp: datetime) -> float:
+    """Секунды Unix; время без часового пояса считаем UTC - так оно и лежит в базе"""
+    if timestamp.tzinfo is None:
+        timestamp = timestamp.replace(tzinfo=timezone.utc)
+    return timestamp.timestamp()
+
+
+class Bar:
+    __slots__ = ("start", "open", "high", "low", "close", "volume", "dirty")
+
+    def __init__(self, start: int, open: int, high: int, low: int, close: int, volume: int, dirty: bool = True):
+        self.start = start
+        self.open = open
+        self.high = high
+        self.low = low
+        self.close = close
+        self.volume = volume
+        self.dirty = dirty
+
+    def row(self) -> dict:
+        return {"timestamp": datetime.fromtimestamp(self.start, timezone.utc), "open": self.open, "high": self.high,
+                "low": self.low, "close": self.close, "volume": self.volume}
+
+
+class CandleAggregator:
+    """Свечи OHLCV по тикерам и интервалам, обновляемые на каждой сделке.
+
+    В памяти по каждой паре тикер-интервал держим последние size баров.
+    Измененный бар, который закрылся (сделка открыла следующий или его период истек),
+    попадает в pending, и раз в flush_interval секунд pending пачкой сохраняется в таблицу candle.
+    """
+
+    def __init__(self, size: int, flush_interval: float):
+        self.size = size
+        self.flush_interval = flush_interval
+        self.bars: Dict[Tuple[str, str], deque] = {}
+        self.pending: Dict[Tuple[str, str, int], Bar] = {}
+        self._save = None
+        self._task = None
+        # в кластере бары видят все воркеры, а сохраняет только владелец тикера
+        self._owns = None
+
+    def _series(self, ticker: str, interval: str) -> deque:
+        bars = self.bars.get((ticker, interval))
+        if bars is None:
+            bars = self.bars[ticker, interval] = deque(maxlen=self.size)
+        return bars
+
+    def _close(self, ticker: str, interval: str, bar: Bar):
+        if bar.dirty and (self._owns is None or self._owns(ticker)):
+            self.pending[ticker, interval, bar.start] = bar
+
+    def add(self, ticker: str, price: int, amount: int, moment: float):
+        for interval, step in INTERVALS.items():
+            start = int(moment // step) * step
+            bars = self._series(ticker, interval)
+            last = bars[-1] if bars else None
+            if last is None or last.start < start:
+                if last is not None:
+                    self._close(ticker, interval, last)
+                bars.append(Bar(start, price, price, price, price, amount))
+                continue
+            # сделка могла опоздать в уже закрытый бар: цену закрытия тогда не трогаем,
+            # а бара, ушедшего из памяти, коснется только пересчет из таблицы transaction
+            for bar in reversed(bars):
+                if bar.start <= start:
+                    break
+            if bar.start != start:
+                continue
+            bar.high = max(bar.high, price)
+            bar.low = min(bar.low, price)
+            bar.volume += amount
+            bar.dirty = True
+            if bar is last:
+                bar.close = price
+            else:
+                self._close(ticker, interval, bar)
+
+    def publish(self, ticker: str, trades: List[dict]):
+        for trade in trades:
+            self.add(ticker, trade["price"], trade["amount"], epoch(trade["timestamp"]))
+
+    def load(self, candles: List[dict]):
+        """Загружает сохраненные свечи; ожидаются от старых к новым"""
+        for candle in candles:
+            self._series(candle["ticker"], candle["interval"]).append(
+                Bar(int(epoch(candle["timestamp"])), candle["open"], candle["high"], candle["low"], candle["close"],
+                    candle["volume"], dirty=False))
+
+    def drop(self, ticker: str):
+        for interval in INTERVALS:
+            self.bars.pop((ticker, interval), None)
+        self.pending = {key: bar for key, bar in self.pending.items() if key[0] != ticker}
+
+    def oldest(self, ticker: str, interval: str) -> Optional[datetime]:
+        """Начало самого старого бара в памяти; все, что раньше, - только в базе"""
+        bars = self.bars.get((ticker, interval))
+        return datetime.fromtimestamp(bars[0].start, timezone.utc) if bars else None
+
+    def select(self, ticker: str, interval: str, start: Optional[datetime] = None,
+               end: Optional[datetime] = None, limit: int = 500) -> List[dict]:
+        """Последние limit баров из памяти в диапазоне [start, end), от старых к новым"""
+        lower = -1 if start is None else epoch(start)
+        upper = float("inf") if end is None else epoch(end)
+        rows = []
+        for bar in reversed(self.bars.get((ticker, interval), ())):
+            if len(rows) == limit or bar.start < lower:
+                break
+            if bar.start < upper:
+                rows.append(bar.row())
+        rows.reverse()
+        return rows
+
+    async def flush(self, everything: bool = False):
+        """Сохраняет закрытые измененные бары, а с everything - и открытые"""
+        now = time.time()
+        for (ticker, interval), bars in self.bars.items():
+            if bars and (everything or bars[-1].start + INTERVALS[interval] <= now):
+                self._close(ticker, interval, bars[-1])
+        if not self.pending:
+            return
+        pending, self.pending = self.pending, {}
+        rows = []
+        for (ticker, interval, _), bar in pending.items():
+            rows.append({"ticker": ticker, "interval": interval, **bar.row()})
+            bar.dirty = False
+        try:
+            await self._save(rows)
+        except Exception:
+            for key, bar in pending.items():
+                bar.dirty = True
+                self.pending.setdefault(key, bar)
+            raise
+
+    def start(self, save, owns=None):
+        self._save = save
+        self._owns = owns
+        self._task = asyncio.create_task(self._flusher())
+
+    async def stop(self):
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        await self.flush(everything=True)
+
+    async def _flusher(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception:
+                # бары вернулись в pending, попробуем на следующем шаге
+                pass
+
+
+candles = CandleAggregator(settings.CANDLE_HISTORY, settings.CANDLE_FLUSH_INTERVAL)
+engine.trade_listeners.append(candles.publish)
+
+
+if __name__ == "__main__":
+    from src.backend.database.orm import CandleORM
+
+    backfill_since = datetime.fromisoformat(sys.argv[1]) if len(sys.argv) > 1 else None
+    started = time.perf_counter()
+    written = asyncio.run(CandleORM.backfill(backfill_since))
+    print(f"{written} candles in {time.perf_counter() - started:.3f}s")
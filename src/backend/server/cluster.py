@@ -0,0 +1,305 @@
+import argparse
+import asyncio
+import inspect
+import logging
+import multiprocessing
+import multiprocessing.connection
+import os
+import pickle
+import shutil
+import signal
+import struct
+import sys
+import tempfile
+import zlib
+from typing import Callable, Dict, List, Set
+
+import uvicorn
+from fastapi import HTTPException
+
+from src.backend.database.database import settings
+from src.backend.engine.matching import engine
+
+logger = logging.getLogger(__name__)
+
+FRAME = struct.Struct("<I")
+REQUEST, REPLY, PUSH = 0, 1, 2
+
+
+def frame(message) -> bytes:
+    body = pickle.dumps(message, pickle.HIGHEST_PROTOCOL)
+    return FRAME.pack(len(body)) + body
+
+
+async def read_frame(reader: asyncio.StreamReader):
+    size, = FRAME.unpack(await reader.readexactly(FRAME.size))
+    return pickle.loads(await reader.readexactly(size))
+
+
+class Peer:
+    """Соединение с другим воркером: запросы к его командам и поток рассылок от него"""
+
+    def __init__(self, worker: int, path: str, on_push: Callable):
+        self.worker = worker
+        self.path = path
+        self.on_push = on_push
+        self.pending: Dict[int, asyncio.Future] = {}
+        self.last_id = 0
+        self.writer = None
+        self._task = None
+
+    async def connect(self, timeout: float):
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while True:
+            try:
+                reader, self.writer = await asyncio.open_unix_connection(self.path)
+                break
+            except (FileNotFoundError, ConnectionRefusedError):
+                if loop.time() >= deadline:
+                    raise
+                await asyncio.sleep(0.05)
+        self._task = asyncio.create_task(self._receive(reader))
+
+    async def call(self, command: str, *args):
+        if self.writer is None or self.writer.is_closing():
+            raise HTTPException(status_code=503, detail="Worker unavailable")
+        self.last_id += 1
+        request_id = self.last_id
+        future = self.pending[request_id] = asyncio.get_running_loop().create_future()
+        self.writer.write(frame((REQUEST, request_id, command, args)))
+        try:
+            return await future
+        finally:
+            self.pending.pop(request_id, None)
+
+    async def _receive(self, reader: asyncio.StreamReader):
+        try:
+            while True:
+                message = await read_frame(reader)
+                if message[0] == PUSH:
+                    self.on_push(message[1], message[2])
+                    continue
+                _, request_id, error, result = message
+                future = self.pending.get(request_id)
+                if future is None or future.done():
+                    continue
+                if error is None:
+                    future.set_result(result)
+                else:
+                    future.set_exception(HTTPException(status_code=error[0], detail=error[1]))
+        except (asyncio.IncompleteReadError, ConnectionError):
+            logger.warning("worker %d disconnected", self.worker)
+        finally:
+            self.writer.close()
+            for future in self.pending.values():
+                if not future.done():
+                    future.set_exception(HTTPException(status_code=503, detail="Worker unavailable"))
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+
+
+class Cluster:
+    """Несколько процессов-воркеров, поделивших тикеры по хэшу.
+
+    Книгу, актора и счета тикера ведет только воркер-владелец owner(ticker), поэтому команды,
+    меняющие их, маршрутизируются к нему через route по unix-сокетам соседей.
+    Владелец рассылает соседям дельты уровней своих книг и записанные сделки: у каждого воркера
+    есть зеркала всех книг, лента, свечи и сводка, и публичные запросы на чтение обслуживает любой.
+    Кадры - pickle, поэтому сокеты лежат в каталоге, доступном только пользователю сервиса.
+    С workers=1 все тикеры свои и кластер ничего не делает. Нескольким воркерам нужен журнал:
+    резерв quote и заявки тикера решают разные процессы, и согласованы они только в журналах.
+    """
+
+    def __init__(self, workers: int, worker_id: int, socket_dir: str, connect_timeout: float):
+        self.workers = workers
+        self.worker_id = worker_id
+        self.socket_dir = socket_dir
+        self.connect_timeout = connect_timeout
+        self.commands: Dict[str, Callable] = {}
+        self.peers: Dict[int, Peer] = {}
+        self.subscribers: Set[asyncio.StreamWriter] = set()
+        self._connections: Set[asyncio.StreamWriter] = set()
+        self._tasks: Set[asyncio.Task] = set()
+        self._server = None
+
+    def owner(self, ticker: str) -> int:
+        # crc32, а не hash(): разбиение должно совпадать во всех процессах и между перезапусками
+        return zlib.crc32(ticker.encode()) % self.workers
+
+    def local(self, ticker: str) -> bool:
+        return self.owner(ticker) == self.worker_id
+
+    def path(self, worker: int) -> str:
+        return os.path.join(self.socket_dir, f"worker-{worker}.sock")
+
+    def journal_dir(self, directory: str) -> str:
+        """Каждый воркер пишет журнал своих книг в свой подкаталог"""
+        return directory if self.workers == 1 else os.path.join(directory, f"worker-{self.worker_id}")
+
+    def register(self, **commands: Callable):
+        self.commands.update(commands)
+
+    async def _run(self, command: str, args):
+        result = self.commands[command](*args)
+        if inspect.isawaitable(result):
+            result = await result
+        return result
+
+    async def call(self, worker: int, command: str, *args):
+        if worker == self.worker_id:
+            return await self._run(command, args)
+        return await self.peers[worker].call(command, *args)
+
+    async def route(self, ticker: str, command: str, *args):
+        """Выполняет команду на воркере-владельце тикера"""
+        return await self.call(self.owner(ticker), command, *args)
+
+    async def gather(self, command: str, *args) -> List:
+        """Выполняет команду на всех воркерах, результаты - по номерам воркеров"""
+        return list(await asyncio.gather(*(self.call(worker, command, *args) for worker in range(self.workers))))
+
+    def publish_levels(self, book, bids, asks):
+        if self.subscribers and self.local(book.ticker):
+            self._push("levels", (book.ticker, book.seq, bids, asks))
+
+    def publish_trades(self, ticker: str, trades: List[dict]):
+        # сделки чужих тикеров пришли от их владельца, пересылать их дальше не нужно
+        if self.subscribers and self.local(ticker):
+            self._push("trades", (ticker, trades))
+
+    def _push(self, kind: str, payload):
+        message = frame((PUSH, kind, payload))
+        for writer in list(self.subscribers):
+            if writer.is_closing():
+                self.subscribers.discard(writer)
+            else:
+                writer.write(message)
+
+    def _on_push(self, kind: str, payload):
+        if kind == "levels":
+            ticker, seq, bids, asks = payload
+            engine.mirror(ticker).apply(seq, bids, asks)
+        elif kind == "trades":
+            engine.publish_trades(*payload)
+        elif kind == "books":
+            for ticker, seq, bids, asks in payload:
+                engine.mirror(ticker).load(seq, bids, asks)
+
+    def _books(self) -> list:
+        return [(ticker, book.seq, *book.depth(max(book.levels()))) for ticker, book in engine.books.items()]
+
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self._connections.add(writer)
+        try:
+            while True:
+                _, request_id, command, args = await read_frame(reader)
+                if command == "subscribe":
+                    # снимок уходит в том же потоке раньше первой дельты, так что зеркало не пропустит ни одной
+                    writer.write(frame((PUSH, "books", self._books())))
+                    writer.write(frame((REPLY, request_id, None, None)))
+                    self.subscribers.add(writer)
+                    continue
+                task = asyncio.create_task(self._answer(writer, request_id, command, args))
+                self._tasks.add(task)
+                task.add_done_callback(self._tasks.discard)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self.subscribers.discard(writer)
+            self._connections.discard(writer)
+            writer.close()
+
+    async def _answer(self, writer: asyncio.StreamWriter, request_id: int, command: str, args):
+        result, error = None, None
+        try:
+            result = await self._run(command, args)
+        except HTTPException as exc:
+            error = (exc.status_code, exc.detail)
+        except Exception:
+            logger.exception("cluster command %s failed", command)
+            error = (500, "Internal Server Error")
+        if not writer.is_closing():
+            writer.write(frame((REPLY, request_id, error, result)))
+
+    async def start(self):
+        """Поднимает свой сокет, подключается к соседям и получает снимки их книг"""
+        if self.workers == 1:
+            return
+        engine.listeners.append(self.publish_levels)
+        engine.trade_listeners.append(self.publish_trades)
+        os.makedirs(self.socket_dir, mode=0o700, exist_ok=True)
+        path = self.path(self.worker_id)
+        if os.path.exists(path):
+            os.unlink(path)
+        self._server = await asyncio.start_unix_server(self._serve, path)
+        await asyncio.gather(*(self._connect(worker) for worker in range(self.workers) if worker != self.worker_id))
+
+    async def _connect(self, worker: int):
+        peer = self.peers[worker] = Peer(worker, self.path(worker), self._on_push)
+        await peer.connect(self.connect_timeout)
+        await peer.call("subscribe")
+
+    async def stop(self):
+        if self._server is None:
+            return
+        self._server.close()
+        for writer in list(self._connections):
+            writer.close()
+        await asyncio.gather(*(peer.close() for peer in self.peers.values()))
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self.peers = {}
+        self._server = None
+
+
+cluster = Cluster(int(settings.WORKERS), int(settings.WORKER_ID), settings.CLUSTER_SOCKET_DIR,
+                  float(settings.CLUSTER_CONNECT_TIMEOUT))
+
+
+def run_worker(config: uvicorn.Config, sockets):
+    uvicorn.Server(config).run(sockets=sockets)
+
+
+def main():
+    """Запускает N воркеров на одном порту: сокет открывает родитель, каждый воркер принимает с него
+    соединения сам, а номер воркера и число воркеров получает через окружение"""
+    parser = argparse.ArgumentParser(description="Биржа в нескольких процессах с разбиением тикеров")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=80)
+    args = parser.parse_args()
+    if args.workers > 1 and not settings.JOURNAL_DIR:
+        parser.error("several workers need JOURNAL_DIR")
+    # api.py импортирует models как модуль верхнего уровня; sys.path передается воркерам при spawn
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    config = uvicorn.Config("src.backend.server.api:app", host=args.host, port=args.port)
+    sock = config.bind_socket()
+    socket_dir = tempfile.mkdtemp(prefix="exchange-cluster-")
+    context = multiprocessing.get_context("spawn")
+    processes = []
+    for worker in range(args.workers):
+        os.environ.update(WORKERS=str(args.workers), WORKER_ID=str(worker), CLUSTER_SOCKET_DIR=socket_dir)
+        process = context.Process(target=run_worker, args=(config, [sock]), name=f"worker-{worker}")
+        process.start()
+        processes.append(process)
+    # по SIGTERM родитель останавливает воркеров, а не оставляет их без присмотра
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    try:
+        # без любого из воркеров часть тикеров недоступна, поэтому первый упавший останавливает всех
+        multiprocessing.connection.wait([process.sentinel for process in processes])
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+        for process in processes:
+            process.join()
+        shutil.rmtree(socket_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+import asyncio
+import json
+from collections import deque
+from itertools import islice
+from typing import Dict, List, Set
+
+from src.backend.database.database import settings
+from src.backend.engine.matching import engine
+
+RESNAPSHOT = "resnapshot"
+DISCONNECT = "disconnect"
+
+
+class Subscriber:
+    __slots__ = ("queue",)
+
+    def __init__(self, maxsize: int):
+        self.queue = asyncio.Queue(maxsize)
+
+    def push(self, message: str) -> bool:
+        """Кладет сообщение в очередь; при переполнении очищает ее и оставляет маркер None."""
+        try:
+            self.queue.put_nowait(message)
+            return True
+        except asyncio.QueueFull:
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait(None)
+            return False
+
+
+class Feed:
+    """Подписчики по тикерам.
+
+    Сообщение сериализуется один раз и раскладывается по очередям подписчиков без ожидания,
+    поэтому медленный клиент не тормозит сведение заявок.
+    """
+
+    def __init__(self, queue_size: int):
+        self.queue_size = queue_size
+        self.subscribers: Dict[str, Set[Subscriber]] = {}
+
+    def subscribe(self, ticker: str) -> Subscriber:
+        subscriber = Subscriber(self.queue_size)
+        self.subscribers.setdefault(ticker, set()).add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, ticker: str, subscriber: Subscriber):
+        subscribers = self.subscribers.get(ticker)
+        if subscribers is not None:
+            subscribers.discard(subscriber)
+            if not subscribers:
+                del self.subscribers[ticker]
+
+    def broadcast(self, ticker: str, message: str):
+        for subscriber in self.subscribers.get(ticker, ()):
+            subscriber.push(message)
+
+
+class OrderBookFeed(Feed):
+    """Рассылка L2 дельт; переполнившему очередь клиенту в зависимости от policy
+    отправляется свежий снимок или соединение закрывается."""
+
+    def __init__(self, queue_size: int, policy: str):
+        super().__init__(queue_size)
+        self.policy = policy
+
+    def snapshot(self, ticker: str) -> str:
+        book = engine.view(ticker)
+        if book is None:
+            return json.dumps({"type": "snapshot", "ticker": ticker, "seq": 0, "bids": [], "asks": []})
+        bids, asks = book.depth(max(book.levels()))
+        return json.dumps({"type": "snapshot", "ticker": ticker, "seq": book.seq, "bids": bids, "asks": asks})
+
+    def publish(self, book, bids, asks):
+        if book.ticker not in self.subscribers:
+            return
+        message = json.dumps({"type": "delta", "ticker": book.ticker, "seq": book.seq, "bids": bids, "asks": asks})
+        self.broadcast(book.ticker, message)
+
+
+class TradeTape(Feed):
+    """Лента сделок: кольцевой буфер последних size сделок каждого тикера и рассылка новых.
+
+    Пропущенные сделки переслать нельзя без дублей, поэтому переполнившего очередь
+    подписчика отключаем - он переподключается и получает хвост из буфера.
+    """
+
+    def __init__(self, size: int, queue_size: int):
+        super().__init__(queue_size)
+        self.size = size
+        self.trades: Dict[str, deque] = {}
+        self.seq: Dict[str, int] = {}
+
+    def _append(self, ticker: str, trade: dict) -> str:
+        seq = self.seq[ticker] = self.seq.get(ticker, 0) + 1
+        message = json.dumps({"type": "trade", "ticker": ticker, "seq": seq, "amount": trade["amount"],
+                              "price": trade["price"], "timestamp": trade["timestamp"].isoformat()})
+        tape = self.trades.get(ticker)
+        if tape is None:
+            tape = self.trades[ticker] = deque(maxlen=self.size)
+        tape.append((trade, message))
+        return message
+
+    def load(self, trades: List[dict]):
+        for trade in trades:
+            self._append(trade["ticker"], trade)
+
+    def publish(self, ticker: str, trades: List[dict]):
+        for trade in trades:
+            self.broadcast(ticker, self._append(ticker, trade))
+
+    def recent(self, ticker: str, limit: int) -> List[dict]:
+        """Последние сделки, от новых к старым."""
+        tape = self.trades.get(ticker, ())
+        return [trade for trade, _ in islice(reversed(tape), limit)]
+
+    def history(self, ticker: str, last: int) -> List[str]:
+        """Сообщения последних last сделок, от старых к новым."""
+        if last <= 0:
+            return []
+        return [message for _, message in list(self.trades.get(ticker, ()))[-last:]]
+
+
+orderbook_feed = OrderBookFeed(settings.WS_QUEUE_SIZE, settings.WS_SLOW_CONSUMER_POLICY)
+engine.listeners.append(orderbook_feed.publish)
+trade_tape = TradeTape(settings.TRADE_TAPE_SIZE, settings.WS_QUEUE_SIZE)
+engine.trade_listeners.append(trade_tape.publish)
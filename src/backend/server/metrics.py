@@ -0,0 +1,216 @@
+import functools
+import inspect
+import time
+from bisect import bisect_left
+from typing import Callable, Dict, List, Tuple
+
+from src.backend.database.database import TimedPool, engine_pg, read_session_var, replica_engines
+from src.backend.database.pipeline import writer
+from src.backend.database.settlement import settlement
+from src.backend.engine.actors import actors
+from src.backend.engine.ledger import ledger
+from src.backend.engine.matching import engine
+from src.backend.server.marketdata import orderbook_feed, trade_tape
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def render_labels(names: Tuple[str, ...], values: Tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Histogram:
+    """Гистограмма в формате Prometheus.
+
+    Все обновления идут из одного цикла событий, поэтому обходимся без блокировок:
+    наблюдение - это поиск корзины и пара сложений в списке.
+    """
+
+    def __init__(self, name: str, documentation: str, labels: Tuple[str, ...], buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self.buckets = buckets
+        self.series: Dict[Tuple, List] = {}
+
+    def observe(self, labels: Tuple, value: float):
+        series = self.series.get(labels)
+        if series is None:
+            # счетчики корзин, затем сумма и общее число наблюдений
+            series = self.series[labels] = [0] * (len(self.buckets) + 2)
+        series[bisect_left(self.buckets, value)] += 1
+        series[-2] += value
+        series[-1] += 1
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        for labels, series in list(self.series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                bucket = render_labels(self.labels, labels, 'le="%s"' % bound)
+                lines.append(f"{self.name}_bucket{bucket} {cumulative}")
+            bucket = render_labels(self.labels, labels, 'le="+Inf"')
+            lines.append(f"{self.name}_bucket{bucket} {series[-1]}")
+            lines.append(f"{self.name}_sum{render_labels(self.labels, labels)} {series[-2]}")
+            lines.append(f"{self.name}_count{render_labels(self.labels, labels)} {series[-1]}")
+        return lines
+
+
+class Gauge:
+    """Значения считаются в момент выдачи метрик функцией, возвращающей {метки: значение}."""
+
+    def __init__(self, name: str, documentation: str, labels: Tuple[str, ...], collect: Callable[[], Dict]):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self.collect = collect
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} gauge"]
+        for labels, value in self.collect().items():
+            lines.append(f"{self.name}{render_labels(self.labels, labels)} {value}")
+        return lines
+
+
+class Registry:
+
+    def __init__(self):
+        self.metrics = []
+
+    def histogram(self, name: str, documentation: str, labels: Tuple[str, ...] = (), **kwargs) -> Histogram:
+        metric = Histogram(name, documentation, labels, **kwargs)
+        self.metrics.append(metric)
+        return metric
+
+    def gauge(self, name: str, documentation: str, labels: Tuple[str, ...], collect: Callable[[], Dict]) -> Gauge:
+        metric = Gauge(name, documentation, labels, collect)
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+request_latency = registry.histogram("http_request_duration_seconds", "HTTP request latency by route",
+                                     ("method", "route", "status"))
+orm_latency = registry.histogram("orm_call_duration_seconds", "ORM classmethod latency", ("method",))
+pool_wait = registry.histogram("db_pool_wait_seconds", "Time to get a connection from the pool, including opening "
+                               "a new one", ("pool",), buckets=(0.0001, 0.00025) + LATENCY_BUCKETS)
+TimedPool.wait_listeners.append(lambda name, seconds: pool_wait.observe((name,), seconds))
+
+
+def observed(func, histogram: Histogram, labels: Tuple):
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return await func(*args, **kwargs)
+        finally:
+            histogram.observe(labels, time.perf_counter() - started)
+    return wrapper
+
+
+def timed(cls):
+    """Декоратор ORM-класса: время и число вызовов каждого асинхронного classmethod попадают в orm_latency"""
+    for name, attribute in list(vars(cls).items()):
+        if isinstance(attribute, classmethod) and inspect.iscoroutinefunction(attribute.__func__):
+            setattr(cls, name, classmethod(observed(attribute.__func__, orm_latency, (f"{cls.__name__}.{name}",))))
+    return cls
+
+
+class MetricsMiddleware:
+    """ASGI-middleware: задержка HTTP-запросов по шаблону маршрута, методу и статусу."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        status = [500]
+
+        async def send_status(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            await send(message)
+
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_status)
+        finally:
+            route = scope.get("route")
+            request_latency.observe((scope["method"], route.path if route is not None else "unmatched", status[0]),
+                                    time.perf_counter() - started)
+
+
+def pool_stats() -> Dict:
+    pool = engine_pg.pool
+    return {("size",): pool.size(), ("checked_out",): pool.checkedout(), ("overflow",): max(pool.overflow(), 0),
+            ("checked_in",): pool.checkedin()}
+
+
+def replica_pool_stats() -> Dict:
+    stats = {}
+    for number, replica in enumerate(replica_engines):
+        pool = replica.pool
+        stats.update({(number, "size"): pool.size(), (number, "checked_out"): pool.checkedout(),
+                      (number, "overflow"): max(pool.overflow(), 0), (number, "checked_in"): pool.checkedin()})
+    return stats
+
+
+def feed_queues() -> Dict:
+    queued = {}
+    for name, feed in (("orderbook", orderbook_feed), ("trades", trade_tape)):
+        for ticker, subscribers in list(feed.subscribers.items()):
+            queued[name, ticker] = sum(subscriber.queue.qsize() for subscriber in subscribers)
+    return queued
+
+
+def book_levels() -> Dict:
+    levels = {}
+    for ticker, book in list(engine.books.items()):
+        bids, asks = book.levels()
+        levels[ticker, "bid"] = bids
+        levels[ticker, "ask"] = asks
+    return levels
+
+
+registry.gauge("db_pool_connections", "Database pool connections by state", ("state",), pool_stats)
+registry.gauge("db_replica_pool_connections", "Read replica pool connections by state", ("replica", "state"),
+               replica_pool_stats)
+registry.gauge("db_reads_total", "Read-only sessions by target: primary without replicas, primary for a pinned "
+               "user after a write, or a replica", ("target",),
+               lambda: {(target,): count for target, count in read_session_var.routed.items()})
+registry.gauge("orderbook_levels", "Price levels per order book side", ("ticker", "side"), book_levels)
+registry.gauge("orderbook_orders", "Resting orders per order book", ("ticker",),
+               lambda: {(ticker,): len(book.orders) for ticker, book in list(engine.books.items())})
+registry.gauge("ticker_queue_depth", "Commands waiting in the per-ticker actor queue", ("ticker",),
+               lambda: {(ticker,): depth for ticker, depth in actors.depths().items()})
+registry.gauge("ledger_dirty_accounts", "Balance accounts changed in memory but not yet saved to Postgres", (),
+               lambda: {(): len(ledger.dirty)})
+registry.gauge("write_pipeline_pending", "Write batches waiting for the next group commit", (),
+               lambda: {(): len(writer.pending)})
+registry.gauge("write_pipeline_total", "Group commits and the write batches they carried since start", ("kind",),
+               lambda: {("commits",): writer.commits, ("batches",): writer.batches})
+registry.gauge("settlement_backlog", "Matching decisions waiting to be written to Postgres, by settlement worker",
+               ("worker",), lambda: {(number,): len(queue) for number, queue in enumerate(settlement.queues)})
+registry.gauge("settlement_lag_seconds", "Age of the oldest matching decision not yet written to Postgres", (),
+               lambda: {(): settlement.lag()})
+registry.gauge("settlement_total", "Settlement outcomes since start: applied and dropped decisions, commit retries "
+               "and orders delayed by backpressure", ("kind",),
+               lambda: {("applied",): settlement.applied, ("failed",): settlement.failed,
+                        ("retries",): settlement.retries, ("throttled",): settlement.throttled})
+registry.gauge("ws_queued_messages", "Messages waiting in WebSocket/SSE subscriber queues", ("feed", "ticker"),
+               feed_queues)
@@ -5,6 +5,10 @@ from datetime import datetime
 from typing_extensions import Annotated
 
 
+# наибольшее значение колонок Integer в базе: больший объем или цену база отвергла бы уже после сведения
+MAX_INT = 2 ** 31 - 1
+
+
 class Direction(str, Enum):
     BUY = "BUY"
     SELL = "SELL"
@@ -67,17 +71,46 @@ class Transaction(BaseModel):
     timestamp: datetime
 
 
+class CandleInterval(str, Enum):
+    S1 = "1s"
+    M1 = "1m"
+    M5 = "5m"
+    H1 = "1h"
+    D1 = "1d"
+
+
+class Candle(BaseModel):
+    timestamp: datetime
+    open: int
+    high: int
+    low: int
+    close: int
+    volume: int
+
+
+class TickerSummary(BaseModel):
+    ticker: str
+    last: int | None = None
+    best_bid: int | None = None
+    best_ask: int | None = None
+    high: int | None = None
+    low: int | None = None
+    volume: int = 0
+    change: int | None = None
+    change_percent: float | None = None
+
+
 class LimitOrderBody(BaseModel):
     direction: Direction
     ticker: str | None
-    qty: int
-    price: int
+    qty: Annotated[int, Field(gt=0, le=MAX_INT)]
+    price: Annotated[int, Field(gt=0, le=MAX_INT)]
 
 
 class MarketOrderBody(BaseModel):
     direction: Direction
     ticker: str | None
-    qty: int
+    qty: Annotated[int, Field(gt=0, le=MAX_INT)]
 
 
 class LimitOrder(BaseModel):
@@ -104,3 +137,18 @@ class CreateOrderResponse(BaseModel):
 
 class Ok(BaseModel):
     success: bool = True
+
+
+class InstrumentResult(BaseModel):
+    ticker: str
+    created: bool
+
+
+class InstrumentsAdded(Ok):
+    results: List[InstrumentResult]
+
+
+class BatchItemResult(BaseModel):
+    success: bool = True
+    order_id: UUID4 | None = None
+    detail: str | None = None
@@ -0,0 +1,117 @@
+import asyncio
+import logging
+import random
+import time
+from contextvars import ContextVar
+from typing import Dict, List, Optional
+
+from sqlalchemy import event
+
+from src.backend.database.database import engine_pg, replica_engines, settings
+
+logger = logging.getLogger(__name__)
+
+current: ContextVar[Optional["QueryProfile"]] = ContextVar("query_profile", default=None)
+explains = set()
+
+
+class QueryProfile:
+    """SQL одного запроса: число выражений, суммарное время в базе и разбивка по тексту выражения."""
+    __slots__ = ("count", "seconds", "statements")
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+        # текст -> [выполнений, секунд, параметры и время самого долгого выполнения]
+        self.statements: Dict[str, List] = {}
+
+    def add(self, statement: str, parameters, seconds: float):
+        self.count += 1
+        self.seconds += seconds
+        entry = self.statements.get(statement)
+        if entry is None:
+            self.statements[statement] = [1, seconds, parameters, seconds]
+            return
+        entry[0] += 1
+        entry[1] += seconds
+        if seconds > entry[3]:
+            entry[2], entry[3] = parameters, seconds
+
+    def breakdown(self, limit: int = 10) -> str:
+        rows = sorted(self.statements.items(), key=lambda item: item[1][1], reverse=True)[:limit]
+        return "\n".join(f"  {count:>4} x {seconds * 1000:8.2f} ms  {' '.join(statement.split())}"
+                         for statement, (count, seconds, _, _) in rows)
+
+
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    # время начала живет в контексте выполнения: если запрос упал, after_cursor_execute не вызовется,
+    # и на соединении из пула ничего не останется
+    context._profile_started = time.perf_counter()
+
+
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    seconds = time.perf_counter() - context._profile_started
+    profile = current.get()
+    if profile is not None:
+        profile.add(statement, None if executemany else parameters, seconds)
+
+
+# запросы к репликам тоже входят в профиль запроса
+for pg in (engine_pg, *replica_engines):
+    event.listen(pg.sync_engine, "before_cursor_execute", before_cursor_execute)
+    event.listen(pg.sync_engine, "after_cursor_execute", after_cursor_execute)
+
+
+async def explain(statement: str, parameters):
+    """План самого долгого выражения медленного запроса; EXPLAIN без ANALYZE ничего не выполняет"""
+    try:
+        async with engine_pg.connect() as connection:
+            result = await connection.exec_driver_sql(f"EXPLAIN {statement}", parameters)
+            plan = "\n".join(row[0] for row in result)
+        logger.warning("EXPLAIN %s\n%s", " ".join(statement.split()), plan)
+    except Exception:
+        logger.exception("EXPLAIN failed")
+
+
+class QueryProfilingMiddleware:
+    """Считает SQL каждого HTTP-запроса.
+
+    В режиме DEBUG число выражений и время в базе отдаются в заголовках X-DB-Queries и X-DB-Time-Ms.
+    Запросы дольше SLOW_REQUEST_MS пишутся в лог с разбивкой по выражениям, а с вероятностью
+    SQL_EXPLAIN_SAMPLE для самого долгого выражения еще и запрашивается план.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        profile = QueryProfile()
+        token = current.set(profile)
+
+        async def send_with_headers(message):
+            if message["type"] == "http.response.start" and settings.DEBUG:
+                message["headers"] = list(message.get("headers", [])) + [
+                    (b"x-db-queries", str(profile.count).encode()),
+                    (b"x-db-time-ms", f"{profile.seconds * 1000:.3f}".encode())]
+            await send(message)
+
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_headers)
+        finally:
+            current.reset(token)
+            elapsed = time.perf_counter() - started
+            if elapsed * 1000 >= settings.SLOW_REQUEST_MS:
+                self.slow(scope, profile, elapsed)
+
+    def slow(self, scope, profile: QueryProfile, elapsed: float):
+        logger.warning("slow request %s %s: %.1f ms, %d queries, %.1f ms in db\n%s", scope["method"], scope["path"],
+                       elapsed * 1000, profile.count, profile.seconds * 1000, profile.breakdown())
+        if profile.statements and random.random() < settings.SQL_EXPLAIN_SAMPLE:
+            statement, (_, _, parameters, _) = max(profile.statements.items(), key=lambda item: item[1][3])
+            if parameters is not None:
+                task = asyncio.create_task(explain(statement, parameters))
+                explains.add(task)
+                task.add_done_callback(explains.discard)
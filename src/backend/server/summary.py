@@ -0,0 +1,118 @@
+import time
+from collections import deque
+from typing import Dict, Iterable, List, Optional
+
+from src.backend.engine.matching import engine
+from src.backend.server.candles import epoch
+
+WINDOW = 24 * 60 * 60
+BUCKET = 60
+
+
+class Rolling:
+    """Сделки тикера за последние сутки в минутных корзинах [начало, open, high, low, volume].
+
+    Максимум и минимум окна держим в монотонных очередях корзин, а объем - скользящей суммой,
+    поэтому и сделка, и запрос сводки стоят O(1) в среднем.
+    """
+    __slots__ = ("last", "buckets", "highs", "lows", "volume")
+
+    def __init__(self):
+        self.last = None
+        self.buckets = deque()
+        self.highs = deque()
+        self.lows = deque()
+        self.volume = 0
+
+    def add(self, start: int, open: int, high: int, low: int, close: int, volume: int):
+        if self.buckets and self.buckets[-1][0] >= start:
+            bucket = self.buckets[-1]
+            bucket[2] = max(bucket[2], high)
+            bucket[3] = min(bucket[3], low)
+            bucket[4] += volume
+        else:
+            bucket = [start, open, high, low, volume]
+            self.buckets.append(bucket)
+        self.volume += volume
+        self.last = close
+        if self.highs and self.highs[-1] is bucket:
+            self.highs.pop()
+        while self.highs and self.highs[-1][2] <= bucket[2]:
+            self.highs.pop()
+        self.highs.append(bucket)
+        if self.lows and self.lows[-1] is bucket:
+            self.lows.pop()
+        while self.lows and self.lows[-1][3] >= bucket[3]:
+            self.lows.pop()
+        self.lows.append(bucket)
+
+    def expire(self, now: float):
+        while self.buckets and self.buckets[0][0] + BUCKET <= now - WINDOW:
+            bucket = self.buckets.popleft()
+            self.volume -= bucket[4]
+            if self.highs[0] is bucket:
+                self.highs.popleft()
+            if self.lows[0] is bucket:
+                self.lows.popleft()
+
+
+class MarketSummary:
+    """Сводка по всем инструментам: последняя цена, лучшие цены книги и суточные high/low/объем/изменение.
+
+    Окно обновляется на каждой сделке, лучшие цены берутся из книг движка,
+    так что сводка не ходит в базу.
+    """
+
+    def __init__(self):
+        self.tickers: Dict[str, Rolling] = {}
+
+    def add(self, ticker: str):
+        self.tickers.setdefault(ticker, Rolling())
+
+    def drop(self, ticker: str):
+        self.tickers.pop(ticker, None)
+
+    def publish(self, ticker: str, trades: List[dict]):
+        rolling = self.tickers.get(ticker)
+        if rolling is None:
+            rolling = self.tickers[ticker] = Rolling()
+        for trade in trades:
+            price = trade["price"]
+            rolling.add(int(epoch(trade["timestamp"])) // BUCKET * BUCKET, price, price, price, price, trade["amount"])
+
+    def load(self, tickers: Iterable[str], candles: List[dict], last_prices: Dict[str, int]):
+        """Заполняет окно минутными свечами за последние сутки (от старых к новым)"""
+        for ticker in tickers:
+            self.add(ticker)
+        for candle in candles:
+            rolling = self.tickers.get(candle["ticker"])
+            if rolling is not None:
+                rolling.add(int(epoch(candle["timestamp"])), candle["open"], candle["high"], candle["low"],
+                            candle["close"], candle["volume"])
+        for ticker, price in last_prices.items():
+            if ticker in self.tickers:
+                self.tickers[ticker].last = price
+
+    def summary(self, ticker: str, now: Optional[float] = None) -> Optional[dict]:
+        rolling = self.tickers.get(ticker)
+        if rolling is None:
+            return None
+        rolling.expire(time.time() if now is None else now)
+        book = engine.view(ticker)
+        window = {"high": None, "low": None, "change": None, "change_percent": None}
+        if rolling.buckets:
+            opened = rolling.buckets[0][1]
+            window = {"high": rolling.highs[0][2], "low": rolling.lows[0][3], "change": rolling.last - opened,
+                      "change_percent": round((rolling.last - opened) * 100 / opened, 4) if opened else None}
+        return {"ticker": ticker, "last": rolling.last,
+                "best_bid": book.best_bid() if book is not None else None,
+                "best_ask": book.best_ask() if book is not None else None,
+                "volume": rolling.volume, **window}
+
+    def summaries(self) -> List[dict]:
+        now = time.time()
+        return [self.summary(ticker, now) for ticker in list(self.tickers)]
+
+
+market_summary = MarketSummary()
+engine.trade_listeners.append(market_summary.publish)
@@ -0,0 +1,19 @@
+import os
+import uuid
+
+import pytest
+
+# модули движка импортируют settings, которым нужны параметры базы; сама база тестам не нужна
+for name, value in (("POSTGRES_USER", "exchange"), ("POSTGRES_PASSWORD", "exchange"), ("POSTGRES_HOST", "localhost"),
+                    ("POSTGRES_PORT", "5432"), ("POSTGRES_DB", "exchange")):
+    os.environ.setdefault(name, value)
+
+
+@pytest.fixture
+def alice():
+    return uuid.uuid4()
+
+
+@pytest.fixture
+def bob():
+    return uuid.uuid4()
@@ -0,0 +1,96 @@
+import asyncio
+import uuid
+
+import httpx
+import pytest
+
+from src.backend.database.cache import Identity, api_key_cache
+from src.backend.database.orm import OrderORM
+from src.backend.server.api import app
+from src.backend.server.cluster import cluster
+from src.backend.server.models import UserRole
+
+HEADERS = {"Authorization": "TOKEN batch-test-key"}
+
+
+@pytest.fixture
+def client(monkeypatch, alice):
+    api_key_cache.put("batch-test-key", Identity(alice, UserRole.USER))
+
+    async def known_tickers(tickers):
+        return set(tickers) & {"MEM", "DOGE"}
+
+    monkeypatch.setattr(OrderORM, "known_tickers", known_tickers)
+    yield lambda: httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test")
+    api_key_cache.evict("batch-test-key")
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+def test_create_reports_each_order(monkeypatch, client):
+    placed = {}
+
+    async def place(ticker, orders):
+        if ticker == "DOGE":
+            raise RuntimeError("worker is gone")
+        placed[ticker] = orders
+        # на вторую заявку не хватило баланса
+        return {orders[0].id}
+
+    monkeypatch.setitem(cluster.commands, "place", place)
+
+    async def scenario():
+        async with client() as http:
+            return await http.post("/api/v1/order/batch", headers=HEADERS, json=[
+                {"direction": "SELL", "ticker": "MEM", "qty": 1, "price": 50},
+                {"direction": "SELL", "ticker": "MEM", "qty": 9, "price": 51},
+                {"direction": "BUY", "ticker": "DOGE", "qty": 2},
+                {"direction": "BUY", "ticker": "NONE", "qty": 2, "price": 3}])
+
+    response = run(scenario())
+    assert response.status_code == 200
+    results = response.json()
+    assert [result["success"] for result in results] == [True, False, False, False]
+    assert results[0]["order_id"] == str(placed["MEM"][0].id)
+    assert [result["detail"] for result in results[1:]] == ["Order rejected", "Order rejected", "Instrument not found"]
+    assert [order.qty for order in placed["MEM"]] == [1, 9]
+
+
+def test_create_rejects_oversized_batch(monkeypatch, client):
+    monkeypatch.setattr("src.backend.server.api.settings.ORDER_BATCH_SIZE", 2)
+
+    async def scenario():
+        async with client() as http:
+            return await http.post("/api/v1/order/batch", headers=HEADERS,
+                                   json=[{"direction": "BUY", "ticker": "MEM", "qty": 1}] * 3)
+
+    assert run(scenario()).status_code == 422
+
+
+def test_cancel_reports_each_order(monkeypatch, client, alice, bob):
+    class Row:
+        def __init__(self, user_id, ticker):
+            self.id, self.user_id, self.ticker = uuid.uuid4(), user_id, ticker
+
+    active, filled, foreign = Row(alice, "MEM"), Row(alice, "MEM"), Row(bob, "MEM")
+    missing = uuid.uuid4()
+
+    async def select_orders(order_ids, user_id):
+        return [row for row in (active, filled, foreign) if row.id in order_ids]
+
+    async def cancel(ticker, order_ids):
+        return {active.id} & set(order_ids)
+
+    monkeypatch.setattr(OrderORM, "select_orders", select_orders)
+    monkeypatch.setitem(cluster.commands, "cancel", cancel)
+
+    async def scenario():
+        async with client() as http:
+            return await http.request("DELETE", "/api/v1/order/batch", headers=HEADERS,
+                                      json=[str(order_id) for order_id in (active.id, filled.id, foreign.id, missing)])
+
+    results = run(scenario()).json()
+    assert [(result["success"], result["detail"]) for result in results] == [
+        (True, None), (False, "Order is not active"), (False, "Order not found"), (False, "Order not found")]
@@ -0,0 +1,41 @@
+from src.backend.database import cache
+from src.backend.database.cache import ApiKeyCache, Identity
+from src.backend.server.models import UserRole
+
+
+class Clock:
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_entry_expires_after_ttl(monkeypatch, alice):
+    clock = Clock()
+    monkeypatch.setattr(cache.time, "monotonic", clock)
+    keys = ApiKeyCache(10, 30)
+    identity = keys.put("key", Identity(alice, UserRole.USER))
+    clock.now += 29
+    assert keys.get("key") == identity
+    clock.now += 2
+    assert keys.get("key") is None
+    assert keys.stats() == {"hits": 1, "misses": 1, "size": 0}
+
+
+def test_least_recently_used_is_dropped(alice, bob):
+    keys = ApiKeyCache(2, 300)
+    keys.put("alice", Identity(alice, UserRole.USER))
+    keys.put("bob", Identity(bob, UserRole.ADMIN))
+    assert keys.get("alice") is not None
+    keys.put("carol", Identity(bob, UserRole.USER))
+    assert keys.get("bob") is None
+    assert keys.get("alice").user_id == alice and keys.get("carol") is not None
+
+
+def test_evict_forgets_key(alice):
+    keys = ApiKeyCache(10, 300)
+    keys.put("key", Identity(alice, UserRole.USER))
+    keys.evict("key")
+    keys.evict("missing")
+    assert keys.get("key") is None and keys.stats()["size"] == 0
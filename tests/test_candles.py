@@ -0,0 +1,71 @@
+import asyncio
+import datetime
+
+import pytest
+
+from src.backend.server.candles import CandleAggregator
+
+# 2026-03-01 12:00:00 UTC, начало и минутного, и часового бара
+BASE = datetime.datetime(2026, 3, 1, 12, tzinfo=datetime.timezone.utc).timestamp()
+
+
+def bars(candles, interval):
+    return [(bar["open"], bar["high"], bar["low"], bar["close"], bar["volume"])
+            for bar in candles.select("MEM", interval)]
+
+
+def test_trades_are_bucketed_by_interval():
+    candles = CandleAggregator(100, 1)
+    for offset, price, amount in ((0, 50, 1), (10, 55, 2), (59.9, 48, 3), (60, 52, 4), (130, 51, 5)):
+        candles.add("MEM", price, amount, BASE + offset)
+    assert bars(candles, "1m") == [(50, 55, 48, 48, 6), (52, 52, 52, 52, 4), (51, 51, 51, 51, 5)]
+    assert bars(candles, "1h") == [(50, 55, 48, 51, 15)]
+    assert candles.select("MEM", "1m")[1]["timestamp"] == datetime.datetime.fromtimestamp(
+        BASE + 60, datetime.timezone.utc)
+    # закрытые сделкой следующего периода бары ждут записи
+    assert sorted(start - BASE for _, interval, start in candles.pending if interval == "1m") == [0, 60]
+
+
+def test_late_trade_does_not_move_close():
+    candles = CandleAggregator(100, 1)
+    candles.add("MEM", 50, 1, BASE)
+    candles.add("MEM", 60, 1, BASE + 70)
+    candles.add("MEM", 40, 2, BASE + 30)
+    assert bars(candles, "1m") == [(50, 50, 40, 50, 3), (60, 60, 60, 60, 1)]
+
+
+def test_select_limits_range_and_count():
+    candles = CandleAggregator(3, 1)
+    for minute in range(5):
+        candles.add("MEM", 50 + minute, 1, BASE + 60 * minute)
+    # в памяти остаются последние size баров
+    assert [bar[0] for bar in bars(candles, "1m")] == [52, 53, 54]
+    start = datetime.datetime.fromtimestamp(BASE + 180, datetime.timezone.utc)
+    assert [bar["open"] for bar in candles.select("MEM", "1m", start=start)] == [53, 54]
+    assert [bar["open"] for bar in candles.select("MEM", "1m", end=start, limit=1)] == [52]
+
+
+def test_failed_flush_keeps_bars_pending():
+    async def scenario():
+        candles = CandleAggregator(100, 1)
+        candles.add("MEM", 50, 1, BASE)
+        candles.add("MEM", 51, 1, BASE + 1)
+
+        async def broken(rows):
+            raise OSError("database is down")
+
+        candles._save = broken
+        with pytest.raises(OSError):
+            await candles.flush(everything=True)
+        saved = []
+
+        async def save(rows):
+            saved.extend(rows)
+
+        candles._save = save
+        await candles.flush(everything=True)
+        return candles, saved
+
+    candles, saved = asyncio.run(scenario())
+    assert not candles.pending
+    assert sorted(row["interval"] for row in saved) == sorted(["1s", "1s", "1m", "5m", "1h", "1d"])
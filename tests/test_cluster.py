@@ -0,0 +1,65 @@
+import asyncio
+import uuid
+
+import pytest
+from fastapi import HTTPException
+
+from src.backend.database import orm
+from src.backend.database.orm import QUOTE_TICKER, OrderORM
+from src.backend.engine.matching import BookOrder, engine
+from src.backend.server.cluster import Cluster
+from src.backend.server.models import Direction
+
+
+def test_owner_is_stable_and_spreads_tickers():
+    cluster = Cluster(4, 0, "", 1)
+    tickers = [f"T{number}" for number in range(200)]
+    owners = [cluster.owner(ticker) for ticker in tickers]
+    assert owners == [Cluster(4, 3, "", 1).owner(ticker) for ticker in tickers]
+    assert set(owners) == {0, 1, 2, 3}
+    assert all(cluster.local(ticker) == (owner == 0) for ticker, owner in zip(tickers, owners))
+    assert {Cluster(1, 0, "", 1).owner(ticker) for ticker in tickers} == {0}
+
+
+def test_commands_are_routed_to_owner(tmp_path, monkeypatch):
+    monkeypatch.setattr(engine, "listeners", list(engine.listeners))
+    monkeypatch.setattr(engine, "trade_listeners", list(engine.trade_listeners))
+
+    async def scenario():
+        workers = [Cluster(2, worker, str(tmp_path), 5) for worker in range(2)]
+        for worker in workers:
+            def reject(worker=worker):
+                raise HTTPException(status_code=422, detail=f"rejected by {worker.worker_id}")
+
+            worker.register(whoami=lambda worker=worker: worker.worker_id, reject=reject)
+        await asyncio.gather(*(worker.start() for worker in workers))
+        try:
+            ticker = next(ticker for ticker in ("MEM", "DOGE", "BTC", "ETH") if workers[0].owner(ticker) == 1)
+            routed = await workers[0].route(ticker, "whoami")
+            gathered = await workers[1].gather("whoami")
+            with pytest.raises(HTTPException) as error:
+                await workers[0].route(ticker, "reject")
+        finally:
+            await asyncio.gather(*(worker.stop() for worker in workers))
+        return routed, gathered, error.value
+
+    routed, gathered, error = asyncio.run(scenario())
+    assert routed == 1 and gathered == [0, 1]
+    assert (error.status_code, error.detail) == (422, "rejected by 1")
+
+
+def test_failed_decision_releases_remote_quote_reserve(monkeypatch, alice):
+    routed = []
+
+    async def call(ticker, function, *args):
+        raise HTTPException(status_code=503, detail="Worker unavailable")
+
+    async def route(ticker, command, *args):
+        routed.append((ticker, command, args))
+
+    monkeypatch.setattr(orm.actors, "call", call)
+    monkeypatch.setattr(orm.cluster, "route", route)
+    bids = [BookOrder(uuid.uuid4(), alice, Direction.BUY, 2, 30), BookOrder(uuid.uuid4(), alice, Direction.BUY, 1, 40)]
+    with pytest.raises(HTTPException):
+        asyncio.run(OrderORM._decide("MEM", bids, {bids[0].id: 60, bids[1].id: 40}))
+    assert routed == [(QUOTE_TICKER, "release", (alice, QUOTE_TICKER, 100))]
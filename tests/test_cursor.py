@@ -0,0 +1,32 @@
+import datetime
+import uuid
+
+import pytest
+from fastapi import HTTPException
+
+from src.backend.database.orm import decode_cursor, encode_cursor
+
+NOW = datetime.datetime(2026, 3, 1, 12, 30, 15, 123456, tzinfo=datetime.timezone.utc)
+
+
+def test_cursor_round_trip():
+    row_id = uuid.uuid4()
+    cursor = encode_cursor(NOW, row_id)
+    assert decode_cursor(cursor) == (NOW, row_id)
+    # курсор уходит в query string как есть
+    assert set(cursor) <= set("ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789-_=")
+
+
+def test_cursor_keeps_keyset_order():
+    first, second = sorted([uuid.uuid4(), uuid.uuid4()])
+    keys = [decode_cursor(encode_cursor(timestamp, row_id)) for timestamp, row_id in
+            [(NOW, second), (NOW, first), (NOW - datetime.timedelta(microseconds=1), second)]]
+    assert keys == sorted(keys, reverse=True)
+
+
+@pytest.mark.parametrize("cursor", ["not base64!", "bm90IGEgY3Vyc29y", encode_cursor(NOW, "not-an-id"),
+                                    "//79"])
+def test_broken_cursor_is_422(cursor):
+    with pytest.raises(HTTPException) as error:
+        decode_cursor(cursor)
+    assert error.value.status_code == 422
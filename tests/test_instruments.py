@@ -0,0 +1,50 @@
+import asyncio
+
+import httpx
+import pytest
+
+from src.backend.database.cache import Identity, api_key_cache
+from src.backend.database.orm import AdminORM
+from src.backend.server.api import app
+from src.backend.server.cluster import cluster
+from src.backend.server.models import UserRole
+
+HEADERS = {"Authorization": "TOKEN instrument-test-key"}
+
+
+@pytest.fixture
+def post(monkeypatch, alice):
+    """POST /admin/instrument; в базе уже есть MEM, новые тикеры попадают в added"""
+    api_key_cache.put("instrument-test-key", Identity(alice, UserRole.ADMIN))
+    added = []
+
+    async def add_instruments(instruments):
+        return {instrument.ticker for instrument in instruments} - {"MEM"}
+
+    monkeypatch.setattr(AdminORM, "add_instruments", add_instruments)
+    monkeypatch.setitem(cluster.commands, "add_tickers", added.extend)
+
+    async def request(body):
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as http:
+            return await http.post("/api/v1/admin/instrument", headers=HEADERS, json=body)
+
+    yield lambda body: asyncio.run(request(body)), added
+    api_key_cache.evict("instrument-test-key")
+
+
+def test_list_reports_created_per_ticker(post):
+    post, added = post
+    response = post([{"name": "Doge", "ticker": "DOGE"}, {"name": "Memcoin", "ticker": "MEM"},
+                     {"name": "Doge again", "ticker": "DOGE"}])
+    assert response.status_code == 200
+    # повтор тикера внутри списка - такой же конфликт, как уже существующий тикер
+    assert response.json()["results"] == [{"ticker": "DOGE", "created": True}, {"ticker": "MEM", "created": False},
+                                           {"ticker": "DOGE", "created": False}]
+    assert added == ["DOGE"]
+
+
+def test_single_conflict_is_422(post):
+    post, added = post
+    assert post({"name": "Memcoin", "ticker": "MEM"}).status_code == 422
+    assert post({"name": "Doge", "ticker": "DOGE"}).json() == {"success": True}
+    assert added == ["DOGE"]
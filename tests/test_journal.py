@@ -0,0 +1,138 @@
+import asyncio
+import os
+import uuid
+
+import pytest
+
+from src.backend.engine.journal import CANCEL, NEW, Journal
+from src.backend.engine.ledger import BalanceLedger
+from src.backend.engine.matching import BookOrder, MatchingEngine
+from src.backend.server.models import Direction
+
+
+def state(engine):
+    return {ticker: (book.depth(100), [(order.id, order.filled) for order in book.orders.values()], book.seq)
+            for ticker, book in engine.books.items() if book.orders}
+
+
+def sell(user_id, qty, price):
+    return BookOrder(uuid.uuid4(), user_id, Direction.SELL, qty, price)
+
+
+def buy(user_id, qty, price=None):
+    return BookOrder(uuid.uuid4(), user_id, Direction.BUY, qty, price)
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+def test_load_without_snapshot(tmp_path):
+    assert not Journal(str(tmp_path), 1, 1).load(MatchingEngine())
+
+
+def test_snapshot_and_tail_replay(tmp_path, alice, bob):
+    async def scenario():
+        engine, ledger = MatchingEngine(), BalanceLedger(1, 1000)
+        journal = Journal(str(tmp_path), 1, 1000)
+        journal.start(engine, ledger)
+        ledger.deposit(alice, "MEM", 100)
+        for price in (50, 51, 52):
+            engine.submit("MEM", sell(alice, 10, price))
+        await journal.write_snapshot(engine, ledger)
+        engine.submit("MEM", buy(bob, 15, 51))
+        engine.cancel("MEM", next(iter(engine.books["MEM"].orders)))
+        engine.submit("DOGE", sell(alice, 3, 7))
+        ledger.deposit(bob, "RUB", 500)
+        await engine.sync()
+        return engine, ledger
+
+    engine, ledger = run(scenario())
+    restored, restored_ledger = MatchingEngine(), BalanceLedger(1, 1000)
+    assert Journal(str(tmp_path), 1, 1).load(restored, restored_ledger)
+    assert state(restored) == state(engine)
+    assert restored_ledger.restored
+    assert sorted(restored_ledger.snapshot(), key=str) == sorted(ledger.snapshot(), key=str)
+
+
+def test_snapshot_deletes_covered_segments(tmp_path, alice):
+    async def scenario():
+        engine = MatchingEngine()
+        journal = Journal(str(tmp_path), 1, 1000)
+        journal.start(engine)
+        for _ in range(3):
+            engine.submit("MEM", sell(alice, 1, 50))
+            await engine.sync()
+            await journal.write_snapshot(engine)
+        await journal.stop(engine)
+        return engine
+
+    engine = run(scenario())
+    assert sorted(os.listdir(tmp_path)) == ["journal-00000004.bin", "snapshot.bin"]
+    restored = MatchingEngine()
+    assert Journal(str(tmp_path), 1, 1).load(restored)
+    assert state(restored) == state(engine)
+
+
+def test_torn_tail_is_truncated(tmp_path, alice):
+    async def scenario():
+        engine = MatchingEngine()
+        journal = Journal(str(tmp_path), 1, 1000)
+        journal.start(engine)
+        await journal.write_snapshot(engine)
+        engine.submit("MEM", sell(alice, 5, 50))
+        await engine.sync()
+        return engine, journal.segment_path(journal.segment)
+
+    engine, path = run(scenario())
+    size = os.path.getsize(path)
+    with open(path, "ab") as file:
+        file.write(b"\x20\x00\x00\x00\x01")
+    restored = MatchingEngine()
+    assert Journal(str(tmp_path), 1, 1).load(restored)
+    assert state(restored) == state(engine)
+    assert os.path.getsize(path) == size
+
+
+def test_tail_lists_decisions_after_snapshot(tmp_path, alice, bob):
+    async def scenario():
+        engine = MatchingEngine()
+        journal = Journal(str(tmp_path), 1, 1000)
+        journal.start(engine)
+        engine.submit("MEM", sell(alice, 10, 50))
+        await journal.write_snapshot(engine)
+        taker = buy(bob, 4)
+        engine.submit("MEM", taker)
+        resting = sell(alice, 2, 60)
+        engine.submit("MEM", resting)
+        engine.cancel("MEM", resting.id)
+        await engine.sync()
+        return taker, resting
+
+    taker, resting = run(scenario())
+    tail = []
+    Journal(str(tmp_path), 1, 1).load(MatchingEngine(), tail=tail)
+    assert [(kind, subject.id) for kind, _, subject, _ in tail] == [(NEW, taker.id), (NEW, resting.id),
+                                                                      (CANCEL, resting.id)]
+    assert [(fill.price, fill.amount) for fill in tail[0][3]] == [(50, 4)]
+
+
+def test_write_error_fails_sync(tmp_path, alice):
+    async def scenario():
+        engine = MatchingEngine()
+        journal = Journal(str(tmp_path), 0.01, 1000)
+        journal.start(engine)
+
+        def broken(file, data):
+            raise OSError(28, "No space left on device")
+
+        journal._write = broken
+        engine.submit("MEM", sell(alice, 1, 50))
+        with pytest.raises(OSError):
+            await asyncio.wait_for(engine.sync(), 1)
+        with pytest.raises(OSError):
+            await engine.sync()
+        del journal._write
+        await journal.stop(engine)
+
+    run(scenario())
@@ -0,0 +1,128 @@
+import uuid
+
+from src.backend.engine.ledger import BalanceLedger
+from src.backend.engine.matching import BookOrder, OrderBook
+from src.backend.server.models import Direction
+
+
+def totals(ledger, ticker):
+    accounts = [accounts[ticker] for accounts in ledger.accounts.values() if ticker in accounts]
+    return sum(account.available for account in accounts), sum(account.reserved for account in accounts)
+
+
+def trade(ledger, book, order, budget=None):
+    """Резерв, сведение и проводка одной заявки так, как их делает OrderORM.place_orders"""
+    if order.is_bid:
+        assert ledger.reserve_orders(order.user_id, "RUB", [(order.id, budget or order.qty * order.price)])
+    else:
+        assert ledger.reserve(order.user_id, book.ticker, order.qty)
+    fills = book.submit(order)
+    ledger.transfer("RUB", ledger.settle(book.ticker, fills))
+    return fills
+
+
+def test_reserve_moves_available_to_reserved(alice):
+    ledger = BalanceLedger(1, 1000)
+    ledger.deposit(alice, "MEM", 10)
+    assert ledger.reserve(alice, "MEM", 4)
+    assert not ledger.reserve(alice, "MEM", 7)
+    account = ledger.account(alice, "MEM")
+    assert (account.available, account.reserved) == (6, 4)
+    ledger.release(alice, "MEM", 3)
+    assert (account.available, account.reserved) == (9, 1)
+
+
+def test_reserve_orders_skips_what_does_not_fit(alice):
+    ledger = BalanceLedger(1, 1000)
+    ledger.deposit(alice, "RUB", 100)
+    first, second, third = uuid.uuid4(), uuid.uuid4(), uuid.uuid4()
+    reserved = ledger.reserve_orders(alice, "RUB", [(first, 60), (second, 50), (third, 30)])
+    assert reserved == {first: 60, third: 30}
+    assert ledger.available(alice, "RUB") == 10
+    market = uuid.uuid4()
+    assert ledger.reserve_orders(alice, "RUB", [(market, None)]) == {market: 10}
+    assert ledger.available(alice, "RUB") == 0
+
+
+def test_settle_conserves_both_tickers(alice, bob):
+    ledger = BalanceLedger(1, 1000)
+    book = OrderBook("MEM")
+    ledger.deposit(alice, "MEM", 20)
+    ledger.deposit(bob, "RUB", 1000)
+    trade(ledger, book, BookOrder(uuid.uuid4(), alice, Direction.SELL, 10, 30))
+    trade(ledger, book, BookOrder(uuid.uuid4(), alice, Direction.SELL, 10, 40))
+    trade(ledger, book, BookOrder(uuid.uuid4(), bob, Direction.BUY, 15, 40))
+    assert sum(totals(ledger, "MEM")) == 20
+    assert sum(totals(ledger, "RUB")) == 1000
+    assert ledger.balances(alice) == {"MEM": 0, "RUB": 10 * 30 + 5 * 40}
+    assert ledger.balances(bob) == {"RUB": 1000 - 500, "MEM": 15}
+    # остаток продажи по 40 лежит в книге и держит свой объем в резерве
+    assert ledger.account(alice, "MEM").reserved == 5
+    assert ledger.account(bob, "RUB").reserved == 0
+
+
+def test_price_improvement_is_refunded_to_buyer(alice, bob):
+    ledger = BalanceLedger(1, 1000)
+    book = OrderBook("MEM")
+    ledger.deposit(alice, "MEM", 5)
+    ledger.deposit(bob, "RUB", 500)
+    trade(ledger, book, BookOrder(uuid.uuid4(), alice, Direction.SELL, 5, 40))
+    bid = BookOrder(uuid.uuid4(), bob, Direction.BUY, 8, 50)
+    trade(ledger, book, bid)
+    account = ledger.account(bob, "RUB")
+    # 5 куплено по 40 вместо 50, остаток 3 по 50 ждет в книге
+    assert (account.available, account.reserved) == (500 - 5 * 40 - 3 * 50, 3 * 50)
+    assert account.reserved == bid.remaining * bid.price
+
+
+def test_resting_bid_release_returns_its_reserve(bob):
+    ledger = BalanceLedger(1, 1000)
+    book = OrderBook("MEM")
+    ledger.deposit(bob, "RUB", 300)
+    bid = BookOrder(uuid.uuid4(), bob, Direction.BUY, 6, 50)
+    trade(ledger, book, bid)
+    book.cancel(bid.id)
+    ledger.release(bob, "RUB", bid.remaining * bid.price)
+    account = ledger.account(bob, "RUB")
+    assert (account.available, account.reserved) == (300, 0)
+
+
+def test_load_rebuilds_reserve_from_resting_orders(alice, bob):
+    ledger = BalanceLedger(1, 1000)
+    book = OrderBook("MEM")
+    ledger.deposit(alice, "MEM", 10)
+    ledger.deposit(bob, "RUB", 1000)
+    trade(ledger, book, BookOrder(uuid.uuid4(), alice, Direction.SELL, 10, 60))
+    trade(ledger, book, BookOrder(uuid.uuid4(), bob, Direction.BUY, 4, 60))
+    trade(ledger, book, BookOrder(uuid.uuid4(), bob, Direction.BUY, 3, 55))
+
+    class Row:
+        def __init__(self, user_id, ticker, amount):
+            self.user_id, self.ticker, self.amount = user_id, ticker, amount
+
+    rows = [Row(user_id, ticker, account.available)
+            for user_id, accounts in ledger.accounts.items() for ticker, account in accounts.items()]
+    loaded = BalanceLedger(1, 1000)
+    loaded.load(rows, [("MEM", order) for order in book.orders.values()], "RUB")
+    assert sorted(loaded.snapshot(), key=str) == sorted(ledger.snapshot(), key=str)
+
+
+def test_pending_takes_changed_accounts_once(alice):
+    ledger = BalanceLedger(1, 1000)
+    ledger.deposit(alice, "MEM", 10)
+    ledger.reserve(alice, "MEM", 3)
+    assert ledger.pending() == [{"user_id": alice, "ticker": "MEM", "amount": 7}]
+    assert ledger.pending() == []
+
+
+def test_reconcile_returns_orphaned_reserve(alice, bob):
+    ledger = BalanceLedger(1, 1000)
+    ledger.deposit(alice, "RUB", 1000)
+    ledger.deposit(bob, "RUB", 100)
+    ledger.reserve(alice, "RUB", 700)
+    ledger.reserve(bob, "RUB", 40)
+    # у alice в книгах покупки только на 200, у bob - ровно на его резерв
+    assert ledger.reconcile("RUB", {alice: 200, bob: 40}) == 1
+    assert (ledger.account(alice, "RUB").available, ledger.account(alice, "RUB").reserved) == (800, 200)
+    assert (ledger.account(bob, "RUB").available, ledger.account(bob, "RUB").reserved) == (60, 40)
+    assert sum(totals(ledger, "RUB")) == 1100
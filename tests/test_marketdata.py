@@ -0,0 +1,74 @@
+import asyncio
+import json
+import uuid
+
+import pytest
+
+from src.backend.engine.matching import BookOrder, OrderBook, engine
+from src.backend.server.marketdata import RESNAPSHOT, OrderBookFeed
+from src.backend.server.models import Direction
+
+
+@pytest.fixture
+def market(monkeypatch):
+    """Лента с очередью на 2 сообщения и книга FEED, которую она видит через engine.view"""
+    feed = OrderBookFeed(2, RESNAPSHOT)
+    book = OrderBook("FEED", [feed.publish])
+    monkeypatch.setattr(engine, "books", {**engine.books, "FEED": book})
+    return feed, book
+
+
+def messages(subscriber):
+    queue = subscriber.queue
+    return [queue.get_nowait() for _ in range(queue.qsize())]
+
+
+def apply(levels, changes):
+    for price, qty in changes:
+        if qty:
+            levels[price] = qty
+        else:
+            levels.pop(price, None)
+
+
+def test_deltas_follow_snapshot(market, alice, bob):
+    async def scenario():
+        feed, book = market
+        book.submit(BookOrder(uuid.uuid4(), alice, Direction.SELL, 5, 50))
+        subscriber = feed.subscribe("FEED")
+        snapshot = json.loads(feed.snapshot("FEED"))
+        book.submit(BookOrder(uuid.uuid4(), bob, Direction.BUY, 3, 50))
+        book.submit(BookOrder(uuid.uuid4(), bob, Direction.BUY, 1, 48))
+        return book, snapshot, [json.loads(message) for message in messages(subscriber)]
+
+    book, snapshot, deltas = asyncio.run(scenario())
+    assert (snapshot["seq"], snapshot["asks"]) == (1, [[50, 5]])
+    assert [delta["seq"] for delta in deltas] == [2, 3]
+    bids, asks = dict(snapshot["bids"]), dict(snapshot["asks"])
+    for delta in deltas:
+        apply(bids, delta["bids"])
+        apply(asks, delta["asks"])
+    assert (sorted(bids.items(), reverse=True), sorted(asks.items())) == book.depth(10)
+
+
+def test_slow_subscriber_gets_marker_and_fresh_snapshot(market, alice):
+    async def scenario():
+        feed, book = market
+        slow, other = feed.subscribe("FEED"), feed.subscribe("OTHER")
+        for price in (50, 51, 52):
+            book.submit(BookOrder(uuid.uuid4(), alice, Direction.SELL, 1, price))
+        queued = messages(slow)
+        feed.unsubscribe("FEED", slow)
+        book.submit(BookOrder(uuid.uuid4(), alice, Direction.SELL, 1, 53))
+        return feed, queued, other, json.loads(feed.snapshot("FEED"))
+
+    feed, queued, other, snapshot = asyncio.run(scenario())
+    # пропущенные дельты выброшены: клиент получит снимок вместо них
+    assert queued == [None]
+    assert other.queue.empty() and "FEED" not in feed.subscribers
+    assert snapshot["seq"] == 4 and snapshot["asks"] == [[50, 1], [51, 1], [52, 1], [53, 1]]
+
+
+def test_unknown_ticker_snapshot_is_empty():
+    assert json.loads(OrderBookFeed(2, RESNAPSHOT).snapshot("NOBOOK")) == {
+        "type": "snapshot", "ticker": "NOBOOK", "seq": 0, "bids": [], "asks": []}
@@ -0,0 +1,119 @@
+import uuid
+
+import pytest
+
+from src.backend.engine.matching import BookOrder, OrderBook
+from src.backend.server.models import Direction
+
+
+def order(user_id, direction, qty, price=None):
+    return BookOrder(uuid.uuid4(), user_id, direction, qty, price)
+
+
+def test_better_price_matches_first(alice, bob):
+    book = OrderBook("MEM")
+    expensive = order(alice, Direction.SELL, 5, 52)
+    cheap = order(alice, Direction.SELL, 5, 50)
+    book.submit(expensive)
+    book.submit(cheap)
+    fills = book.submit(order(bob, Direction.BUY, 7, 52))
+    assert [(fill.maker.id, fill.price, fill.amount) for fill in fills] == [(cheap.id, 50, 5), (expensive.id, 52, 2)]
+
+
+def test_same_price_matches_in_arrival_order(alice, bob):
+    book = OrderBook("MEM")
+    first, second = order(alice, Direction.BUY, 3, 40), order(bob, Direction.BUY, 3, 40)
+    book.submit(first)
+    book.submit(second)
+    fills = book.submit(order(alice, Direction.SELL, 4, 40))
+    assert [(fill.maker.id, fill.amount) for fill in fills] == [(first.id, 3), (second.id, 1)]
+    assert book.orders[second.id].remaining == 2
+
+
+def test_limit_does_not_cross_its_price(alice, bob):
+    book = OrderBook("MEM")
+    book.submit(order(alice, Direction.SELL, 5, 51))
+    bid = order(bob, Direction.BUY, 5, 50)
+    assert book.submit(bid) == []
+    assert book.best_bid() == 50 and book.best_ask() == 51
+
+
+def test_partial_fill_rests_remainder(alice, bob):
+    book = OrderBook("MEM")
+    maker = order(alice, Direction.SELL, 4, 50)
+    book.submit(maker)
+    taker = order(bob, Direction.BUY, 10, 55)
+    fills = book.submit(taker)
+    assert [(fill.price, fill.amount) for fill in fills] == [(50, 4)]
+    assert maker.id not in book.orders
+    assert taker.filled == 4 and taker.remaining == 6
+    assert book.depth(5) == ([(55, 6)], [])
+
+
+def test_partially_filled_maker_keeps_its_place(alice, bob):
+    book = OrderBook("MEM")
+    maker, later = order(alice, Direction.SELL, 10, 50), order(alice, Direction.SELL, 10, 50)
+    book.submit(maker)
+    book.submit(later)
+    book.submit(order(bob, Direction.BUY, 4, 50))
+    fills = book.submit(order(bob, Direction.BUY, 8, 50))
+    assert [(fill.maker.id, fill.amount) for fill in fills] == [(maker.id, 6), (later.id, 2)]
+    assert book.depth(1) == ([], [(50, 8)])
+
+
+def test_market_order_remainder_does_not_rest(alice, bob):
+    book = OrderBook("MEM")
+    book.submit(order(alice, Direction.SELL, 3, 50))
+    market = order(bob, Direction.BUY, 5)
+    fills = book.submit(market)
+    assert sum(fill.amount for fill in fills) == 3 and market.remaining == 2
+    assert market.id not in book.orders
+    assert book.levels() == (0, 0)
+
+
+def test_cancel_updates_depth(alice):
+    book = OrderBook("MEM")
+    first, second = order(alice, Direction.BUY, 3, 40), order(alice, Direction.BUY, 2, 40)
+    deeper = order(alice, Direction.BUY, 7, 39)
+    for resting in (first, second, deeper):
+        book.submit(resting)
+    assert book.depth(5) == ([(40, 5), (39, 7)], [])
+    assert book.cancel(first.id) is first
+    assert book.depth(5) == ([(40, 2), (39, 7)], [])
+    book.cancel(second.id)
+    assert book.depth(5) == ([(39, 7)], []) and book.best_bid() == 39
+    assert book.cancel(second.id) is None
+
+
+def test_depth_is_best_first_and_limited(alice):
+    book = OrderBook("MEM")
+    for price in (53, 51, 52, 54):
+        book.submit(order(alice, Direction.SELL, price - 50, price))
+    for price in (48, 49, 47):
+        book.submit(order(alice, Direction.BUY, 1, price))
+    assert book.depth(2) == ([(49, 1), (48, 1)], [(51, 1), (52, 2)])
+    assert book.depth(0) == ([], [])
+
+
+def test_listeners_get_changed_levels(alice, bob):
+    changes = []
+    book = OrderBook("MEM", [lambda book, bids, asks: changes.append((book.seq, bids, asks))])
+    maker = order(alice, Direction.SELL, 5, 50)
+    book.submit(maker)
+    book.submit(order(bob, Direction.BUY, 5, 50))
+    assert changes == [(1, [], [(50, 5)]), (2, [], [(50, 0)])]
+
+
+def test_buyable_respects_budget(alice, bob):
+    book = OrderBook("MEM")
+    book.submit(order(alice, Direction.SELL, 5, 10))
+    book.submit(order(alice, Direction.SELL, 5, 20))
+    assert book.buyable(8, 1000) == 8
+    assert book.buyable(8, 95) == 7
+    assert book.buyable(20, 1000) == 10
+
+
+@pytest.mark.parametrize("qty, price", [(0, 50), (-1, 50), (5, 0), (5, -3)])
+def test_non_positive_orders_are_rejected(alice, qty, price):
+    with pytest.raises(ValueError):
+        OrderBook("MEM").submit(order(alice, Direction.SELL, qty, price))
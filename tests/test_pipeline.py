@@ -0,0 +1,81 @@
+import asyncio
+
+from src.backend.database.pipeline import Batch, WritePipeline
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+def test_merge_folds_updates_and_keeps_last_balance(alice):
+    merged = Batch.merge([
+        Batch(orders=[{"id": 1, "filled": 0, "status": "NEW"}], balances=[{"user_id": alice, "ticker": "MEM",
+                                                                          "amount": 5}]),
+        Batch(updates=[{"id": 1, "filled": 3, "status": "PARTIALLY_EXECUTED"}, {"id": 2, "status": "CANCELLED"}],
+              trades=[{"id": "t1"}]),
+        Batch(updates=[{"id": 2, "filled": 4}], trades=[{"id": "t2"}],
+              balances=[{"user_id": alice, "ticker": "MEM", "amount": 2}])])
+    # обновление заявки из этой же пачки попадает прямо в ее строку для insert
+    assert merged.orders == [{"id": 1, "filled": 3, "status": "PARTIALLY_EXECUTED"}]
+    assert merged.updates == [{"id": 2, "status": "CANCELLED", "filled": 4}]
+    assert merged.trades == [{"id": "t1"}, {"id": "t2"}]
+    assert merged.balances == [{"user_id": alice, "ticker": "MEM", "amount": 2}]
+
+
+def test_merge_does_not_change_source_rows():
+    row = {"id": 1, "filled": 0}
+    Batch.merge([Batch(orders=[row]), Batch(updates=[{"id": 1, "filled": 1}])])
+    assert row == {"id": 1, "filled": 0}
+
+
+class Database:
+    def __init__(self, bad=()):
+        self.bad = set(bad)
+        self.commits = []
+
+    async def __call__(self, batch):
+        ids = [row["id"] for row in batch.orders]
+        if self.bad & set(ids):
+            raise ValueError("rejected")
+        self.commits.append(ids)
+
+
+def test_one_commit_per_window():
+    async def scenario():
+        database = Database()
+        pipeline = WritePipeline(0.05, 100)
+        pipeline.start(database)
+        await asyncio.gather(*(pipeline.submit(Batch(orders=[{"id": number}])) for number in range(5)))
+        await pipeline.stop()
+        return database, pipeline
+
+    database, pipeline = run(scenario())
+    assert database.commits == [[0, 1, 2, 3, 4]]
+    assert (pipeline.commits, pipeline.batches) == (1, 5)
+
+
+def test_max_batch_splits_commits():
+    async def scenario():
+        database = Database()
+        pipeline = WritePipeline(0.05, 2)
+        pipeline.start(database)
+        await asyncio.gather(*(pipeline.submit(Batch(orders=[{"id": number}])) for number in range(5)))
+        await pipeline.stop()
+        return database
+
+    assert run(scenario()).commits == [[0, 1], [2, 3], [4]]
+
+
+def test_failed_batch_does_not_fail_the_others():
+    async def scenario():
+        database = Database(bad={1})
+        pipeline = WritePipeline(0.05, 100)
+        pipeline.start(database)
+        futures = [pipeline.submit(Batch(orders=[{"id": number}])) for number in range(3)]
+        results = await asyncio.gather(*futures, return_exceptions=True)
+        await pipeline.stop()
+        return database, results
+
+    database, results = run(scenario())
+    assert database.commits == [[0], [2]]
+    assert results[0] is None and isinstance(results[1], ValueError) and results[2] is None
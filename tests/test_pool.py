@@ -0,0 +1,44 @@
+import asyncio
+
+import pytest
+import sqlalchemy.exc
+from sqlalchemy.util import greenlet_spawn
+
+from src.backend.database import database
+from src.backend.database.database import TimedPool, make_engine
+
+
+class Connection:
+    def rollback(self):
+        pass
+
+    def close(self):
+        pass
+
+
+def test_engine_pool_follows_settings(monkeypatch):
+    for name, value in (("DB_POOL_SIZE", 7), ("DB_MAX_OVERFLOW", 3), ("DB_POOL_TIMEOUT", 2.5),
+                        ("DB_POOL_RECYCLE", 600), ("DB_POOL_PRE_PING", True)):
+        monkeypatch.setattr(database.settings, name, value)
+    pool = make_engine("postgresql+asyncpg://exchange@localhost/exchange", "primary").pool
+    assert isinstance(pool, TimedPool) and pool.logging_name == "primary"
+    assert (pool.size(), pool._max_overflow, pool.timeout(), pool._recycle, pool._pre_ping) == (7, 3, 2.5, 600, True)
+
+
+def test_pool_reports_checkout_wait(monkeypatch):
+    waits = []
+    monkeypatch.setattr(TimedPool, "wait_listeners", [lambda name, seconds: waits.append((name, seconds))])
+    pool = TimedPool(Connection, pool_size=1, max_overflow=0, timeout=0.01, logging_name="test")
+
+    def checkouts():
+        connection = pool.connect()
+        with pytest.raises(sqlalchemy.exc.TimeoutError):
+            # соединение занято, а переполнение запрещено: ожидание заканчивается ошибкой и тоже замеряется
+            pool.connect()
+        connection.close()
+        pool.connect().close()
+
+    # асинхронный пул ждет соединения через await_only, как внутри AsyncSession
+    asyncio.run(greenlet_spawn(checkouts))
+    assert [name for name, _ in waits] == ["test"] * 3
+    assert waits[1][1] >= 0.01
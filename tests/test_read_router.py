@@ -0,0 +1,38 @@
+import pytest
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from src.backend.database import database
+from src.backend.database.database import ReadRouter
+
+PRIMARY = object()
+
+
+@pytest.fixture
+def replicas():
+    return [create_async_engine(f"postgresql+asyncpg://exchange@replica-{number}/exchange") for number in range(2)]
+
+
+def test_without_replicas_everything_reads_primary(alice):
+    router = ReadRouter(lambda: PRIMARY, [], 5)
+    router.pin(alice)
+    assert router(alice) is PRIMARY and router() is PRIMARY
+    assert router.pins == {} and router.routed == {"primary": 2, "pinned": 0, "replica": 0}
+
+
+def test_reads_rotate_over_replicas(replicas, alice):
+    router = ReadRouter(lambda: PRIMARY, replicas, 5)
+    binds = [router(alice).bind for _ in range(4)]
+    assert binds == [replicas[1], replicas[0], replicas[1], replicas[0]]
+    assert router.routed["replica"] == 4
+
+
+def test_pinned_user_reads_primary_until_pin_expires(monkeypatch, replicas, alice, bob):
+    now = [1000.0]
+    monkeypatch.setattr(database.time, "monotonic", lambda: now[0])
+    router = ReadRouter(lambda: PRIMARY, replicas, 5)
+    router.pin(alice)
+    assert router(alice) is PRIMARY
+    assert router(bob) is not PRIMARY and router() is not PRIMARY
+    now[0] += 5.1
+    assert router(alice) is not PRIMARY
+    assert router.routed == {"primary": 0, "pinned": 1, "replica": 3}
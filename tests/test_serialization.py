@@ -0,0 +1,49 @@
+import datetime
+import json
+import uuid
+from types import SimpleNamespace
+
+import pytest
+
+from models import LimitOrder, MarketOrder, Transaction
+from src.backend.database.database import Direction, OrderStatus
+from src.backend.server.api import FastJSONResponse, order_json
+
+
+class DriverUUID(uuid.UUID):
+    """Как asyncpg: свой подкласс UUID"""
+
+
+NOW = datetime.datetime(2026, 3, 1, 12, 0, 0, 5, tzinfo=datetime.timezone.utc)
+
+
+def row(price):
+    return SimpleNamespace(id=DriverUUID(str(uuid.uuid4())), status=OrderStatus.PARTIALLY_EXECUTED,
+                           user_id=uuid.uuid4(), timestamp=NOW, direction=Direction.BUY, ticker="MEM", qty=5,
+                           price=price, filled=2)
+
+
+def dumped(content):
+    return json.loads(FastJSONResponse(content).body)
+
+
+@pytest.mark.parametrize("model, price", [(LimitOrder, 40), (MarketOrder, None)])
+def test_order_matches_response_model(model, price):
+    order = row(price)
+    body = {"direction": order.direction, "ticker": order.ticker, "qty": order.qty}
+    extra = {}
+    if price is not None:
+        body["price"], extra["filled"] = price, order.filled
+    expected = model(id=order.id, status=order.status, user_id=order.user_id, timestamp=order.timestamp, body=body,
+                     **extra)
+    assert dumped([order_json(order)]) == [json.loads(expected.model_dump_json())]
+
+
+def test_timestamps_use_z_suffix_like_pydantic():
+    trade = {"ticker": "MEM", "amount": 1, "price": 50, "timestamp": NOW}
+    assert FastJSONResponse([trade]).body.decode() == "[" + Transaction(**trade).model_dump_json() + "]"
+
+
+def test_unknown_types_are_refused():
+    with pytest.raises(TypeError):
+        FastJSONResponse({"value": object()})
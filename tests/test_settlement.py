@@ -0,0 +1,126 @@
+import asyncio
+import json
+
+import pytest
+import sqlalchemy.exc
+
+from src.backend.database.pipeline import Batch
+from src.backend.database.settlement import SettlementQueue
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+def batch(name):
+    return Batch(orders=[{"id": name}])
+
+
+class Database:
+    """save для очереди: помнит записанные заявки, отказывает ошибками из failures"""
+
+    def __init__(self, failures=()):
+        self.failures = list(failures)
+        self.saved = []
+        self.calls = 0
+
+    async def __call__(self, batch):
+        self.calls += 1
+        if self.failures:
+            failure = self.failures.pop(0)
+            if failure is not None:
+                raise failure
+        self.saved.extend(row["id"] for row in batch.orders)
+
+
+def lost_connection():
+    return sqlalchemy.exc.OperationalError("insert", {}, ConnectionResetError())
+
+
+def bad_data():
+    return sqlalchemy.exc.IntegrityError("insert", {}, Exception("foreign key"))
+
+
+def queue(max_retries=3):
+    return SettlementQueue(1, 100, 1000, 0, max_retries)
+
+
+def test_lost_connection_is_retried(tmp_path, alice):
+    async def scenario():
+        settlement, database = queue(), Database([lost_connection(), OSError()])
+        settlement.start(database, str(tmp_path / "dead.jsonl"))
+        await settlement.submit("MEM", batch("a"), [alice])
+        await settlement.stop()
+        return settlement, database
+
+    settlement, database = run(scenario())
+    assert database.saved == ["a"] and settlement.retries == 2 and settlement.failed == 0
+
+
+def test_data_error_goes_to_dead_letter_without_retries(tmp_path, alice, bob):
+    async def scenario():
+        # общая пачка и первое решение отвергнуты, второе проходит при записи по одной
+        settlement, database = queue(), Database([bad_data(), bad_data()])
+        settlement.start(database, str(tmp_path / "dead.jsonl"))
+        rejected = settlement.submit("MEM", batch("a"), [alice])
+        accepted = settlement.submit("MEM", batch("b"), [bob])
+        await settlement.stop()
+        with pytest.raises(sqlalchemy.exc.IntegrityError):
+            await rejected
+        await accepted
+        return settlement, database
+
+    settlement, database = run(scenario())
+    assert database.saved == ["b"] and settlement.retries == 0 and settlement.failed == 1
+    [record] = [json.loads(line) for line in open(tmp_path / "dead.jsonl")]
+    assert record["orders"] == [{"id": "a"}] and record["users"] == [str(alice)]
+
+
+def test_unexpected_error_is_not_retried(tmp_path, alice):
+    async def scenario():
+        settlement, database = queue(), Database([ValueError("bug"), ValueError("bug")])
+        settlement.start(database, str(tmp_path / "dead.jsonl"))
+        future = settlement.submit("MEM", batch("a"), [alice])
+        await settlement.stop()
+        with pytest.raises(ValueError):
+            await future
+        return settlement, database
+
+    settlement, database = run(scenario())
+    assert database.calls == 2 and settlement.retries == 0 and settlement.failed == 1
+
+
+def test_retries_are_bounded(tmp_path, alice, bob):
+    async def scenario():
+        settlement, database = queue(max_retries=2), Database([lost_connection()] * 3)
+        settlement.start(database, str(tmp_path / "dead.jsonl"))
+        first = settlement.submit("MEM", batch("a"), [alice])
+        second = settlement.submit("MEM", batch("b"), [bob])
+        await settlement.stop()
+        for future in (first, second):
+            with pytest.raises(sqlalchemy.exc.OperationalError):
+                await future
+        await asyncio.wait_for(settlement.settled(alice), 1)
+        return settlement, database
+
+    settlement, database = run(scenario())
+    # после трех неудачных попыток решения уходят в dead letter, не записываясь по одной
+    assert database.calls == 3 and settlement.failed == 2 and settlement.backlog == 0
+    assert len(open(tmp_path / "dead.jsonl").readlines()) == 2
+
+
+def test_settled_waits_for_users_decisions(tmp_path, alice, bob):
+    async def scenario():
+        settlement, database = queue(), Database([lost_connection()])
+        settlement.retry_interval = 0.05
+        settlement.start(database, str(tmp_path / "dead.jsonl"))
+        await settlement.settled(bob)
+        settlement.submit("MEM", batch("a"), [alice])
+        settlement.submit("DOGE", batch("b"), [alice, bob])
+        await settlement.settled(alice)
+        saved = list(database.saved)
+        await settlement.barrier()
+        await settlement.stop()
+        return saved
+
+    assert run(scenario()) == ["a", "b"]
@@ -0,0 +1,42 @@
+import datetime
+
+from src.backend.server.summary import BUCKET, WINDOW, MarketSummary
+
+START = 1_772_366_400  # 2026-03-01 12:00:00 UTC
+
+
+def trade(seconds, price, amount):
+    return {"price": price, "amount": amount,
+            "timestamp": datetime.datetime.fromtimestamp(START + seconds, datetime.timezone.utc)}
+
+
+def test_window_summary():
+    summary = MarketSummary()
+    summary.publish("SUMMARY", [trade(0, 100, 1), trade(30, 120, 2), trade(90, 90, 3), trade(3600, 110, 4)])
+    row = summary.summary("SUMMARY", START + 3600)
+    assert (row["last"], row["high"], row["low"], row["volume"]) == (110, 120, 90, 10)
+    assert (row["change"], row["change_percent"]) == (10, 10.0)
+    assert row["best_bid"] is None and row["best_ask"] is None
+
+
+def test_expired_buckets_leave_the_window():
+    summary = MarketSummary()
+    summary.publish("SUMMARY", [trade(0, 150, 1), trade(BUCKET, 80, 2), trade(2 * BUCKET, 100, 3)])
+    # первая корзина вышла из окна: ее максимум и объем больше не считаются
+    row = summary.summary("SUMMARY", START + WINDOW + BUCKET)
+    assert (row["high"], row["low"], row["volume"], row["change"]) == (100, 80, 5, 20)
+    row = summary.summary("SUMMARY", START + WINDOW + 3 * BUCKET)
+    assert (row["last"], row["high"], row["volume"], row["change"]) == (100, None, 0, None)
+
+
+def test_load_fills_window_from_candles():
+    summary = MarketSummary()
+    candles = [{"ticker": "SUMMARY", "timestamp": datetime.datetime.fromtimestamp(START, datetime.timezone.utc),
+                "open": 40, "high": 70, "low": 30, "close": 60, "volume": 9},
+               {"ticker": "GONE", "timestamp": datetime.datetime.fromtimestamp(START, datetime.timezone.utc),
+                "open": 1, "high": 1, "low": 1, "close": 1, "volume": 1}]
+    summary.load(["SUMMARY", "QUIET"], candles, {"SUMMARY": 65})
+    row = summary.summary("SUMMARY", START + BUCKET)
+    assert (row["last"], row["high"], row["low"], row["volume"], row["change"]) == (65, 70, 30, 9, 25)
+    assert summary.summary("QUIET", START)["volume"] == 0
+    assert summary.summary("GONE") is None
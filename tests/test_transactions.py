@@ -0,0 +1,62 @@
+import asyncio
+import datetime
+import uuid
+
+import httpx
+
+from src.backend.database.orm import OrderORM, PublicORM, decode_cursor
+from src.backend.engine.matching import BookOrder, OrderBook
+from src.backend.server.api import app
+from src.backend.server.marketdata import trade_tape
+from src.backend.server.models import Direction
+
+NOW = datetime.datetime(2026, 3, 1, 12, 0, tzinfo=datetime.timezone.utc)
+
+
+def trade(number):
+    return {"id": uuid.uuid4(), "ticker": "MEM", "amount": number, "price": 50,
+            "timestamp": NOW + datetime.timedelta(seconds=number)}
+
+
+def get(path, params=None):
+    async def request():
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as http:
+            return await http.get(path, params=params)
+
+    return asyncio.run(request())
+
+
+def test_trades_of_one_decision_keep_execution_order(alice, bob):
+    book = OrderBook("MEM")
+    for price in (50, 51, 52):
+        book.submit(BookOrder(uuid.uuid4(), alice, Direction.SELL, 1, price))
+    fills = book.submit(BookOrder(uuid.uuid4(), bob, Direction.BUY, 3, 52))
+    _, trades = OrderORM._settle("MEM", fills, (), NOW)
+    assert [trade["price"] for trade in trades] == [50, 51, 52]
+    # ключ (timestamp, id) курсоров растет в порядке исполнения, даже если сделки из одного решения
+    assert [trade["timestamp"] for trade in trades] == sorted({trade["timestamp"] for trade in trades})
+    assert [trade["id"] for trade in OrderORM._settle("MEM", fills, (), NOW)[1]] == [trade["id"] for trade in trades]
+
+
+def test_latest_trades_come_from_tape_with_cursors(monkeypatch):
+    monkeypatch.setattr(trade_tape, "trades", {})
+    monkeypatch.setattr(trade_tape, "seq", {})
+    trades = [trade(number) for number in range(1, 6)]
+    trade_tape.load(trades)
+    response = get("/api/v1/public/transactions/MEM", {"limit": 3})
+    assert [row["amount"] for row in response.json()] == [5, 4, 3]
+    assert decode_cursor(response.headers["X-Before-Cursor"]) == (trades[2]["timestamp"], trades[2]["id"])
+    assert decode_cursor(response.headers["X-After-Cursor"]) == (trades[4]["timestamp"], trades[4]["id"])
+
+
+def test_cursor_pages_go_to_database(monkeypatch):
+    calls = []
+
+    async def transactions(ticker, limit, before=None, after=None, start=None, end=None):
+        calls.append((ticker, limit, before, after, start))
+        return []
+
+    monkeypatch.setattr(PublicORM, "transactions", transactions)
+    response = get("/api/v1/public/transactions/MEM", {"before": "cursor", "from": NOW.isoformat()})
+    assert response.json() == [] and "X-Before-Cursor" not in response.headers
+    assert calls == [("MEM", 10, "cursor", None, NOW)]